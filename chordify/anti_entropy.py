@@ -0,0 +1,129 @@
+# anti_entropy.py
+import threading
+import time
+from transport import transport
+from merkle import MERKLE_DEPTH, range_digests, bucket_digests
+
+ANTI_ENTROPY_INTERVAL = 30 # Seconds between two periodic anti-entropy rounds of a node (0 disables them)
+ANTI_ENTROPY_DELAY = 2 # Seconds a round triggered by a membership change waits, so a burst of changes runs one round
+ANTI_ENTROPY_TIMEOUT = 10 # Seconds an anti-entropy request may take
+
+# Merkle-tree anti-entropy between a primary and its replica holders: the trees are compared from the root down and
+# only the keys of the differing buckets are repaired.
+
+class AntiEntropy:
+    def __init__(self, node, interval=ANTI_ENTROPY_INTERVAL):
+        self.node = node
+        self.interval = interval
+        self.wakeup = threading.Event() #Set to run a round before the interval is over
+        self.lock = threading.Lock() #One round at a time
+        self.started = False
+        self.rounds = 0
+        self.in_sync = 0 #Holders whose range digest matched at the first comparison
+        self.compared = 0 #Tree nodes compared
+        self.differing_buckets = 0
+        self.keys_sent = 0
+        self.keys_deleted = 0
+        self.failures = 0
+        self.last_round_ms = 0.0
+
+    def configure(self, interval):
+        self.interval = interval
+
+    def start(self):
+        if not self.started:
+            self.started = True
+            threading.Thread(target=self._loop, daemon=True).start()
+
+    # Run a round soon, e.g. after a membership change.
+    def trigger(self):
+        self.start()
+        self.wakeup.set()
+
+    def _loop(self):
+        while True:
+            if self.wakeup.wait(self.interval or None):
+                time.sleep(ANTI_ENTROPY_DELAY)
+                self.wakeup.clear()
+            try:
+                self.run()
+            except Exception as e:
+                print(f"[{self.node.ip}:{self.node.port}] Error in anti-entropy round: {e}")
+
+    # Compare the primary ranges of this node with each of their replica holders and repair the ones that differ.
+    def run(self):
+        node = self.node
+        if node.replication_factor <= 1:
+            return
+        shared = {} #Holder id -> (holder, the ranges it holds replicas of)
+        for start, end in node.primary_ranges():
+            holders = node._replica_holders(node.replication_factor - 1, end)
+            if holders is None:
+                holders = [node.successor] if node.successor.get("id", node.id) != node.id else []
+            for holder in holders:
+                shared.setdefault(holder["id"], (holder, []))[1].append((start, end))
+        with self.lock:
+            began = time.perf_counter()
+            for holder, ranges in shared.values():
+                try:
+                    self.sync(holder, ranges)
+                except Exception as e:
+                    self.failures += 1
+                    print(f"[{node.ip}:{node.port}] Error in anti-entropy with {holder['ip']}:{holder['port']}: {e}")
+            self.rounds += 1
+            self.last_round_ms = round((time.perf_counter() - began) * 1000, 2)
+
+    def _post(self, holder, endpoint, payload):
+        response = transport.post(f"http://{holder['ip']}:{holder['port']}{endpoint}", json=payload, timeout=ANTI_ENTROPY_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    # Bring the replicas of the keys in the (start, end] ranges at holder in line with the data_store of this node.
+    def sync(self, holder, ranges):
+        node = self.node
+        store = node.data_store
+        leaves = 1 << MERKLE_DEPTH
+        pending, buckets = [1], []
+        while pending:
+            remote = self._post(holder, "/merkle_digests", {"nodes": pending, "ranges": ranges})["digests"]
+            local = range_digests(store, pending, ranges)
+            differing = [i for i, mine, theirs in zip(pending, local, remote) if mine != theirs]
+            self.compared += len(pending)
+            buckets.extend(i - leaves for i in differing if i >= leaves)
+            pending = [child for i in differing if i < leaves for child in (2 * i, 2 * i + 1)]
+        if not buckets:
+            self.in_sync += 1
+            return
+
+        remote = self._post(holder, "/merkle_keys", {"buckets": buckets, "ranges": ranges})["keys"]
+        version = node.clock.now() # Every write applied after the keys are read gets a newer version
+        local = bucket_digests(store, buckets, ranges)
+        self.differing_buckets += len(buckets)
+        if node.consistency_mode == "linearizability":
+            sent = node.repair_through_chain([key for key, digest in local.items() if remote.get(key) != digest])
+            self.keys_sent += sent
+            print(f"[{node.ip}:{node.port}] Anti-entropy with {holder['ip']}:{holder['port']}: {len(buckets)} buckets differed, sent {sent} keys through the chain")
+            return
+        values = {}
+        for key, digest in local.items():
+            value = store.get(key)
+            if remote.get(key) != digest and value is not None:
+                values[key] = value.to_list()
+        deleted = [key for key in remote if key not in local]
+        self._post(holder, "/merkle_repair", {"set": values, "delete": deleted, "version": version})
+        self.keys_sent += len(values)
+        self.keys_deleted += len(deleted)
+        print(f"[{node.ip}:{node.port}] Anti-entropy with {holder['ip']}:{holder['port']}: {len(buckets)} buckets differed, sent {len(values)} keys, deleted {len(deleted)}")
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "rounds": self.rounds,
+            "in_sync": self.in_sync,
+            "compared": self.compared,
+            "differing_buckets": self.differing_buckets,
+            "keys_sent": self.keys_sent,
+            "keys_deleted": self.keys_deleted,
+            "failures": self.failures,
+            "last_round_ms": self.last_round_ms
+        }
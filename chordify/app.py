@@ -2,7 +2,14 @@
 import argparse
 from flask import Flask
 from flask_cors import CORS  # Import flask-cors
-from node import Node
+from node import Node, CONSISTENCY_MODES, RESPONSE_MODES, READ_MODES
+from transport import transport, CONNECT_TIMEOUT, READ_TIMEOUT
+from persistence import PersistenceEngine, FSYNC_POLICIES
+from chain import CHAIN_MAX_BATCH, CHAIN_MAX_IN_FLIGHT
+from replication import REPLICATION_WORKERS, REPLICATION_MAX_BATCH
+from quorum import QUORUM_READ, QUORUM_WRITE, quorum_error
+from anti_entropy import ANTI_ENTROPY_INTERVAL
+from vnodes import VNODES
 from routes.join import join_bp
 from routes.depart import depart_bp
 from routes.overlay import overlay_bp
@@ -35,13 +42,56 @@ if __name__ == '__main__':
     parser.add_argument("--bootstrap", action="store_true", help="Ενεργοποίηση ως bootstrap κόμβος")
     parser.add_argument("--bootstrap_ip", type=str, default="127.0.0.1", help="IP του bootstrap κόμβου")
     parser.add_argument("--bootstrap_port", type=int, default=8000, help="Θύρα του bootstrap κόμβου")
+    parser.add_argument("--vnodes", type=int, default=VNODES, help="Ring positions (virtual nodes) of this node; more tokens even out the key shares")
     parser.add_argument("--replication_factor", type=int, default=1, help="Replication factor for data")
-    parser.add_argument("--consistency_mode", type=str, choices=["linearizability", "eventual"], default="strong", help="Consistency mode for data replication")
+    parser.add_argument("--consistency_mode", type=str, choices=CONSISTENCY_MODES, default="strong", help="Consistency mode for data replication")
+    parser.add_argument("--response_mode", type=str, choices=RESPONSE_MODES, default="callback", help="How final results reach the origin node: callback POST or directly through the HTTP responses")
+    parser.add_argument("--read_mode", type=str, choices=READ_MODES, default="tail", help="Where linearizable reads are answered: at the chain tail, or at any node of the chain with CRAQ apportioned reads")
+    parser.add_argument("--read_quorum", type=int, default=QUORUM_READ, help="Replies a read waits for in the quorum consistency mode (R)")
+    parser.add_argument("--write_quorum", type=int, default=QUORUM_WRITE, help="Acknowledgements a write waits for in the quorum consistency mode (W)")
+    parser.add_argument("--runtime", type=str, choices=["asyncio", "threaded"], default="asyncio", help="Run forwards, callbacks and replication as coroutines on an event loop (asyncio) or as blocking calls (threaded)")
+    parser.add_argument("--pool_size", type=int, default=10, help="Keep-alive connections kept per peer node")
+    parser.add_argument("--connect_timeout", type=float, default=CONNECT_TIMEOUT, help="Default connect timeout (seconds) for inter-node requests")
+    parser.add_argument("--read_timeout", type=float, default=READ_TIMEOUT, help="Default read timeout (seconds) for inter-node requests")
+    parser.add_argument("--chain_batch", type=int, default=CHAIN_MAX_BATCH, help="Linearizable writes sent down the chain in one request")
+    parser.add_argument("--chain_in_flight", type=int, default=CHAIN_MAX_IN_FLIGHT, help="Chain batches a node may have in flight per successor")
+    parser.add_argument("--replication_workers", type=int, default=REPLICATION_WORKERS, help="Threads sending asynchronous replication batches (eventual consistency)")
+    parser.add_argument("--replication_batch", type=int, default=REPLICATION_MAX_BATCH, help="Keys sent to the successor in one asynchronous replication request")
+    parser.add_argument("--anti_entropy_interval", type=float, default=ANTI_ENTROPY_INTERVAL, help="Seconds between Merkle-tree comparisons of a node's keys with its replica holders (0: only after membership changes)")
+    parser.add_argument("--data_dir", type=str, default=None, help="Directory for the write-ahead log and snapshots of the node stores (default: in memory only)")
+    parser.add_argument("--fsync", type=str, choices=FSYNC_POLICIES, default="interval", help="When the write-ahead log is fsynced: on every group commit (always), periodically (interval) or never")
+    parser.add_argument("--fsync_interval", type=float, default=0.05, help="Seconds between fsyncs with --fsync interval")
+    parser.add_argument("--snapshot_every", type=int, default=100000, help="Log records between two snapshots (0 disables automatic snapshots)")
     args = parser.parse_args()
+    if args.consistency_mode == "quorum" and quorum_error(args.read_quorum, args.write_quorum, args.replication_factor):
+        parser.error(quorum_error(args.read_quorum, args.write_quorum, args.replication_factor))
+
+    # Configure the shared connection pools used for all inter-node requests
+    transport.configure(pool_size=args.pool_size, connect_timeout=args.connect_timeout, read_timeout=args.read_timeout)
 
     # Initialize the Node instance
-    node = Node(ip=args.ip, port=args.port, is_bootstrap=args.bootstrap, consistency_mode=args.consistency_mode, replication_factor=args.replication_factor)
-    
+    node = Node(ip=args.ip, port=args.port, is_bootstrap=args.bootstrap, consistency_mode=args.consistency_mode, replication_factor=args.replication_factor, response_mode=args.response_mode, read_mode=args.read_mode, vnodes=args.vnodes)
+
+    # Batching of the chain replication pipeline (linearizability)
+    node.chain.configure(args.chain_batch, args.chain_in_flight)
+
+    # Worker pool and batch size of the asynchronous replication queue (eventual consistency)
+    node.replication.configure(args.replication_workers, args.replication_batch)
+
+    # Read and write quorums (R and W) of the quorum consistency mode
+    node.quorum.configure(args.read_quorum, args.write_quorum)
+
+    # Periodic Merkle-tree anti-entropy with the replica holders
+    node.anti_entropy.configure(args.anti_entropy_interval)
+
+    # Recover the stores from disk before joining, so a node restarted after a crash comes back with its keys
+    if args.data_dir:
+        node.enable_persistence(PersistenceEngine(args.data_dir, fsync=args.fsync, fsync_interval=args.fsync_interval, snapshot_every=args.snapshot_every))
+
+    # Start the asyncio runtime before joining, so the replication triggered by the join already uses it
+    if args.runtime == "asyncio":
+        node.start_runtime()
+
     # Store bootstrap info for non-bootstrap nodes
     if not node.is_bootstrap:
         node.bootstrap_ip = args.bootstrap_ip
@@ -57,6 +107,7 @@ if __name__ == '__main__':
             "ip": node.ip,
             "port": node.port,
             "id": node.id,
+            "tokens": node.tokens,
             "successor": {},
             "predecessor": {}
         }
@@ -65,6 +116,9 @@ if __name__ == '__main__':
         node.consistency_mode = "eventual"
         app.config['RING'] = [bootstrap_info]
 
+    # Start the anti-entropy rounds once the node has its place in the ring
+    node.anti_entropy.start()
+
     # Optionally, set the node instance in app.config or a dedicated module so that
     # the routes can access it.
     app.config['NODE'] = node
@@ -0,0 +1,197 @@
+# chain.py
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from transport import transport
+
+CHAIN_MAX_BATCH = 64 # Writes sent to the successor in one request
+CHAIN_MAX_IN_FLIGHT = 1 # Batches a link may have sent and not yet seen applied (writes queue up meanwhile)
+CHAIN_ORDER_TIMEOUT = 10 # Seconds a batch waits for the batches before it on its link
+CHAIN_TIMEOUT = 60 # Seconds a write waits for its chain to commit
+
+# Pipelined chain replication for linearizability: every node sends its writes to a successor in numbered batches.
+# An entry is a dict with op, key, value, replication_count (replicas left after the receiver), origin and final_result.
+
+class ChainLink:
+    def __init__(self, pipeline, target):
+        self.pipeline = pipeline
+        self.label = f"{pipeline.node.ip}:{pipeline.node.port}" #Sending node, for the logs and the link ids
+        self.url = f"http://{target['ip']}:{target['port']}/chain_pipeline"
+        self.link_id = self._new_link_id() #Identifies the ordered stream at the receiver; renewed after a failure
+        self.next_seq = 0 #Sequence number of the next batch on this link
+        self.queue = deque() #Entries not sent yet, in order
+        self.in_flight = 0
+        self.cond = threading.Condition()
+        self.batches = 0
+        self.entries = 0
+        self.failures = 0
+        self.closed = False #Set when the target left or rejoined the ring; the link is replaced by a new one
+        self.executor = ThreadPoolExecutor(max_workers=pipeline.max_in_flight)
+        threading.Thread(target=self._sender, daemon=True).start()
+
+    def _new_link_id(self):
+        return f"{self.label}/{uuid.uuid4().hex[:8]}"
+
+    # Queue writes for the successor, in order.
+    def submit(self, entries):
+        with self.cond:
+            self.queue.extend(entries)
+            self.cond.notify_all()
+
+    # Stop the link: the writes not sent yet fail, the sender thread ends.
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def _sender(self):
+        while True:
+            with self.cond:
+                while not self.closed and (not self.queue or self.in_flight >= self.pipeline.max_in_flight):
+                    self.cond.wait()
+                if self.closed:
+                    unsent = list(self.queue)
+                    self.queue.clear()
+                    break
+                batch = [self.queue.popleft() for _ in range(min(self.pipeline.max_batch, len(self.queue)))]
+                link_id, seq = self.link_id, self.next_seq
+                self.next_seq += 1
+                self.in_flight += 1
+            self.executor.submit(self._send_batch, link_id, seq, batch)
+        self.executor.shutdown(wait=False)
+        if unsent:
+            self.pipeline.node.finish_chain_entries([(entry, chain_failure(entry["final_result"], "the next node left the ring")) for entry in unsent])
+
+    def _send_batch(self, link_id, seq, batch):
+        try:
+            response = transport.post(self.url, json={"link": link_id, "seq": seq, "entries": batch}, timeout=CHAIN_TIMEOUT)
+            response.raise_for_status()
+        except Exception as e:
+            print(f"[{self.label}] Error in chain replication to {self.url}: {e}")
+            with self.cond:
+                self.failures += 1
+                if self.link_id == link_id:
+                    # The receiver may never see this batch: the following ones start a new ordered stream.
+                    self.link_id = self._new_link_id()
+                    self.next_seq = 0
+            self.pipeline.node.finish_chain_entries([(entry, chain_failure(entry["final_result"], e)) for entry in batch])
+        with self.cond:
+            self.in_flight -= 1
+            self.batches += 1
+            self.entries += len(batch)
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "batches": self.batches,
+                "entries": self.entries,
+                "avg_batch": round(self.entries / self.batches, 2) if self.batches else 0.0,
+                "queued": len(self.queue),
+                "in_flight": self.in_flight,
+                "failures": self.failures
+            }
+
+# Result of a write whose chain could not be completed.
+def chain_failure(final_result, error):
+    result = dict(final_result)
+    result["result"] = False
+    result["error"] = f"Chain replication failed: {error}"
+    return result
+
+class ChainPipeline:
+    def __init__(self, node, max_batch=CHAIN_MAX_BATCH, max_in_flight=CHAIN_MAX_IN_FLIGHT):
+        self.node = node
+        self.max_batch = max_batch
+        self.max_in_flight = max_in_flight
+        self.links = {} #(ip, port) of a successor -> ChainLink
+        self.expected = {} #Incoming link id -> sequence number of the next batch to apply (one link per sender)
+        self.waiting = {} #Entry id -> Future of a write whose head waits for the commit
+        self.cond = threading.Condition() #Guards links, expected and waiting
+        self.head_lock = threading.Lock() #Makes the local write at the head and its submission one step
+
+    # Set the batch size and the number of batches in flight per link (links created later use them).
+    def configure(self, max_batch, max_in_flight):
+        self.max_batch = max_batch
+        self.max_in_flight = max_in_flight
+
+    # Send writes through the link to the next node of their chain; the writes for one link keep their order.
+    # With wait=True the head waits for the commits: returns one future per entry, resolved with the tail's final result.
+    def replicate(self, entries, wait=False):
+        futures = []
+        groups = {} #(ip, port) of a link -> (link, entries for it)
+        with self.cond:
+            for entry in entries:
+                successor = self.node.chain_next(self.node.compute_hash(entry["key"]))
+                target = (successor["ip"], successor["port"])
+                link = self.links.get(target)
+                if link is None:
+                    link = ChainLink(self, successor)
+                    self.links[target] = link
+                groups.setdefault(target, (link, []))[1].append(entry)
+                if wait:
+                    entry["head"] = {"ip": self.node.ip, "port": self.node.port}
+                    entry["id"] = uuid.uuid4().hex
+                    futures.append(Future())
+                    self.waiting[entry["id"]] = futures[-1]
+        for link, group in groups.values():
+            link.submit(group)
+        return futures
+
+    # Drop the links to nodes that left or rejoined the ring: a rejoined node is a new process that expects new streams.
+    def drop(self, addresses):
+        with self.cond:
+            links = [self.links.pop(address) for address in addresses if address in self.links]
+        for link in links:
+            link.close()
+
+    # Final result of a write the head waits for (a failure result if the chain does not commit it in time).
+    def result(self, entry, future):
+        try:
+            return future.result(timeout=CHAIN_TIMEOUT)
+        except FutureTimeoutError:
+            return chain_failure(entry["final_result"], "timed out")
+        finally:
+            with self.cond:
+                self.waiting.pop(entry["id"], None)
+
+    # Complete a write the head waits for. Returns False if it is unknown (e.g. timed out).
+    def complete(self, entry_id, final_result):
+        with self.cond:
+            future = self.waiting.pop(entry_id, None)
+        if future is None:
+            return False
+        future.set_result(final_result)
+        return True
+
+    # Handle a batch from a predecessor: wait for its turn on the link, apply it (the node passes the writes on or
+    # commits them), then let the next batch of the link in. Returns False if the batches before it never arrived.
+    def receive(self, link_id, seq, entries):
+        deadline = time.monotonic() + CHAIN_ORDER_TIMEOUT
+        with self.cond:
+            if seq == 0 and link_id not in self.expected:
+                # A new stream of a sender replaces its previous one (link ids are "sender/random")
+                sender = link_id.rsplit("/", 1)[0] + "/"
+                for old in [old for old in self.expected if old.startswith(sender)]:
+                    del self.expected[old]
+                self.expected[link_id] = 0
+            while self.expected.get(link_id, 0) != seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        try:
+            self.node.apply_chain_entries(entries)
+        finally:
+            with self.cond:
+                self.expected[link_id] = seq + 1
+                self.cond.notify_all()
+        return True
+
+    def stats(self):
+        with self.cond:
+            links = dict(self.links)
+            waiting = len(self.waiting)
+        return {"waiting": waiting, "links": {f"{ip}:{port}": link.stats() for (ip, port), link in links.items()}}
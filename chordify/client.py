@@ -7,6 +7,25 @@ from colorama import Fore, Style, init
 # Initialize colorama so ANSI escape sequences work on all platforms.
 init(autoreset=True)
 
+def display_ack_details(resp):
+    """
+    Displays the key, status and commit sequence of an insert/delete acknowledgement.
+    The data store of the responsible node is only part of the response in debug mode (--debug).
+    """
+    print(Fore.CYAN + "Key:" + Style.RESET_ALL, resp.get("key", "N/A"))
+    print(Fore.CYAN + "Status:" + Style.RESET_ALL, resp.get("status", "N/A"))
+    if "commit_seq" in resp:
+        print(Fore.CYAN + "Commit Sequence:" + Style.RESET_ALL, resp["commit_seq"])
+
+    if "data_store" in resp:
+        data_store = resp["data_store"]
+        if data_store:
+            print(Fore.CYAN + "Data Store:" + Style.RESET_ALL)
+            for key, value in data_store.items():
+                print(f"  {key}: {value}")
+        else:
+            print(Fore.CYAN + "Data Store:" + Style.RESET_ALL, "{}")
+
 def display_insert_response(resp):
     """
     Formats and displays the insert response in a user-friendly way.
@@ -17,23 +36,19 @@ def display_insert_response(resp):
     
     addr = resp.get("address", "N/A")
     print(Fore.CYAN + "Address:" + Style.RESET_ALL, addr)
-    
-    data_store = resp.get("data_store", {})
-    if data_store:
-        print(Fore.CYAN + "Data Store:" + Style.RESET_ALL)
-        for key, value in data_store.items():
-            print(f"  {key}: {value}")
-    else:
-        print(Fore.CYAN + "Data Store:" + Style.RESET_ALL, "{}")
+
+    display_ack_details(resp)
     
     result = resp.get("result", None)
     if result is not None:
         print(Fore.CYAN + "Result:" + Style.RESET_ALL, result)
     print()
 
-def insert_cmd(node_addr, key, value):
+def insert_cmd(node_addr, key, value, debug=False):
     url = f"http://{node_addr}/insert"
     payload = {"key": key, "value": value}
+    if debug:
+        payload["debug"] = True
     try:
         response = requests.post(url, json=payload)
         response.raise_for_status()
@@ -43,6 +58,33 @@ def insert_cmd(node_addr, key, value):
         print(Fore.RED + "\n[Error during insert]" + Style.RESET_ALL, e)
         print()
 
+def display_insert_batch_response(resp):
+    """
+    Formats and displays the per-key results of a batch insert.
+    """
+    results = resp.get("results", [])
+    print(Fore.GREEN + f"\n[Batch insert: {resp.get('inserted', 0)}/{len(results)} keys stored]" + Style.RESET_ALL)
+    for r in results:
+        if r.get("result"):
+            line = f"  {r.get('key')}: {r.get('status')} at {r.get('address')}"
+            if "commit_seq" in r:
+                line += f" (commit_seq {r['commit_seq']})"
+            print(line)
+        else:
+            print(Fore.RED + f"  {r.get('key')}: {r.get('error', r.get('message', 'failed'))}" + Style.RESET_ALL)
+    print()
+
+def insert_batch_cmd(node_addr, pairs):
+    url = f"http://{node_addr}/insert_batch"
+    payload = {"items": [{"key": key, "value": value} for key, value in pairs]}
+    try:
+        response = requests.post(url, json=payload)
+        response.raise_for_status()
+        display_insert_batch_response(response.json())
+    except Exception as e:
+        print(Fore.RED + "\n[Error during batch insert]" + Style.RESET_ALL, e)
+        print()
+
 def display_query_response(resp):
     """
     Formats and displays the query response in a user-friendly way.
@@ -58,6 +100,8 @@ def display_query_response(resp):
         print(Fore.CYAN + "Nodes Count:" + Style.RESET_ALL, nodes_count)
         print(Fore.CYAN + "Original Songs Count:" + Style.RESET_ALL, original_songs_count)
         print(Fore.CYAN + "Replica Songs Count:" + Style.RESET_ALL, replica_songs_count)
+        for failed in resp.get("failed_nodes", []):
+            print(Fore.RED + f"No answer from node {failed.get('node')}, its songs are missing:" + Style.RESET_ALL, failed.get("error"))
         print()
         for node, songs in all_songs.items():
             print(Fore.CYAN + f"Node {node}:" + Style.RESET_ALL)
@@ -105,6 +149,41 @@ def query_cmd(node_addr, key):
         print(Fore.RED + "\n[Error during query]" + Style.RESET_ALL, e)
         print()
 
+def scan_cmd(node_addr, include_replicas=False):
+    """
+    Streams all songs of the network ("Query *") from /scan_stream and prints them as they arrive,
+    grouped by the node that stores them.
+    """
+    url = f"http://{node_addr}/scan_stream"
+    params = {"include_replicas": 1 if include_replicas else 0}
+    print(Fore.GREEN + "\n[Query result]" + Style.RESET_ALL)
+    try:
+        with requests.get(url, params=params, stream=True) as response:
+            response.raise_for_status()
+            current = None
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                item = json.loads(line)
+                if item.get("done"):
+                    print("-" * 40)
+                    print(Fore.CYAN + "Songs:" + Style.RESET_ALL, item.get("count", 0))
+                    for failed in item.get("failed_nodes", []):
+                        print(Fore.RED + f"No answer from node {failed.get('node')}, its songs are missing:" + Style.RESET_ALL, failed.get("error"))
+                    break
+                header = (item["node"], item["source"])
+                if header != current:
+                    if current is None or current[0] != item["node"]:
+                        print(Fore.CYAN + f"Node {item['node']}:" + Style.RESET_ALL)
+                    label = "Original Songs:" if item["source"] == "original" else "Replica Songs:"
+                    print("  " + Fore.YELLOW + label + Style.RESET_ALL)
+                    current = header
+                print(f"    {item['key']}: {item['value']}")
+        print()
+    except Exception as e:
+        print(Fore.RED + "\n[Error during query]" + Style.RESET_ALL, e)
+        print()
+
 def display_delete_response(resp):
     """
     Formats and displays the delete response in a user-friendly way.
@@ -115,23 +194,19 @@ def display_delete_response(resp):
     
     addr = resp.get("address", "N/A")
     print(Fore.CYAN + "Address:" + Style.RESET_ALL, addr)
-    
-    data_store = resp.get("data_store", {})
-    if data_store:
-        print(Fore.CYAN + "Data Store:" + Style.RESET_ALL)
-        for key, value in data_store.items():
-            print(f"  {key}: {value}")
-    else:
-        print(Fore.CYAN + "Data Store:" + Style.RESET_ALL, "{}")
+
+    display_ack_details(resp)
     
     result = resp.get("result", None)
     if result is not None:
         print(Fore.CYAN + "Result:" + Style.RESET_ALL, result)
     print()
 
-def delete_cmd(node_addr, key):
+def delete_cmd(node_addr, key, debug=False):
     url = f"http://{node_addr}/delete"
     payload = {"key": key}
+    if debug:
+        payload["debug"] = True
     try:
         response = requests.post(url, json=payload)
         response.raise_for_status()
@@ -279,7 +354,10 @@ def help_cmd():
     help_text = """
 Available commands:
     Insert <key> <value>  - Insert a key-value pair into the network.
+    Insertbatch <key>=<value> [<key>=<value> ...]
+                          - Insert many key-value pairs with a single request.
     Query <key>           - Retrieve the value associated with a given key.
+    Query * [replicas]    - Stream all songs of the network (with "replicas", also the replica songs).
     Delete <key>          - Delete the key-value pair from the network.
     Overlay               - Display the current network overlay (topology).
     Nodeinfo              - Display the node information.
@@ -293,6 +371,7 @@ def print_intro(node_addr):
     print(Fore.CYAN + f"Connected to node: http://{node_addr}" + Style.RESET_ALL)
     print(Fore.YELLOW + "Enter commands in the following format:" + Style.RESET_ALL)
     print("  Insert <key> <value>")
+    print("  Insertbatch <key>=<value> [<key>=<value> ...]")
     print("  Query <key>")
     print("  Delete <key>")
     print("  Overlay")
@@ -312,6 +391,11 @@ def main():
         required=True,
         help="Target node address in the format ip:port (e.g., 127.0.0.1:8001)"
     )
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="Show the data store of the responsible node after Insert and Delete"
+    )
     args = parser.parse_args()
     node_addr = args.node
 
@@ -350,15 +434,29 @@ def main():
                 continue
             key = tokens[1]
             value = " ".join(tokens[2:])
-            insert_cmd(node_addr, key, value)
+            insert_cmd(node_addr, key, value, args.debug)
+
+        elif cmd == "insertbatch":
+            pairs = [token.split("=", 1) for token in tokens[1:]]
+            if not pairs or any(len(pair) != 2 or not pair[0] for pair in pairs):
+                print(Fore.RED + "Usage: Insertbatch <key>=<value> [<key>=<value> ...]" + Style.RESET_ALL)
+                print()
+                continue
+            insert_batch_cmd(node_addr, pairs)
 
         elif cmd == "query":
+            if len(tokens) == 3 and tokens[1] == "*" and tokens[2].lower() == "replicas":
+                scan_cmd(node_addr, include_replicas=True)
+                continue
             if len(tokens) != 2:
                 print(Fore.RED + "Usage: Query <key>" + Style.RESET_ALL)
                 print()
                 continue
             key = tokens[1]
-            query_cmd(node_addr, key)
+            if key == "*":
+                scan_cmd(node_addr)
+            else:
+                query_cmd(node_addr, key)
 
         elif cmd == "delete":
             if len(tokens) != 2:
@@ -366,7 +464,7 @@ def main():
                 print()
                 continue
             key = tokens[1]
-            delete_cmd(node_addr, key)
+            delete_cmd(node_addr, key, args.debug)
 
         elif cmd == "overlay":
             if len(tokens) != 1:
@@ -394,7 +492,7 @@ def main():
             help_cmd()
 
         else:
-            print(Fore.RED + "Invalid command. Use Insert, Query, Delete, Overlay, Nodeinfo, Depart, Help, or Exit." + Style.RESET_ALL)
+            print(Fore.RED + "Invalid command. Use Insert, Insertbatch, Query, Delete, Overlay, Nodeinfo, Depart, Help, or Exit." + Style.RESET_ALL)
             print()
 
 if __name__ == "__main__":
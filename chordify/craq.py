@@ -0,0 +1,63 @@
+# craq.py
+import threading
+
+# Apportioned reads for chain replication (CRAQ): a node of the chain answers a clean key itself and asks the tail
+# which version of a dirty key is committed.
+
+class CraqVersions:
+    def __init__(self):
+        self.lock = threading.Lock() #Makes a write to the stores and the recording of its version one step for readers
+        self.versions = {} #Key -> version of the last write applied here (at the tail: the committed version)
+        self.dirty = {} #Key -> [[version, value], ...]: the clean version first, then the uncommitted ones, in order
+        self.clean_reads = 0 #Reads answered locally without asking the tail
+        self.checked_reads = 0 #Reads of dirty keys answered locally after asking the tail
+        self.tail_reads = 0 #Reads of dirty keys handed to the tail
+
+    # Version of the next write of a key (head of the chain, with the chain head lock held).
+    def next_version(self, key):
+        return self.versions.get(key, 0) + 1
+
+    # Record a write applied at a node before the tail (lock held): value is the display value of the key before the
+    # write, new_value the one after it (None when the key does not exist).
+    def applied(self, key, version, value, new_value):
+        states = self.dirty.get(key)
+        if states is None:
+            states = self.dirty[key] = [[self.versions.get(key, 0), value]]
+        states.append([version, new_value])
+        self.versions[key] = version
+
+    # Record a write committed at the tail (lock held).
+    def committed(self, key, version):
+        if version > self.versions.get(key, 0):
+            self.versions[key] = version
+
+    # The tail committed the writes of key up to version: drop the older states, the key is clean once none is left.
+    def mark_clean(self, key, version):
+        with self.lock:
+            states = self.dirty.get(key)
+            if states is None or version < states[0][0]:
+                return
+            while len(states) > 1 and states[1][0] <= version:
+                states.pop(0)
+            if len(states) == 1:
+                del self.dirty[key]
+
+    # States of a dirty key (a copy), or None if the key is clean (lock held).
+    def states(self, key):
+        states = self.dirty.get(key)
+        return [list(state) for state in states] if states is not None else None
+
+    def clear(self):
+        with self.lock:
+            self.versions.clear()
+            self.dirty.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "versioned_keys": len(self.versions),
+                "dirty_keys": len(self.dirty),
+                "clean_reads": self.clean_reads,
+                "checked_reads": self.checked_reads,
+                "tail_reads": self.tail_reads
+            }
@@ -3,7 +3,7 @@ import argparse
 import json
 import sys
 
-def update_settings(replication_factor, consistency_mode, aws_flag=False):
+def update_settings(replication_factor, consistency_mode, aws_flag=False, response_mode=None, read_mode=None, read_quorum=None, write_quorum=None):
     if aws_flag:
         url = "http://10.0.62.44:8000/update_settings"
     else:
@@ -13,6 +13,14 @@ def update_settings(replication_factor, consistency_mode, aws_flag=False):
         "replication_factor": replication_factor,
         "consistency_mode": consistency_mode
     }
+    if response_mode:
+        data["response_mode"] = response_mode
+    if read_mode:
+        data["read_mode"] = read_mode
+    if read_quorum:
+        data["read_quorum"] = read_quorum
+    if write_quorum:
+        data["write_quorum"] = write_quorum
     
     try:
         response = requests.post(url, headers=headers, data=json.dumps(data), timeout=5)
@@ -29,13 +37,17 @@ def update_settings(replication_factor, consistency_mode, aws_flag=False):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Change the replication factor and consistency mode of the Chordify system.")
     parser.add_argument("--replication_factor", type=int, help="The new replication factor")
-    parser.add_argument("--consistency_mode", type=str, help="The new consistency mode (eventual/linearizable)")
+    parser.add_argument("--consistency_mode", type=str, help="The new consistency mode (eventual/linearizable/quorum)")
+    parser.add_argument("--response_mode", type=str, choices=["callback", "direct"], help="How final results reach the origin node")
+    parser.add_argument("--read_mode", type=str, choices=["tail", "craq"], help="Where linearizable reads are answered (chain tail or any chain node)")
+    parser.add_argument("--read_quorum", type=int, help="Replies a read waits for in the quorum consistency mode (R)")
+    parser.add_argument("--write_quorum", type=int, help="Acknowledgements a write waits for in the quorum consistency mode (W)")
     parser.add_argument( "--aws", action="store_true", help="Use the AWS server instead of localhost")
     args = parser.parse_args()
     replication_factor = args.replication_factor
     consistency_mode = args.consistency_mode
     aws_flag = args.aws
     
-    update_settings(replication_factor, consistency_mode, aws_flag)
+    update_settings(replication_factor, consistency_mode, aws_flag, args.response_mode, args.read_mode, args.read_quorum, args.write_quorum)
 
 # python3 change_configurations.py  --replication_factor 3 --consistency_mode linearizable --aws
\ No newline at end of file
@@ -0,0 +1,65 @@
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+# Make the node modules importable when the script is run from the chordify directory or from experiments/.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hashing import compute_hash
+
+# Hashing as it was done before hashing.py: hex digest, then parse the hex string.
+def hexdigest_hash(key):
+    h = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return int(h, 16)
+
+# Same digest with the direct bytes-to-int conversion, without the cache.
+def digest_hash(key):
+    return int.from_bytes(hashlib.sha1(key.encode('utf-8')).digest(), 'big')
+
+def load_keys(file_number):
+    file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "insert", f"insert_{file_number}_part.txt")
+    try:
+        with open(file_path, "r") as f:
+            keys = [line.strip() for line in f if line.strip()]
+        if keys:
+            return keys
+    except FileNotFoundError:
+        pass
+    return [f"song_{i}" for i in range(500)]
+
+# Time hash_function over all keys `repeat` times and return the cost per call in nanoseconds.
+def time_per_op(hash_function, keys, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for key in keys:
+            hash_function(key)
+    duration = time.perf_counter() - start
+    return duration * 1e9 / (len(keys) * repeat)
+
+def run_benchmark(file_number, repeat):
+    keys = load_keys(file_number)
+    # Every key of the experiments is hashed several times on its way (routing, storing, replicating, querying),
+    # so each key is looked up `repeat` times.
+    results = {
+        "hexdigest + int(h, 16)": time_per_op(hexdigest_hash, keys, repeat),
+        "digest + int.from_bytes": time_per_op(digest_hash, keys, repeat),
+    }
+    compute_hash.cache_clear()
+    results["hashing.compute_hash (LRU cache)"] = time_per_op(compute_hash, keys, repeat)
+
+    # Both conversions must give the same identifiers.
+    assert all(hexdigest_hash(key) == compute_hash(key) for key in keys)
+
+    baseline = results["hexdigest + int(h, 16)"]
+    print(f"Keys: {len(keys)}, lookups per key: {repeat}")
+    for name, ns in results.items():
+        print(f"{name:<36} {ns:8.1f} ns/op  (x{baseline / ns:.2f})")
+    print("Cache:", compute_hash.cache_info())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Key hashing microbenchmark")
+    parser.add_argument("--file_number", type=str, default="00", help="Insert file whose keys are hashed")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of times every key is hashed")
+    args = parser.parse_args()
+    run_benchmark(args.file_number, args.repeat)
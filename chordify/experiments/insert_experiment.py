@@ -19,10 +19,10 @@ def get_info(bootstrap_addr):
         "consistency_mode": data.get("consistency_mode")
     }
 
-def _start_inserts_on_node(node_addr, file_number, results, index):
+def _start_inserts_on_node(node_addr, file_number, results, index, batch_size=1):
     # Thread worker that POSTs to /start_inserts on node_addr with the given file_number.
     url = f"http://{node_addr}/start_inserts"
-    payload = {"file_number": file_number}
+    payload = {"file_number": file_number, "batch_size": batch_size}
     start_time = time.time()
 
     try:
@@ -47,7 +47,24 @@ def _start_inserts_on_node(node_addr, file_number, results, index):
             "request_duration": round(end_time - start_time, 2)
         }
 
-def run_distributed_insert_experiment(bootstrap_addr, num_nodes=5, local_flag=False):
+# Print how many primary keys (and replicas) every node holds, and how far the most loaded node is from the mean.
+def print_key_distribution(ring, local_flag=False):
+    counts = []
+    for entry in ring:
+        node_addr = f"{'127.0.0.1' if local_flag else entry['ip']}:{entry['port']}"
+        try:
+            data = requests.get(f"http://{node_addr}/nodeinfo", timeout=30).json()
+        except Exception as e:
+            print(f"[{node_addr}] => ERROR: {e}")
+            continue
+        counts.append(len(data.get("data_store", {})))
+        print(f"[{node_addr}] vnodes={entry.get('vnodes', 1)}, ring share={entry.get('ring_share', 0):.1%}, "
+              f"primary keys={counts[-1]}, replicas={len(data.get('replica_store', {}))}")
+    if counts and sum(counts):
+        mean = sum(counts) / len(counts)
+        print(f"Key distribution: max/mean={max(counts) / mean:.2f}, min/mean={min(counts) / mean:.2f}")
+
+def run_distributed_insert_experiment(bootstrap_addr, num_nodes=5, local_flag=False, batch_size=1):
     overlay_data = get_overlay(bootstrap_addr)
     ring = overlay_data.get("ring", [])
 
@@ -79,7 +96,7 @@ def run_distributed_insert_experiment(bootstrap_addr, num_nodes=5, local_flag=Fa
 
         t = threading.Thread(
             target=_start_inserts_on_node,
-            args=(node_addr, file_number, results, i)
+            args=(node_addr, file_number, results, i, batch_size)
         )
         threads.append(t)
 
@@ -92,7 +109,7 @@ def run_distributed_insert_experiment(bootstrap_addr, num_nodes=5, local_flag=Fa
         t.join()
 
     print("=== Distributed Insert Experiment Results ===")
-    print(f"Replication Factor: {replication_factor}, Consistency Mode: {consistency_mode}")
+    print(f"Replication Factor: {replication_factor}, Consistency Mode: {consistency_mode}, Batch Size: {batch_size}")
     for res in results:
         if "error" in res:
             print(f"[{res['node']}] file_number={res['file_number']} => ERROR: {res['error']}")
@@ -101,6 +118,7 @@ def run_distributed_insert_experiment(bootstrap_addr, num_nodes=5, local_flag=Fa
                   f"node_response={res['node_response']}, "
                   f"request_duration={res['request_duration']}s, "
                   f"write throughput={res['node_response']['inserted'] / res['request_duration']:.2f} ops/sec")
+    print_key_distribution(ring, local_flag)
     print("==============================================")
 
 
@@ -111,10 +129,11 @@ if __name__ == "__main__":
     parser.add_argument("--num_nodes", type=int, default=5, help="Number of nodes to run the experiment on")
     # Flag if running locally
     parser.add_argument("--local", action="store_true", help="Run locally")
+    parser.add_argument("--batch_size", type=int, default=1, help="Keys per /insert_batch request (1 sends one /insert per key)")
     args = parser.parse_args()
     local_flag = args.local
 
     bootstrap_addr = f"{args.bootstrap_ip}:{args.bootstrap_port}"
-    run_distributed_insert_experiment(bootstrap_addr, args.num_nodes, local_flag)
+    run_distributed_insert_experiment(bootstrap_addr, args.num_nodes, local_flag, args.batch_size)
 
 # python3 insert_experiment.py --bootstrap_ip 10.0.62.44 --bootstrap_port 8000 --num_nodes 10
\ No newline at end of file
@@ -0,0 +1,89 @@
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# Make the node modules importable when the script is run from the chordify directory or from experiments/.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hashing import compute_hash
+from persistence import PersistenceEngine
+from store import HashIndexedStore
+
+def new_stores():
+    return {"data": HashIndexedStore(compute_hash), "replica": HashIndexedStore(compute_hash)}
+
+# Insert `keys` keys (each with `values_per_key` values) through `writers` threads into journaled stores.
+# Returns the write throughput (ops/sec).
+def load(data_dir, keys, values_per_key, fsync, writers):
+    engine = PersistenceEngine(data_dir, fsync=fsync, snapshot_every=0)
+    stores = new_stores()
+    engine.recover(stores)
+    engine.start()
+
+    def writer(w):
+        for i in range(w, keys, writers):
+            for v in range(values_per_key):
+                stores["data"].add_value(f"song_{i}", f"value_{v}")
+            stores["replica"].merge_values(f"replica_{i}", [f"value_{i}"])
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=writer, args=(w,)) for w in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duration = time.perf_counter() - start
+    engine.close()
+    return keys * (values_per_key + 1) / duration
+
+# Recover the stores from data_dir and return (seconds, replayed records, microseconds per get of a stored key).
+def recover(data_dir, keys, gets=2000):
+    engine = PersistenceEngine(data_dir)
+    stores = new_stores()
+    recovery = engine.recover(stores)
+    sample = [f"song_{random.randrange(keys)}" for _ in range(gets)]
+    start = time.perf_counter()
+    for key in sample:
+        stores["data"].get(key)
+    get_us = (time.perf_counter() - start) * 1e6 / gets
+    engine.close()
+    return recovery["seconds"], recovery["replayed_records"], get_us
+
+# Write a snapshot of the stores in data_dir (recover, then snapshot).
+def compact(data_dir):
+    engine = PersistenceEngine(data_dir, snapshot_every=0)
+    engine.recover(new_stores())
+    engine.start()
+    engine.snapshot()
+    engine.close()
+
+def run_benchmark(sizes, values_per_key, writers, always_limit):
+    print(f"Values per key: {values_per_key}, writer threads: {writers}")
+    # After a snapshot the stores are not loaded: the snapshot is mapped and gets search it.
+    print(f"{'keys':>8} {'fsync':>9} {'write ops/s':>12} {'recovery (log)':>16} {'records':>9} {'get (dict)':>11} {'recovery (snapshot)':>20} {'get (mapped)':>13}")
+    for keys in sizes:
+        for fsync in ("never", "interval", "always"):
+            if fsync == "always" and keys > always_limit:
+                continue # One fsync per group commit: only measured on the smaller stores
+            data_dir = tempfile.mkdtemp(prefix="chordify_wal_")
+            try:
+                throughput = load(data_dir, keys, values_per_key, fsync, writers)
+                log_seconds, records, dict_get = recover(data_dir, keys)
+                compact(data_dir)
+                snapshot_seconds, _, mapped_get = recover(data_dir, keys)
+                print(f"{keys:>8} {fsync:>9} {throughput:>12.0f} {log_seconds:>15.3f}s {records:>9} {dict_get:>9.2f}us {snapshot_seconds:>19.3f}s {mapped_get:>11.2f}us")
+            finally:
+                shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write-ahead log throughput, recovery time and lookup cost by store size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Numbers of keys to test")
+    parser.add_argument("--values_per_key", type=int, default=2, help="Values inserted per key")
+    parser.add_argument("--writers", type=int, default=8, help="Concurrent writer threads (they share group commits)")
+    parser.add_argument("--always_limit", type=int, default=10000, help="Largest store tested with --fsync always")
+    args = parser.parse_args()
+    run_benchmark(args.sizes, args.values_per_key, args.writers, args.always_limit)
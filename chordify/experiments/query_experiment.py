@@ -19,11 +19,11 @@ def get_info(bootstrap_addr):
         "consistency_mode": data.get("consistency_mode")
     }
 
-def _start_queries_on_node(node_addr, file_number, results, index):
+def _start_queries_on_node(node_addr, file_number, results, index, batch_size=1):
     # Thread worker that POSTs to /start_queries on node_addr with the given file_number.
     # Stores the result (or error) in results[index].
     url = f"http://{node_addr}/start_queries"
-    payload = {"file_number": file_number}
+    payload = {"file_number": file_number, "batch_size": batch_size}
     start_time = time.time()
     try:
         r = requests.post(url, json=payload, timeout=120)
@@ -46,7 +46,7 @@ def _start_queries_on_node(node_addr, file_number, results, index):
             "request_duration": round(end_time - start_time, 2)
         }
 
-def run_distributed_query_experiment(bootstrap_addr, num_nodes=5, local_flag=False):
+def run_distributed_query_experiment(bootstrap_addr, num_nodes=5, local_flag=False, batch_size=1):
     overlay_data = get_overlay(bootstrap_addr)
     ring = overlay_data.get("ring", [])
 
@@ -75,7 +75,7 @@ def run_distributed_query_experiment(bootstrap_addr, num_nodes=5, local_flag=Fal
         file_number = f"{i:02d}"  
         t = threading.Thread(
             target=_start_queries_on_node,
-            args=(node_addr, file_number, results, i)
+            args=(node_addr, file_number, results, i, batch_size)
         )
         threads.append(t)
 
@@ -87,7 +87,7 @@ def run_distributed_query_experiment(bootstrap_addr, num_nodes=5, local_flag=Fal
         t.join()
 
     print("=== Distributed Query Experiment Results ===")
-    print(f"Replication Factor: {replication_factor}, Consistency Mode: {consistency_mode}")
+    print(f"Replication Factor: {replication_factor}, Consistency Mode: {consistency_mode}, Batch Size: {batch_size}")
     for res in results:
         if "error" in res:
             print(f"[{res['node']}] file_number={res['file_number']} => ERROR: {res['error']}")
@@ -95,7 +95,8 @@ def run_distributed_query_experiment(bootstrap_addr, num_nodes=5, local_flag=Fal
             print(f"[{res['node']}] file_number={res['file_number']} => "
                   f"queried={res['node_response']['queried']} "
                   f"time_seconds={res['node_response']['time_seconds']} "
-                  f"read throughput={res['node_response']['queried'] / res['node_response']['time_seconds']:.2f}")
+                  f"read throughput={res['node_response']['throughput']:.2f} "
+                  f"avg hops={res['node_response'].get('avg_hops', 'N/A')}")
     print("==============================================")
 
 if __name__ == "__main__":
@@ -104,10 +105,11 @@ if __name__ == "__main__":
     parser.add_argument("--bootstrap_port", type=int, default=8000, help="Port of the bootstrap node")
     parser.add_argument("--num_nodes", type=int, default=5, help="Number of nodes to run the experiment on")
     parser.add_argument("--local", action="store_true", help="Run the experiment locally (on the host)")
+    parser.add_argument("--batch_size", type=int, default=1, help="Keys per /query_batch request (1 sends one /query per key)")
     args = parser.parse_args()
 
     local_flag = args.local
     bootstrap_addr = f"{args.bootstrap_ip}:{args.bootstrap_port}"
-    run_distributed_query_experiment(bootstrap_addr, args.num_nodes, local_flag)
+    run_distributed_query_experiment(bootstrap_addr, args.num_nodes, local_flag, args.batch_size)
 
 # python3 query_experiment.py --bootstrap_ip 10.0.62.44 --bootstrap_port 8000 --num_nodes 10
@@ -17,6 +17,25 @@ def get_info(bootstrap_addr):
     r.raise_for_status()
     return r.json()
 
+def summarize_latencies(global_logs):
+    """
+    Returns per-operation latency statistics (in milliseconds) over all successful requests.
+    Used to compare the callback and direct response modes.
+    """
+    summary = {}
+    for operation in ("insert", "query"):
+        times = sorted(log["response_time"] for log in global_logs
+                       if log["operation"] == operation and log["response_time"] is not None)
+        if not times:
+            continue
+        summary[operation] = {
+            "count": len(times),
+            "mean_ms": 1000 * sum(times) / len(times),
+            "p50_ms": 1000 * times[len(times) // 2],
+            "p95_ms": 1000 * times[min(len(times) - 1, int(len(times) * 0.95))]
+        }
+    return summary
+
 def to_set(value_str):
     if not value_str:
         return set()
@@ -248,6 +267,7 @@ def run_distributed_request_experiment_with_comparison(bootstrap_addr, num_nodes
     system_info = get_info(bootstrap_addr)
     replication_factor = system_info.get("replication_factor")
     consistency_mode = system_info.get("consistency_mode")
+    response_mode = system_info.get("response_mode", "callback")
 
     # Sort ring entries by a consistent key (e.g., 'id')
     ring = sorted(ring, key=lambda x: x["id"])
@@ -275,7 +295,7 @@ def run_distributed_request_experiment_with_comparison(bootstrap_addr, num_nodes
     experiment_duration = end_experiment - start_experiment
 
     print("=== Distributed Request Experiment Results ===")
-    print(f"Consistency Mode: {consistency_mode}, Replication Factor: {replication_factor}")
+    print(f"Consistency Mode: {consistency_mode}, Replication Factor: {replication_factor}, Response Mode: {response_mode}")
     for res in results:
         if "error" in res:
             print(f"[{res['node']}] ERROR: {res['error']}")
@@ -291,6 +311,11 @@ def run_distributed_request_experiment_with_comparison(bootstrap_addr, num_nodes
             global_logs.extend(node_logs)
     global_logs.sort(key=lambda x: x["start_time"])
 
+    # Per-operation latency, to compare the callback and direct response paths.
+    for operation, stats in summarize_latencies(global_logs).items():
+        print(f"{operation.capitalize()} latency ({response_mode}): count={stats['count']} "
+              f"mean={stats['mean_ms']:.1f}ms p50={stats['p50_ms']:.1f}ms p95={stats['p95_ms']:.1f}ms")
+
     # Compute expected values for queries and compare.
     comparison_logs = compute_expected_values(global_logs, consistency_mode)
 
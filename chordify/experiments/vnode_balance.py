@@ -0,0 +1,55 @@
+import argparse
+import os
+import statistics
+import sys
+
+# Make the node modules importable when the script is run from the chordify directory or from experiments/.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hashing import compute_hash
+from vnodes import node_tokens, token_ring, owner_index, walk, ring_shares
+
+# Ring of `nodes` physical nodes on consecutive ports, the first one being the bootstrap (id 0).
+def build_ring(nodes, vnodes, ip="10.0.0.1", port=8000):
+    ring = []
+    for i in range(nodes):
+        node_id = 0 if i == 0 else compute_hash(f"{ip}:{port + i}")
+        ring.append({"id": node_id, "ip": ip, "port": port + i, "tokens": node_tokens(node_id, ip, port + i, vnodes)})
+    return ring
+
+# Keys (primary) and keys plus replicas stored per node when `keys` keys are spread over the ring.
+def place(ring, keys, replication_factor):
+    token_ids, owners = token_ring(ring)
+    primary = {node["id"]: 0 for node in ring}
+    stored = {node["id"]: 0 for node in ring}
+    for i in range(keys):
+        chain = walk(token_ids, owners, owner_index(token_ids, compute_hash(f"song_{i}")), replication_factor)
+        primary[chain[0]["id"]] += 1
+        for node in chain:
+            stored[node["id"]] += 1
+    return primary, stored
+
+def summary(counts):
+    values = list(counts.values())
+    mean = statistics.mean(values)
+    return max(values) / mean, min(values) / mean, statistics.pstdev(values) / mean
+
+def run_benchmark(node_counts, vnode_counts, keys, replication_factor):
+    print(f"Keys: {keys}, replication factor: {replication_factor}")
+    # max/mean bounds the throughput of the cluster: the most loaded node serves that multiple of the average share.
+    print(f"{'nodes':>6} {'vnodes':>7} {'max/mean':>9} {'min/mean':>9} {'cv':>6} {'max/mean (with replicas)':>25} {'largest arc':>12}")
+    for nodes in node_counts:
+        for vnodes in vnode_counts:
+            ring = build_ring(nodes, vnodes)
+            primary, stored = place(ring, keys, replication_factor)
+            high, low, cv = summary(primary)
+            stored_high, _, _ = summary(stored)
+            print(f"{nodes:>6} {vnodes:>7} {high:>9.2f} {low:>9.2f} {cv:>6.2f} {stored_high:>25.2f} {max(ring_shares(ring).values()):>11.1%}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Key distribution over the physical nodes by number of virtual nodes")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[5, 10], help="Numbers of physical nodes to test")
+    parser.add_argument("--vnodes", type=int, nargs="+", default=[1, 4, 16, 64], help="Tokens per physical node to test")
+    parser.add_argument("--keys", type=int, default=20000, help="Keys placed on the ring")
+    parser.add_argument("--replication_factor", type=int, default=3, help="Nodes holding each key (owner and replicas)")
+    args = parser.parse_args()
+    run_benchmark(args.nodes, args.vnodes, args.keys, args.replication_factor)
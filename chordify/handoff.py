@@ -0,0 +1,233 @@
+# handoff.py
+import threading
+import time
+from transport import transport
+from values import ValueList
+
+HANDOFF_CHUNK = 256 # Keys of the first chunk of a handoff; the next chunks grow or shrink with the measured latency
+HANDOFF_MAX_CHUNK = 4096 # Largest number of keys in one chunk
+HANDOFF_TARGET_MS = 250 # A chunk that takes less doubles the next one, a slower (or failed) one halves it
+HANDOFF_RETRIES = 5 # Attempts of a chunk request before the handoff gives up (every retry resumes from the cursor)
+HANDOFF_TIMEOUT = 10 # Seconds a handoff request may take
+HANDOFF_SESSION_TTL = 600 # Seconds an idle outgoing session is kept before it is dropped with its change tracking
+HANDOFF_ABORT_TTL = 120 # Seconds the keys cut out by a switch are kept, so a join the bootstrap aborts can restore them
+
+# Chunked key handoff on join and depart: the keys of the ranges that change owner are streamed in resumable chunks
+# while the old owner keeps serving them, then ownership switches in one step with the keys changed meanwhile.
+
+class KeyHandoff:
+    def __init__(self, node):
+        self.node = node
+        self.lock = threading.Lock()
+        self.outgoing = {} #Session -> progress of a handoff from this node: target, ranges, cursor, keys sent
+        self.incoming = {} #Source address -> progress of a handoff to this node: keys received, chunks, done
+        self.handed = {} #Session -> (keys cut out by its switch, keys of them kept as replicas), until the join is final
+        self.switched = 0 #Sessions whose ranges were cut out of the data_store
+        self.changed_sent = 0 #Keys sent again because they changed while their range was streamed
+
+    # Read up to limit entries of the ranges from the data_store, starting at cursor [range index, last hash sent]
+    # (None starts from the beginning). Returns (key -> values, next cursor, done).
+    def _read(self, ranges, cursor, limit):
+        index, after = cursor or (0, None)
+        entries = {}
+        while index < len(ranges) and len(entries) < limit:
+            start, end = ranges[index]
+            if after == end:
+                index, after = index + 1, None
+                continue
+            page = self.node.data_store.range_page(start if after is None else after, end, limit - len(entries))
+            for key, value, key_hash in page:
+                entries[key] = value.to_list()
+                after = key_hash
+            if len(entries) < limit: # The range is exhausted
+                index, after = index + 1, None
+        return entries, [index, after], index >= len(ranges)
+
+    # Drop the outgoing sessions nobody asked for within HANDOFF_SESSION_TTL (lock held).
+    def _expire(self):
+        now = time.time()
+        for session, progress in list(self.outgoing.items()):
+            if now - progress["updated"] > HANDOFF_SESSION_TTL:
+                self.node.data_store.unwatch(session)
+                del self.outgoing[session]
+
+    # Next chunk of an outgoing handoff. A request without a cursor (re)opens the session and starts recording the
+    # keys that change from now on.
+    def chunk(self, session, target, ranges, cursor, limit):
+        with self.lock:
+            self._expire()
+            if cursor is None or session not in self.outgoing:
+                self.node.data_store.watch(session)
+                self.outgoing[session] = {"target": target, "ranges": len(ranges), "sent": 0, "chunks": 0, "cursor": None, "done": False, "started": time.time(), "updated": time.time()}
+        entries, cursor, done = self._read(ranges, cursor, min(limit, HANDOFF_MAX_CHUNK))
+        with self.lock:
+            progress = self.outgoing.get(session)
+            if progress is not None:
+                progress.update(sent=progress["sent"] + len(entries), chunks=progress["chunks"] + 1, cursor=cursor, done=done, updated=time.time())
+        return {"entries": entries, "cursor": cursor, "done": done}
+
+    # Switch the ranges of a session to their new owner: cut them out of the data_store and stop recording in one step.
+    # Returns key -> values (None if deleted) of the keys of the ranges that changed since the session was opened.
+    def switch(self, session, ranges):
+        node = self.node
+        store = node.data_store
+        with store.lock:
+            changed_keys = store.unwatch(session)
+            moved = {}
+            for start, end in ranges:
+                moved.update(store.pop_range(start, end))
+        changed = {}
+        for key in changed_keys:
+            key_hash = node.compute_hash(key)
+            if any(node.in_interval(key_hash, start, end) for start, end in ranges):
+                changed[key] = moved[key].to_list() if key in moved else None
+        kept = {key: value for key, value in moved.items() if node.is_replica_holder(node.compute_hash(key))}
+        node.replica_store.update(kept)
+        with self.lock:
+            self.outgoing.pop(session, None)
+            self.handed[session] = (moved, list(kept))
+            self.switched += 1
+            self.changed_sent += len(changed)
+        timer = threading.Timer(HANDOFF_ABORT_TTL, self.release, args=(session,))
+        timer.daemon = True
+        timer.start()
+        print(f"[{node.ip}:{node.port}] Handoff {session}: handed over {len(moved)} keys ({len(kept)} kept as replicas), {len(changed)} changed while streaming")
+        return changed
+
+    # Undo the switch of an aborted join: put the keys cut out by the session back into the data_store (the keys kept
+    # as replicas are primary here again) and stop recording changes if it never switched. Returns the keys restored.
+    def restore(self, session):
+        node = self.node
+        node.data_store.unwatch(session)
+        with self.lock:
+            self.outgoing.pop(session, None)
+            moved, kept = self.handed.pop(session, ({}, []))
+        for key in kept:
+            node.replica_store.pop(key, None)
+        node.data_store.update(moved)
+        print(f"[{node.ip}:{node.port}] Handoff {session} aborted: restored {len(moved)} keys")
+        return len(moved)
+
+    # Forget the keys cut out by a switch once the join can no longer be aborted.
+    def release(self, session):
+        with self.lock:
+            self.handed.pop(session, None)
+
+    # Pull the ranges from source into the data_store of this node, chunk by chunk. Returns the number of keys received.
+    def pull(self, source, session, ranges):
+        node = self.node
+        address = f"{source['ip']}:{source['port']}"
+        url = f"http://{address}/handoff_chunk"
+        cursor, limit, failures = None, HANDOFF_CHUNK, 0
+        with self.lock:
+            self.incoming[address] = progress = {"received": 0, "chunks": 0, "retries": 0, "done": False}
+        while True:
+            payload = {"session": session, "target": f"{node.ip}:{node.port}", "ranges": ranges, "cursor": cursor, "limit": limit}
+            began = time.perf_counter()
+            try:
+                response = transport.post(url, json=payload, timeout=HANDOFF_TIMEOUT)
+                response.raise_for_status()
+                data = response.json()
+            except Exception as e:
+                failures += 1
+                progress["retries"] += 1
+                if failures >= HANDOFF_RETRIES:
+                    raise
+                print(f"[{node.ip}:{node.port}] Handoff chunk from {address} failed ({e}), retrying from the cursor")
+                limit = max(1, limit // 2)
+                time.sleep(0.2 * failures)
+                continue
+            failures = 0
+            node.data_store.update({key: ValueList.from_wire(values) for key, values in data["entries"].items()})
+            cursor = data["cursor"]
+            progress["received"] += len(data["entries"])
+            progress["chunks"] += 1
+            elapsed_ms = (time.perf_counter() - began) * 1000
+            limit = min(limit * 2, HANDOFF_MAX_CHUNK) if elapsed_ms < HANDOFF_TARGET_MS else max(1, limit // 2)
+            if data["done"]:
+                progress["done"] = True
+                print(f"[{node.ip}:{node.port}] Handoff from {address}: {progress['received']} keys in {progress['chunks']} chunks")
+                return progress["received"]
+
+    # Push the ranges of this node's data_store to target in chunks (/absorb_keys), recording the keys that change
+    # meanwhile. Returns the number of keys sent; the session is closed with finish().
+    def push(self, target, session, ranges):
+        node = self.node
+        url = f"http://{target['ip']}:{target['port']}/absorb_keys"
+        cursor, limit, failures, sent = None, HANDOFF_CHUNK, 0, 0
+        while True:
+            chunk = self.chunk(session, f"{target['ip']}:{target['port']}", ranges, cursor, limit)
+            began = time.perf_counter()
+            try:
+                response = transport.post(url, json={"keys": chunk["entries"], "session": session}, timeout=HANDOFF_TIMEOUT)
+                response.raise_for_status()
+            except Exception as e:
+                failures += 1
+                if failures >= HANDOFF_RETRIES:
+                    raise
+                print(f"[{node.ip}:{node.port}] Handoff chunk to {target['ip']}:{target['port']} failed ({e}), retrying from the cursor")
+                limit = max(1, limit // 2)
+                time.sleep(0.2 * failures)
+                continue
+            failures = 0
+            sent += len(chunk["entries"])
+            cursor = chunk["cursor"]
+            elapsed_ms = (time.perf_counter() - began) * 1000
+            limit = min(limit * 2, HANDOFF_MAX_CHUNK) if elapsed_ms < HANDOFF_TARGET_MS else max(1, limit // 2)
+            if chunk["done"]:
+                return sent
+
+    # Close a pushed session once ownership has switched: cut the ranges out and send the keys that changed meanwhile.
+    def finish(self, target, session, ranges):
+        changed = self.switch(session, ranges)
+        url = f"http://{target['ip']}:{target['port']}/absorb_keys"
+        response = transport.post(url, json={"changed": changed, "session": session, "final": True}, timeout=HANDOFF_TIMEOUT)
+        response.raise_for_status()
+
+    # Abandon a pushed session before ownership switched: stop recording and ask target to drop the chunks it stored.
+    def cancel(self, target, session, ranges):
+        self.node.data_store.unwatch(session)
+        with self.lock:
+            self.outgoing.pop(session, None)
+        url = f"http://{target['ip']}:{target['port']}/handoff_cancel"
+        response = transport.post(url, json={"session": session, "ranges": ranges}, timeout=HANDOFF_TIMEOUT)
+        response.raise_for_status()
+
+    # Drop the chunks a departing node pushed for ranges it keeps after all. Returns the number of keys dropped.
+    def discard(self, source, ranges):
+        dropped = 0
+        for start, end in ranges:
+            dropped += len(self.node.data_store.pop_range(start, end))
+        with self.lock:
+            self.incoming.pop(source, None)
+        return dropped
+
+    # Apply the keys that changed on the old owner while their range was streamed (None: the key was deleted).
+    # A joining node replaces its values; a node taking over from a departing one merges them.
+    def apply_changed(self, changed, replace=False):
+        for key, values in changed.items():
+            if values is None:
+                self.node.data_store.pop(key, None)
+            elif replace:
+                self.node.data_store[key] = ValueList(values)
+            else:
+                self.node.data_store.merge_values(key, values)
+
+    # Store a chunk pushed by a departing node (keys), or its last one (the keys that changed meanwhile).
+    def absorb(self, source, keys, changed, final):
+        self.node.data_store.update({key: ValueList.from_wire(values) for key, values in keys.items()})
+        self.apply_changed(changed or {})
+        with self.lock:
+            progress = self.incoming.setdefault(source, {"received": 0, "chunks": 0, "retries": 0, "done": False})
+            progress["received"] += len(keys)
+            progress["chunks"] += 1
+            progress["done"] = final
+
+    def stats(self):
+        with self.lock:
+            return {
+                "outgoing": {session: dict(progress) for session, progress in self.outgoing.items()},
+                "incoming": {address: dict(progress) for address, progress in self.incoming.items()},
+                "switched": self.switched,
+                "changed_sent": self.changed_sent
+            }
@@ -0,0 +1,30 @@
+# hashing.py
+import hashlib
+from functools import lru_cache
+
+# Maximum number of keys whose hash is remembered by a node.
+HASH_CACHE_SIZE = 1 << 16
+
+# Position of a key (or of a node "ip:port") on the identifier circle: its SHA-1 digest as an integer.
+# Every module hashes through this function, and recently used keys are served from a bounded LRU cache.
+@lru_cache(maxsize=HASH_CACHE_SIZE)
+def compute_hash(key):
+    return int.from_bytes(hashlib.sha1(key.encode('utf-8')).digest(), 'big')
+
+# Parse a key hash that another node sent along with a request (JSON number or URL parameter string).
+# Returns None when there is none, so the receiver hashes the key itself.
+def parse_hash(value):
+    if value is None or value == "":
+        return None
+    return int(value)
+
+def hash_cache_stats():
+    info = compute_hash.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "max_size": info.maxsize,
+        "hit_ratio": round(info.hits / lookups, 3) if lookups else 0.0
+    }
@@ -0,0 +1,135 @@
+# hlc.py
+import threading
+import time
+
+LOGICAL_BITS = 16 # Counter of the events within one millisecond of the clock
+NODE_BITS = 32 # Low bits of the node id, so timestamps of different nodes never tie
+VERSION_WINDOW = 300 # Seconds a VersionTable remembers the versions of a key after its last update
+VERSION_SWEEP = 1024 # Updates between two sweeps of the keys not updated within the window
+
+# Hybrid logical clock (HLC) versions for replicated writes. A timestamp is one integer,
+# (wall milliseconds << LOGICAL_BITS | logical counter) << NODE_BITS | node tag, so versions compare as numbers.
+
+def encode(wall, logical, node_tag):
+    return ((wall << LOGICAL_BITS) | logical) << NODE_BITS | node_tag
+
+# (wall milliseconds, logical counter, node tag) of a timestamp.
+def decode(timestamp):
+    node_tag = timestamp & ((1 << NODE_BITS) - 1)
+    time_part = timestamp >> NODE_BITS
+    return time_part >> LOGICAL_BITS, time_part & ((1 << LOGICAL_BITS) - 1), node_tag
+
+class HybridLogicalClock:
+    def __init__(self, node_id):
+        self.node_tag = node_id & ((1 << NODE_BITS) - 1)
+        self.wall = 0 #Largest wall time (ms) seen, local or received
+        self.logical = 0 #Events at that wall time
+        self.lock = threading.Lock()
+
+    # Advance to (wall, logical), carrying a full counter into the next millisecond (lock held).
+    def _set(self, wall, logical):
+        if logical >> LOGICAL_BITS:
+            wall, logical = wall + 1, 0
+        self.wall, self.logical = wall, logical
+
+    # Timestamp of a new local write.
+    def now(self):
+        with self.lock:
+            physical = time.time_ns() // 1_000_000
+            if physical > self.wall:
+                self._set(physical, 0)
+            else:
+                self._set(self.wall, self.logical + 1)
+            return encode(self.wall, self.logical, self.node_tag)
+
+    # Merge a timestamp received from another node, so the next local one is larger.
+    def update(self, timestamp):
+        if not timestamp:
+            return
+        wall, logical, _ = decode(timestamp)
+        with self.lock:
+            physical = time.time_ns() // 1_000_000
+            if physical > self.wall and physical > wall:
+                self._set(physical, 0)
+            elif wall > self.wall:
+                self._set(wall, logical + 1)
+            elif wall == self.wall:
+                self._set(wall, max(self.logical, logical) + 1)
+            else:
+                self._set(self.wall, self.logical + 1)
+
+    def stats(self):
+        with self.lock:
+            return {"wall": self.wall, "logical": self.logical, "node_tag": self.node_tag}
+
+# Wall clock milliseconds of a timestamp.
+def wall_ms(timestamp):
+    return timestamp >> (NODE_BITS + LOGICAL_BITS)
+
+# Versions of the replication updates applied per key. An update is dropped if it is a repeated delivery or older than
+# the last delete of its key; deletes and replacing repairs are last-writer-wins.
+class VersionTable:
+    def __init__(self, window=VERSION_WINDOW):
+        self.window_ms = window * 1000
+        self.keys = {} #Key -> {"newest": version, "deleted": version of the last delete or replace, "seen": versions applied}
+        self.lock = threading.Lock()
+        self.applied = 0
+        self.dropped = 0 #Repeated updates, and updates older than a delete or a replace
+        self.expired = 0 #Keys forgotten after the window
+        self.since_sweep = 0
+
+    # Record version as applied to key (lock held), forgetting the versions older than the window.
+    def _record(self, key, version, deleted=False):
+        entry = self.keys.setdefault(key, {"newest": 0, "deleted": 0, "seen": set()})
+        entry["newest"] = max(entry["newest"], version)
+        if deleted:
+            entry["deleted"] = max(entry["deleted"], version)
+        oldest = wall_ms(entry["newest"]) - self.window_ms
+        entry["seen"] = {seen for seen in entry["seen"] if wall_ms(seen) >= oldest}
+        entry["seen"].add(version)
+        self.applied += 1
+        self.since_sweep += 1
+        if self.since_sweep >= VERSION_SWEEP:
+            self._sweep()
+
+    # Forget the keys not updated within the window (lock held).
+    def _sweep(self):
+        self.since_sweep = 0
+        oldest = time.time_ns() // 1_000_000 - self.window_ms
+        for key in [key for key, entry in self.keys.items() if wall_ms(entry["newest"]) < oldest]:
+            del self.keys[key]
+            self.expired += 1
+
+    # Apply a replication update of key as one step: write(remove) runs (remove: the update deletes the key first)
+    # unless the update is stale. Returns True if it ran; updates without a version are always applied.
+    def apply(self, key, version, write, delete=False):
+        with self.lock:
+            if not version:
+                write(delete)
+                self.applied += 1
+                return True
+            entry = self.keys.get(key, {"newest": 0, "deleted": 0, "seen": ()})
+            if version in entry["seen"] or version <= entry["deleted"]:
+                self.dropped += 1
+                return False
+            write(delete and version > entry["newest"])
+            self._record(key, version, delete)
+            return True
+
+    # Run write(), which replaces the state of key, if version is newer than every update applied to it; the updates
+    # older than version are dropped from now on. Returns True if it ran. Without a version it always runs.
+    def replace(self, key, version, write):
+        with self.lock:
+            if version and version <= self.keys.get(key, {"newest": 0})["newest"]:
+                self.dropped += 1
+                return False
+            write()
+            if version:
+                self._record(key, version, True)
+            else:
+                self.applied += 1
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {"versioned_keys": len(self.keys), "applied": self.applied, "dropped": self.dropped, "expired": self.expired}
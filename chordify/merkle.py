@@ -0,0 +1,106 @@
+# merkle.py
+import hashlib
+
+MERKLE_DEPTH = 10 # Levels below the root: the identifier circle is split into 2^10 leaf buckets
+HASH_BITS = 160 # Bits of a key hash (SHA1 identifiers)
+RING_MAX = 2 ** HASH_BITS - 1 # Largest hash on the identifier circle
+
+# Merkle trees over the hash-indexed stores. The leaves are fixed buckets of the identifier circle (heap order, root 1)
+# and a tree node holds the XOR of the digests of the keys below it, so a write updates its path in place.
+
+def _digest(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+# Contribution of one value of key to the digest of the key.
+def value_digest(key, value):
+    return _digest(f"{key}\0{value}")
+
+# Digest of a key holding the given values (repeated values count once).
+def key_digest(key, values):
+    digest = _digest(key)
+    for value in set(values):
+        digest ^= value_digest(key, value)
+    return digest
+
+class MerkleTree:
+    def __init__(self, depth=MERKLE_DEPTH):
+        self.depth = depth
+        self.leaves = 1 << depth #Index of the first leaf, and number of leaves
+        self.nodes = [0] * (2 * self.leaves) #Digest of every tree node in heap order (index 0 is unused)
+
+    def bucket(self, key_hash):
+        return key_hash >> (HASH_BITS - self.depth)
+
+    # XOR digest into the bucket of key_hash and every node above it.
+    def toggle(self, key_hash, digest):
+        i = self.leaves + self.bucket(key_hash)
+        while i:
+            self.nodes[i] ^= digest
+            i >>= 1
+
+    def reset(self):
+        self.nodes = [0] * (2 * self.leaves)
+
+    def root(self):
+        return self.nodes[1]
+
+    # First and last hash covered by tree node i.
+    def span(self, i):
+        level = i.bit_length() - 1
+        shift = HASH_BITS - level
+        first = (i - (1 << level)) << shift
+        return first, first + (1 << shift) - 1
+
+# Linear pieces [lo, hi] of the ring range (start, end]. start == end means the whole ring, like Node.in_interval.
+def _pieces(start, end):
+    if start == end:
+        return [(0, RING_MAX)]
+    if start < end:
+        return [(start + 1, end)]
+    return [(start + 1, RING_MAX), (0, end)]
+
+# Linear pieces of a list of ring ranges.
+def _all_pieces(ranges):
+    return [piece for start, end in ranges for piece in _pieces(start, end)]
+
+# Digest of every key of store whose hash is in [first, last] and in one of the pieces (store lock held).
+def _keys_in(store, first, last, pieces):
+    keys = store.keys_in_range(first - 1, last) if first > 0 else store.keys_in_range(RING_MAX, last)
+    digests = {}
+    for key in keys:
+        key_hash = store.hash_of(key)
+        if any(lo <= key_hash <= hi for lo, hi in pieces):
+            digests[key] = key_digest(key, store.get(key))
+    return digests
+
+def _range_digest(store, tree, i, pieces):
+    first, last = tree.span(i)
+    inside = [(lo, hi) for lo, hi in pieces if lo <= last and first <= hi]
+    if not inside:
+        return 0
+    if any(lo <= first and last <= hi for lo, hi in inside):
+        return tree.nodes[i] # The whole node is inside the ranges
+    if i >= tree.leaves:
+        digest = 0
+        for other in _keys_in(store, first, last, inside).values():
+            digest ^= other
+        return digest
+    return _range_digest(store, tree, 2 * i, inside) ^ _range_digest(store, tree, 2 * i + 1, inside)
+
+# Digests of the given tree nodes of store, restricted to the keys whose hash is in one of the (start, end] ranges.
+def range_digests(store, nodes, ranges):
+    pieces = _all_pieces(ranges)
+    with store.lock:
+        tree = store.merkle_tree()
+        return [_range_digest(store, tree, i, pieces) for i in nodes]
+
+# key -> digest of the keys of store in the given leaf buckets whose hash is in one of the (start, end] ranges.
+def bucket_digests(store, buckets, ranges):
+    pieces = _all_pieces(ranges)
+    with store.lock:
+        tree = store.merkle_tree()
+        digests = {}
+        for bucket in buckets:
+            first, last = tree.span(tree.leaves + bucket)
+            digests.update(_keys_in(store, first, last, pieces))
+        return digests
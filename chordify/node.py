@@ -1,9 +1,34 @@
-import hashlib
 from flask import current_app
-import requests
+from transport import transport
 import threading
+import contextlib
 import uuid
 import time
+import bisect
+import random
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from runtime import AsyncRuntime
+from chain import ChainPipeline
+from craq import CraqVersions
+from replication import ReplicationQueue
+from quorum import QuorumReplication
+from anti_entropy import AntiEntropy
+from handoff import KeyHandoff
+from hlc import HybridLogicalClock, VersionTable
+from vnodes import VNODES, node_tokens, has_vnodes, token_ring, token_ranges, owner_index, walk, ranges_of, neighbours
+from hashing import compute_hash
+from store import HashIndexedStore
+from values import ValueList, store_to_display
+
+M_BITS = 160 # Number of bits of the SHA1 identifier space
+RING_SIZE = 2 ** M_BITS # Size of the identifier circle
+MEMBERSHIP_WORKERS = 16 # Parallel requests of a membership push, or of the cleanup after a join/depart
+MEMBERSHIP_TIMEOUT = 2 # Seconds a membership request may take
+JOIN_ATTEMPTS = 3 # Times a join pulls its keys again when another join or depart changed its ranges meanwhile
+DEPART_CHECKS = 3 # Times a depart whose /remove_node got no answer asks the bootstrap whether it was removed
+CONSISTENCY_MODES = ("linearizability", "eventual", "quorum")
+RESPONSE_MODES = ("callback", "direct") # How final results reach the origin node
+READ_MODES = ("tail", "craq") # Where linearizable reads are answered
 
 # This class represents a node in the DHT ring.
 # Here we implement the main methods for the node to interact with the ring.
@@ -11,24 +36,243 @@ import time
 # We also implemented helper methods for replication and consistency, as well as methods for taking node info or updating its fields. 
 
 class Node:
-    def __init__(self, ip, port, is_bootstrap=False, consistency_mode="strong", replication_factor=1):
+    def __init__(self, ip, port, is_bootstrap=False, consistency_mode="strong", replication_factor=1, response_mode="callback", read_mode="tail", vnodes=VNODES):
         self.ip = ip #IP address of the node
         self.port = port #Port number of the node
         self.is_bootstrap = is_bootstrap #Boolean value to check if the node is a bootstrap node
         self.id = 0 if is_bootstrap else self.compute_hash(f"{self.ip}:{self.port}") #Unique ID of the node
+        self.tokens = node_tokens(self.id, ip, port, vnodes) #Ring positions of the node (virtual nodes, vnodes.py); the first is its id
         self.successor = {}  #Successor node
         self.predecessor = {} #Predecessor node
-        self.data_store = {}   #Data store for the node
-        self.pending_requests = {} #Pending requests for the node
+        self.data_store = HashIndexedStore(self.compute_hash)   #Data store for the node (keys indexed by hash)
+        self.pending_requests = {} #Pending requests for the node: request_id -> {"future": Future completed with the final result}
         self.pending_requests_lock = threading.Lock() #Lock for pending requests
-        self.replica_store = {} #Replica store for the node
+        self.replica_store = HashIndexedStore(self.compute_hash) #Replica store for the node (keys indexed by hash)
         self.replication_factor = replication_factor #Replication factor for the node
         self.consistency_mode = consistency_mode #Consistency mode for the node
+        self.response_mode = response_mode #"callback": results are posted back to the origin, "direct": results travel back through the HTTP responses
+        self.finger_table = [] #Finger table: finger[i] is the successor of (id + 2^i)
+        self.ring = [] #Cached membership view: every node of the ring sorted by id
+        self.ring_ids = [] #Sorted node ids of the membership view, used for bisect lookups
+        self.token_ids = [] #Sorted tokens of all the nodes of the view (the node ids without virtual nodes)
+        self.token_owners = [] #Node owning each token of token_ids
+        self.vnodes_active = False #Some node of the view has several tokens: ownership and placement follow the tokens
+        self.ring_version = 0 #Version of the membership view, incremented by the bootstrap on every join/depart
+        self.membership_lock = threading.Lock() #Makes the version check and the switch to a new view one step
+        self.runtime = None #AsyncRuntime for fire-and-forget requests (None keeps the blocking sends)
+        self.persistence = None #PersistenceEngine writing the stores to disk (None keeps them in memory only)
+        self.chain = ChainPipeline(self) #Pipelined chain replication of linearizable writes (chain.py)
+        self.read_mode = read_mode #Linearizable reads: "tail" reads from the chain tail, "craq" from any node of the chain
+        self.craq = CraqVersions() #Per-key versions of the chain writes, for read_mode "craq" (craq.py)
+        self.replication = ReplicationQueue(self) #Queued, coalesced and batched replication for eventual consistency (replication.py)
+        self.quorum = QuorumReplication(self) #Versions and R/W quorums of consistency_mode "quorum" (quorum.py)
+        self.clock = HybridLogicalClock(self.id) #Hybrid logical clock stamping the versions of replicated writes (hlc.py)
+        self.replica_versions = VersionTable() #Versions of the replication updates applied per replica key, to drop repeated and stale ones
+        self.anti_entropy = AntiEntropy(self) #Merkle-tree comparison and repair of the replicas of this node's keys (anti_entropy.py)
+        self.handoff = KeyHandoff(self) #Chunked transfer of the keys that change owner on join and depart (handoff.py)
+
+    # Compute the hash of a key (shared, memoized implementation in hashing.py)
+    compute_hash = staticmethod(compute_hash)
+
+    # Returns True if value is in (start, end] on the identifier circle
+    @staticmethod
+    def in_interval(value, start, end):
+        if start < end:
+            return start < value <= end
+        return value > start or value <= end
+
+    # Returns True if value is in (start, end) on the identifier circle
+    @staticmethod
+    def in_open_interval(value, start, end):
+        if start < end:
+            return start < value < end
+        return value > start or value < end
+
+    # Rebuild the finger table from the full ring.
+    # Each finger is the first node whose id succeeds (self.id + 2^i) on the identifier circle.
+    def update_finger_table(self, ring):
+        if not ring:
+            return
+        sorted_ring = sorted(ring, key=lambda n: n["id"])
+        ids = [n["id"] for n in sorted_ring]
+        fingers = []
+        for i in range(M_BITS):
+            start = (self.id + 2 ** i) % RING_SIZE
+            entry = sorted_ring[bisect.bisect_left(ids, start) % len(ids)]
+            fingers.append({"id": entry["id"], "ip": entry["ip"], "port": entry["port"]})
+        self.finger_table = fingers
+        print(f"[{self.ip}:{self.port}] Updated finger table ({len(set(f['id'] for f in fingers))} distinct fingers)")
+
+    # Replace the cached membership view with a newer version (the full ring).
+    # Older or duplicate versions are ignored, so out-of-order pushes cannot roll the view back.
+    def update_membership(self, ring, version):
+        with self.membership_lock:
+            if not ring or (self.ring and version <= self.ring_version):
+                return False
+            old_ring = self.ring
+            self._set_view(ring, version)
+        self._membership_changed(old_ring, self.ring)
+        return True
 
-    # Compute the hash of a keys
-    def compute_hash(self, key):
-        h = hashlib.sha1(key.encode('utf-8')).hexdigest()
-        return int(h, 16)
+    # Apply a membership delta pushed by the bootstrap ({"op": "join" or "depart", "node": ...}, view version - 1 to
+    # version). A node that missed a delta pulls the full view instead. Returns True if the view changed.
+    def apply_membership_delta(self, delta, version):
+        with self.membership_lock:
+            if self.ring and version <= self.ring_version:
+                return False
+            missed = not self.ring or version != self.ring_version + 1
+            if not missed:
+                old_ring = self.ring
+                changed = delta["node"]
+                ring = [n for n in old_ring if n["id"] != changed["id"]]
+                if delta["op"] == "join":
+                    ring.insert(bisect.bisect_left([n["id"] for n in ring], changed["id"]), changed)
+                self._set_view(ring, version)
+        if missed:
+            print(f"[{self.ip}:{self.port}] Membership delta {version} does not follow view {self.ring_version}, pulling the full view")
+            return self.pull_membership()
+        self._membership_changed(old_ring, self.ring)
+        return True
+
+    # Switch to the view of ring (membership lock held).
+    def _set_view(self, ring, version):
+        view = sorted(({"id": n["id"], "ip": n["ip"], "port": n["port"], "tokens": n.get("tokens") or [n["id"]]} for n in ring), key=lambda n: n["id"])
+        self.ring = view
+        self.ring_ids = [n["id"] for n in view]
+        self.token_ids, self.token_owners = token_ring(view)
+        self.vnodes_active = has_vnodes(view)
+        self.ring_version = version
+        self.update_finger_table(view)
+        print(f"[{self.ip}:{self.port}] Membership view updated to version {version} ({len(view)} nodes)")
+
+    # Only the nodes next to the one that joined or departed have primary ranges or replica holders that moved:
+    # start an anti-entropy round if this node is one of them, or if it had no view before.
+    def _membership_changed(self, old_ring, ring):
+        addresses = lambda nodes: {(n["ip"], n["port"]) for n in nodes}
+        self.chain.drop(addresses(old_ring) ^ addresses(ring))
+        if not old_ring or any(node["id"] == self.id for node in self.affected_nodes(old_ring, ring)):
+            self.anti_entropy.trigger()
+
+    # Nodes of ring whose primary ranges or replica holders move when the view changes from old_ring to ring:
+    # up to replication_factor nodes before and after every token of each node that joined or departed.
+    def affected_nodes(self, old_ring, ring):
+        old_ids = {n["id"] for n in old_ring}
+        ids = {n["id"] for n in ring}
+        nodes = {}
+        for changed_ring, changed_ids in ((ring, ids - old_ids), (old_ring, old_ids - ids)):
+            for node_id in changed_ids:
+                for node in neighbours(changed_ring, node_id, self.replication_factor):
+                    if node["id"] in ids:
+                        nodes.setdefault(node["id"], node)
+        return list(nodes.values())
+
+    # Fetch the full membership view from the bootstrap, for a node that missed a delta.
+    def pull_membership(self):
+        if self.is_bootstrap:
+            return False
+        url = f"http://{self.bootstrap_ip}:{self.bootstrap_port}/membership"
+        try:
+            response = transport.get(url, timeout=MEMBERSHIP_TIMEOUT)
+            response.raise_for_status()
+            data = response.json()
+            return self.update_membership(data.get("ring", []), data.get("version", 0))
+        except Exception as e:
+            print(f"[{self.ip}:{self.port}] Error pulling membership from the bootstrap: {e}")
+            return False
+
+    # Send a new version of the membership view (the delta of the change, or the full view) to every node of the ring
+    # except the ones in skip_ids, in parallel.
+    def push_membership(self, ring, version, skip_ids=(), delta=None):
+        view = [{"id": n["id"], "ip": n["ip"], "port": n["port"], "tokens": n.get("tokens") or [n["id"]]} for n in ring]
+        payload = {"delta": delta, "version": version} if delta else {"ring": view, "version": version}
+        self.post_parallel([n for n in view if n["id"] not in skip_ids], "/update_membership", payload, "pushing membership to")
+
+    # POST payload to endpoint on every node of nodes in parallel (at most MEMBERSHIP_WORKERS at a time).
+    # Returns the nodes that could not be reached.
+    def post_parallel(self, nodes, endpoint, payload, action):
+        if not nodes:
+            return []
+        executor = ThreadPoolExecutor(max_workers=min(MEMBERSHIP_WORKERS, len(nodes)))
+        futures = {
+            executor.submit(transport.post, f"http://{n['ip']}:{n['port']}{endpoint}", json=payload, timeout=MEMBERSHIP_TIMEOUT): n
+            for n in nodes
+        }
+        executor.shutdown(wait=False)
+        failed = []
+        for future, n in futures.items():
+            try:
+                future.result().raise_for_status()
+            except Exception as e:
+                print(f"[{self.ip}:{self.port}] Error {action} {n['ip']}:{n['port']}: {e}")
+                failed.append(n)
+        return failed
+
+    # Index in the membership view of the node responsible for key_hash (first id >= key_hash, wrapping to the bootstrap).
+    def _owner_index(self, key_hash):
+        return bisect.bisect_left(self.ring_ids, key_hash) % len(self.ring_ids)
+
+    # Node responsible for key_hash according to the membership view, or None if there is no view yet.
+    def lookup_owner(self, key_hash):
+        if not self.ring:
+            return None
+        if self.vnodes_active:
+            return self.token_owners[owner_index(self.token_ids, key_hash)]
+        return self.ring[self._owner_index(key_hash)]
+
+    # Tail of the replication chain of key_hash (replication_factor - 1 positions after the owner).
+    def lookup_chain_tail(self, key_hash):
+        if not self.ring:
+            return None
+        if self.vnodes_active:
+            chain = self.lookup_chain(key_hash)
+            return chain[(self.replication_factor - 1) % len(chain)] # The chain wraps like the successors do
+        index = (self._owner_index(key_hash) + self.replication_factor - 1) % len(self.ring)
+        return self.ring[index]
+
+    # Nodes of the replication chain of key_hash, from the owner (head) to the tail.
+    # With virtual nodes these are the next distinct physical nodes on the token ring.
+    def lookup_chain(self, key_hash):
+        if not self.ring:
+            return []
+        if self.vnodes_active:
+            return walk(self.token_ids, self.token_owners, owner_index(self.token_ids, key_hash), self.replication_factor)
+        index = self._owner_index(key_hash)
+        return [self.ring[(index + i) % len(self.ring)] for i in range(self.replication_factor)]
+
+    # Node a chain write of key_hash is passed to after this one: the next node of its chain with virtual nodes,
+    # the successor otherwise.
+    def chain_next(self, key_hash):
+        if self.vnodes_active:
+            chain = self.lookup_chain(key_hash)
+            for i, node in enumerate(chain):
+                if node["id"] == self.id:
+                    return chain[(i + 1) % len(chain)]
+        return self.successor
+
+    # True if this node holds a replica of key_hash (it is on the replication chain of the key after the owner).
+    def is_replica_holder(self, key_hash):
+        return any(node["id"] == self.id for node in self.lookup_chain(key_hash)[1:])
+
+    # (start, end] ranges this node is primary for: one per token with virtual nodes, else (predecessor, id].
+    def primary_ranges(self):
+        if self.vnodes_active and self.id in self.ring_ids:
+            return ranges_of(self.token_ids, self.token_owners, self.id)
+        if "id" not in self.predecessor:
+            return []
+        return [(self.predecessor["id"], self.id)]
+
+    # Choose the node to forward a request for key_hash to: the responsible node with a membership view,
+    # otherwise the successor if it owns the key, else the closest preceding finger.
+    def next_hop(self, key_hash):
+        owner = self.lookup_owner(key_hash)
+        if owner is not None and owner["id"] != self.id:
+            return owner
+        if self.in_interval(key_hash, self.id, self.successor["id"]):
+            return self.successor
+        for finger in reversed(self.finger_table):
+            if self.in_open_interval(finger["id"], self.id, key_hash):
+                return finger
+        return self.successor
     
     # Update the node's ID
     def update_local_pointers(self, ring):
@@ -56,67 +300,175 @@ class Node:
         self.replication_factor = replication_factor
         self.consistency_mode = consistency
 
+    # Recover the stores from the data directory of the engine, then log every change of them (persistence.py).
+    def enable_persistence(self, engine):
+        recovery = engine.recover({"data": self.data_store, "replica": self.replica_store})
+        engine.start()
+        self.persistence = engine
+        print(f"[{self.ip}:{self.port}] Recovered {recovery['keys']} from {engine.data_dir} in {recovery['seconds']}s ({recovery['replayed_records']} log records).")
+        return recovery
+
+    # Start the asyncio runtime. Forwards, callbacks and replication steps then run as coroutines on its event loop.
+    def start_runtime(self):
+        if not AsyncRuntime.available():
+            print(f"[{self.ip}:{self.port}] aiohttp is not installed, using the threaded runtime.")
+            return False
+        self.runtime = AsyncRuntime()
+        self.runtime.start()
+        print(f"[{self.ip}:{self.port}] Asyncio runtime started.")
+        return True
+
+    # Send a request whose answer we do not need.
+    # With the asyncio runtime it is scheduled on the event loop, otherwise it is sent (and waited for) right here.
+    def _send(self, method, url, error_message, **kwargs):
+        if self.runtime is not None:
+            self.runtime.send(method, url, error_message, **kwargs)
+            return
+        try:
+            transport.request(method, url, **kwargs)
+        except Exception as e:
+            print(f"{error_message}: {e}")
+
+    # Send a forwarded insert/query/delete. In direct mode we wait for the downstream answer; otherwise the asyncio
+    # runtime schedules the forward and None is returned at once.
+    def _forward(self, method, url, direct=False, **kwargs):
+        if self.runtime is not None and not direct:
+            self.runtime.send(method, url, f"[{self.ip}:{self.port}] Error forwarding to {url}", **kwargs)
+            return None
+        return transport.request(method, url, **kwargs)
+
+    # Complete the pending request request_id with its final result. Returns False if the request is unknown.
+    def complete_request(self, request_id, final_result):
+        with self.pending_requests_lock:
+            pending = self.pending_requests.get(request_id)
+        if pending is None:
+            return False
+        if not pending["future"].done():
+            pending["future"].set_result(final_result)
+        return True
+
+    # Wait for the final result of a pending request and forget the request. Returns None on timeout.
+    def wait_for_result(self, request_id, timeout):
+        with self.pending_requests_lock:
+            pending = self.pending_requests.get(request_id)
+        try:
+            return pending["future"].result(timeout=timeout) if pending else None
+        except FutureTimeoutError:
+            return None
+        finally:
+            with self.pending_requests_lock:
+                self.pending_requests.pop(request_id, None)
+
+    # Deliver the final result of a request to its origin: directly if we are the origin, otherwise via its callback endpoint.
+    def _deliver_result(self, origin, endpoint, final_result):
+        if origin["ip"] == self.ip and str(origin["port"]) == str(self.port):
+            self.complete_request(origin.get("request_id"), final_result)
+            return
+        callback_url = f"http://{origin['ip']}:{origin['port']}/{endpoint}"
+        self._send("POST", callback_url, "Error sending callback",
+                   json={"request_id": origin.get("request_id"), "final_result": final_result}, timeout=3)
+
+    # Update how final results reach the origin node ("callback" or "direct")
+    def update_response_mode(self, response_mode):
+        self.response_mode = response_mode
+
+    # Update where linearizable reads are answered ("tail" or "craq"). The versions recorded so far are dropped.
+    def update_read_mode(self, read_mode):
+        self.read_mode = read_mode
+        self.craq.clear()
+
+    # Create the origin of a request started at this node. Only callback mode registers a pending request; in direct mode
+    # the returned pending id is None. With debug=True the ack includes the data_store (see _write_ack).
+    def _new_origin(self, debug=False):
+        request_id = str(uuid.uuid4())
+        origin = {"ip": self.ip, "port": self.port, "request_id": request_id}
+        if debug:
+            origin["debug"] = True
+        if self.response_mode == "direct":
+            origin["direct"] = True
+            return origin, None
+        with self.pending_requests_lock:
+            self.pending_requests[request_id] = {"future": Future()}
+        return origin, request_id
+
+    # Build the acknowledgement of an insert or delete at the responsible node (the tail adds "commit_seq").
+    # The data_store dump is only included for requests that asked for it with the debug flag.
+    def _write_ack(self, key: str, result: bool, status: str, msg: str, hops: int, origin: dict) -> dict:
+        ack = {
+            "result": result,
+            "message": msg,
+            "key": key,
+            "status": status,
+            "address": f"{self.ip}:{self.port}",
+            "hops": hops
+        }
+        if origin.get("debug"):
+            ack["data_store"] = store_to_display(self.data_store)
+        return ack
+
     # Check if the node is responsible for a key
     def is_responsible(self, key_hash: int) -> bool:
+        if self.vnodes_active and self.id in self.ring_ids:
+            return self.lookup_owner(key_hash)["id"] == self.id
         if self.is_bootstrap:
             return key_hash > self.predecessor["id"]
         else:
             return self.predecessor["id"] < key_hash <= self.id
 
     # Main method for inserting a key-value pair into the DHT.
-    def insert(self, key: str, value: str, origin: dict = None) -> (dict, str):  # type: ignore
+    # key_hash is the hash computed by the previous hop, if any, so forwarded requests are not rehashed.
+    def insert(self, key: str, value: str, origin: dict = None, hops: int = 0, debug: bool = False, key_hash: int = None) -> (dict, str):  # type: ignore
         if origin is None:
             # If there is no origin, this node is the original requester.
-            # Initialize a request_id and event for the pending request.
-            request_id = str(uuid.uuid4())
-            event = threading.Event()
-            with self.pending_requests_lock:
-                self.pending_requests[request_id] = {"event": event, "result": None}
-            origin = {"ip": self.ip, "port": self.port, "request_id": request_id}
+            # Initialize a request_id (and, in callback mode, an event for the pending request).
+            origin, request_id = self._new_origin(debug)
             is_origin = True
             print(f"[{self.ip}:{self.port}] Origin request: {origin}")
         else:
             # If there is an origin, this node is forwarding the request, use the provided request_id.
             is_origin = False
             request_id = origin.get("request_id")
+        direct = origin.get("direct", False)
 
-        key_hash = self.compute_hash(key)
+        if key_hash is None:
+            key_hash = self.compute_hash(key)
         if self.is_responsible(key_hash):
-            # If the node is responsible for the key, insert it locally.
-            if key in self.data_store:
-                self.data_store[key] += f" | {value}"
-                msg = f"Key '{key}' updated at node {self.ip}:{self.port}."
-            else:
-                self.data_store[key] = value
-                msg = f"Key '{key}' inserted at node {self.ip}:{self.port}."
-
-            final_result = {
-                "result": True,
-                "message": msg,
-                "address": f"{self.ip}:{self.port}",
-                "data_store": self.data_store
-            }
-
             if self.consistency_mode == "linearizability" and self.replication_factor > 1:
-                # If the consistency mode is linearizability, start chain replication using the helper method.
-                replication_count = self.replication_factor - 1
-                self.chain_replicate_insert(key, value, replication_count, origin, final_result)
+                # If the consistency mode is linearizability, insert locally and queue the write for chain replication
+                # in one step, so the replicas apply the writes in the order of the head.
+                with self.chain.head_lock:
+                    version = self._next_craq_version(key)
+                    status = self._apply_versioned(key, version, lambda: self.data_store.add_value(key, value))
+                    msg = f"Key '{key}' {status} at node {self.ip}:{self.port}."
+                    final_result = self._write_ack(key, True, status, msg, hops, origin)
+                    entry = self._chain_entry("insert", key, value, origin, final_result, version)
+                    futures = self.chain.replicate([entry], wait=direct)
+                if direct:
+                    # In direct mode the tail reports the commit back to this node, which answers with it.
+                    return (self.chain.result(entry, futures[0]), None)
+                # Otherwise the tail calls back the origin.
             else:
+                # If the node is responsible for the key, insert it locally.
+                quorum = self.consistency_mode == "quorum"
+                if quorum:
+                    status, version, values = self.quorum.write_local(key, lambda: self.data_store.add_value(key, value))
+                else:
+                    status = self.data_store.add_value(key, value)
+                msg = f"Key '{key}' {status} at node {self.ip}:{self.port}."
+                final_result = self._write_ack(key, True, status, msg, hops, origin)
+
+                if quorum:
+                    # If the consistency mode is quorum, wait until W of the N nodes of the key have the new version.
+                    acks = self.quorum.replicate([{"key": key, "version": version, "values": values}])
+                    self.quorum.finish_write(final_result, version, acks)
                 # If the consistency mode is eventual consistency, replicate asynchronously and callback immediately.
-                if self.replication_factor > 1:
-                    threading.Thread(
-                        target=self.async_replicate_insert, 
-                        args=(key, value, self.replication_factor - 1)
-                    ).start()
+                elif self.replication_factor > 1:
+                    self.async_replicate_insert(key, value, self.replication_factor - 1)
+                if direct:
+                    # In direct mode the final result is the HTTP response, no callback is needed.
+                    return (final_result, None)
                 # Also, if the consistency mode is linearizability and the replication factor is 0, the callback is sent here.
-                callback_url = f"http://{origin['ip']}:{origin['port']}/insert_response"
-                try:
-                    requests.post(callback_url, json={
-                        "request_id": origin["request_id"],
-                        "final_result": final_result
-                    }, timeout=2)
-                except Exception as e:
-                    print(f"Error sending callback: {e}")
+                self._deliver_result(origin, "insert_response", final_result)
                 if not is_origin:
                     # if this node is not the origin, return the final result immediately, without waiting for the callback.
                     # We no longer need the request_id in the pending_requests dict. 
@@ -129,24 +481,24 @@ class Node:
                 # Otherwise, indicate that the insert was processed; the callback will be sent from the chain.
                 return ({"result": True, "message": "Insert processed; callback will be sent from chain replication."}, request_id)
         else:
-            # If this node is not responsible, forward the insert request to the successor.
-            successor_ip = self.successor["ip"]
-            successor_port = self.successor["port"]
-            url = f"http://{successor_ip}:{successor_port}/insert"
-            payload = {"key": key, "value": value, "origin": origin}
+            # If this node is not responsible, forward the insert request to the closest preceding finger.
+            next_node = self.next_hop(key_hash)
+            url = f"http://{next_node['ip']}:{next_node['port']}/insert"
+            payload = {"key": key, "key_hash": key_hash, "value": value, "origin": origin, "hops": hops + 1}
             try:
-                requests.post(url, json=payload)
+                response = self._forward("POST", url, direct, json=payload)
             except Exception as e:
                 return ({"result": False, "error": f"Forwarding failed: {e}"}, request_id)
+            if direct:
+                # The responsible node answered with the final result.
+                return (response.json(), None)
             return ({"result": True, "message": "Insert forwarded."}, request_id)
 
-    # Performs synchronous chain replication for linearizability.
-    def chain_replicate_insert(self, key: str, value: str, replication_count: int, origin: dict, final_result: dict) -> None:
+    # Performs synchronous chain replication for linearizability, one write per request and hop (/chain_replicate_insert).
+    # In direct mode the tail's final result is returned and travels back up the chain; otherwise None is returned.
+    def chain_replicate_insert(self, key: str, value: str, replication_count: int, origin: dict, final_result: dict) -> dict:
         if key not in self.data_store: # The node that is responsible for the key should not have a stale replica.
-            if key in self.replica_store:
-                self.replica_store[key] += f" | {value}"
-            else:
-                self.replica_store[key] = value
+            self.replica_store.add_value(key, value)
         print(f"[{self.ip}:{self.port}] (Chain) Stored key '{key}' locally.")
 
         if replication_count > 0:
@@ -162,235 +514,714 @@ class Node:
                 "final_result": final_result
             }
             try:
-                requests.post(url, json=payload, timeout=20)
+                response = transport.post(url, json=payload, timeout=20)
+                if origin.get("direct"):
+                    return response.json().get("final_result")
             except Exception as e:
                 print(f"Error in chain replication: {e}")
+                if origin.get("direct"):
+                    final_result["result"] = False
+                    final_result["message"] += f" Chain replication failed: {e}"
+                    return final_result
         else:
             # Last replica in the chain: assign commit sequence and send callback to the origin.
-            if not hasattr(self, "commit_seq_per_key"):
-                self.commit_seq_per_key = {}
-            if key not in self.commit_seq_per_key:
-                self.commit_seq_per_key[key] = 0
-            self.commit_seq_per_key[key] += 1
-            final_result["commit_seq"] = self.commit_seq_per_key[key]
+            final_result["commit_seq"] = self._next_commit_seq(key)
+            if origin.get("direct"):
+                # Direct mode: hand the committed result back up the chain instead of calling back the origin.
+                print(f"[{self.ip}:{self.port}] Chain replication for key '{key}' completed.")
+                return final_result
             # Last replica in the chain: send callback to the origin node. (Characteristic of Linearizability) 
-            callback_url = f"http://{origin['ip']}:{origin['port']}/insert_response"
-            try:
-                requests.post(callback_url, json={
-                    "request_id": origin["request_id"],
-                    "final_result": final_result
-                }, timeout=2)
-            except Exception as e:
-                print(f"Error sending callback: {e}")
+            self._deliver_result(origin, "insert_response", final_result)
             print(f"[{self.ip}:{self.port}] Chain replication for key '{key}' completed.")
 
-    # Performs asynchronous replication for eventual consistency.
-    def async_replicate_insert(self, key: str, value: str, replication_count: int):
+    # A write for the chain pipeline (chain.py), sent from the head to its replication_factor - 1 replicas.
+    # With apportioned reads the write carries its version and the path of the nodes that applied it before the tail.
+    def _chain_entry(self, op: str, key: str, value, origin: dict, final_result: dict, version: int = None) -> dict:
+        entry = {"op": op, "key": key, "value": value, "replication_count": self.replication_factor - 2,
+                 "origin": origin, "final_result": final_result}
+        if version is not None:
+            entry["version"] = version
+            entry["path"] = [{"ip": self.ip, "port": self.port}]
+        return entry
+
+    # Version of the next chain write of a key started at this head, or None when reads are not apportioned.
+    def _next_craq_version(self, key: str):
+        return self.craq.next_version(key) if self.read_mode == "craq" else None
+
+    # Value of a key in the local stores as a read returns it, or None if it is not stored here.
+    def _display_value(self, key: str):
+        value = self.data_store.get(key, self.replica_store.get(key, None))
+        return str(value) if value is not None else None
+
+    # Apply a chain write with write() and record its version for apportioned reads (version None: not versioned).
+    # At the tail the version is committed; before the tail the key stays dirty until the tail reports the commit.
+    def _apply_versioned(self, key: str, version: int, write, tail: bool = False):
+        if version is None:
+            return write()
+        with self.craq.lock:
+            if tail:
+                result = write()
+                self.craq.committed(key, version)
+                return result
+            value = self._display_value(key)
+            result = write()
+            self.craq.applied(key, version, value, self._display_value(key))
+            return result
+
+    # Apply a batch of chain writes from the predecessor, in order (called by ChainPipeline.receive).
+    # Writes with replicas left are passed on to the successor as one batch; the others are committed here (tail).
+    def apply_chain_entries(self, entries: list):
+        forward = [] #Writes passed on to the successor
+        committed = [] #(entry, final result) of the writes this node is the tail for
+        clean = {} #(ip, port) of a node before the tail -> [[key, version]] of the committed versioned writes it applied
+        me = {"ip": self.ip, "port": self.port}
+        for entry in entries:
+            key = entry["key"]
+            tail = entry["replication_count"] <= 0
+            if entry["op"] == "delete":
+                write = lambda: self.replica_store.pop(key, None)
+            elif entry["op"] == "repair": # Anti-entropy: the replica takes the primary's value (repair_through_chain).
+                write = lambda: self._replace_replica(key, entry["value"])
+            elif key not in self.data_store: # The node that is responsible for the key should not have a stale replica.
+                write = lambda: self.replica_store.add_value(key, entry["value"])
+            else:
+                write = lambda: None
+            self._apply_versioned(key, entry.get("version"), write, tail)
+            if not tail:
+                forwarded = dict(entry, replication_count=entry["replication_count"] - 1)
+                if "path" in entry:
+                    forwarded["path"] = entry["path"] + [me]
+                forward.append(forwarded)
+            elif entry["op"] != "repair":
+                # Tail of the chain: assign the commit sequence.
+                final_result = entry["final_result"]
+                final_result["commit_seq"] = self._next_commit_seq(key)
+                committed.append((entry, final_result))
+                for node in entry.get("path", []):
+                    clean.setdefault((node["ip"], node["port"]), []).append([key, entry["version"]])
+        if forward:
+            self.chain.replicate(forward)
+        if committed:
+            self.finish_chain_entries(committed)
+        for (ip, port), versions in clean.items():
+            # The nodes before the tail may now answer reads of these versions themselves (craq.py).
+            self._send("POST", f"http://{ip}:{port}/craq_clean", f"[{self.ip}:{self.port}] Error reporting clean versions",
+                       json={"versions": versions}, timeout=5)
+        print(f"[{self.ip}:{self.port}] (Chain) Applied batch of {len(entries)} writes, {len(forward)} passed on.")
+
+    # Report the final results of chain writes (committed by this node as tail, or failed on its link).
+    # In callback mode they go to the origin; writes whose head waits for them go back to the head, one request per head.
+    def finish_chain_entries(self, results: list):
+        heads = {} #(ip, port) of a head -> [[entry id, final result]]
+        for entry, final_result in results:
+            origin = entry.get("origin")
+            if origin and not origin.get("direct"):
+                endpoint = "insert_response" if entry["op"] == "insert" else "delete_response"
+                self._deliver_result(origin, endpoint, final_result)
+            elif entry.get("id"):
+                heads.setdefault((entry["head"]["ip"], entry["head"]["port"]), []).append([entry["id"], final_result])
+        for (ip, port), completed in heads.items():
+            if ip == self.ip and str(port) == str(self.port):
+                for entry_id, final_result in completed:
+                    self.chain.complete(entry_id, final_result)
+            else:
+                self._send("POST", f"http://{ip}:{port}/chain_commit", f"[{self.ip}:{self.port}] Error reporting chain commits",
+                           json={"results": completed}, timeout=5)
+
+    # Commit sequence of the next write of a key, assigned by the tail of the chain.
+    def _next_commit_seq(self, key: str) -> int:
+        if not hasattr(self, "commit_seq_per_key"):
+            self.commit_seq_per_key = {}
+        if key not in self.commit_seq_per_key:
+            self.commit_seq_per_key[key] = 0
+        self.commit_seq_per_key[key] += 1
+        return self.commit_seq_per_key[key]
+
+    # Performs asynchronous replication for eventual consistency: the update is queued (replication.py).
+    # value is a single inserted value, or the list of all values of a key when the whole key is re-replicated.
+    def async_replicate_insert(self, key: str, value, replication_count: int):
         if "ip" not in self.successor:
             print(f"[{self.ip}:{self.port}] Error: No successor found for async replication.")
             return False
 
         # time.sleep(0.3)  # Simulate a delay in the replication process.
+        values = value if isinstance(value, list) else [value]
         if key not in self.data_store: # The node that is responsible for the key should not have a stale replica.
-            if key in self.replica_store:
-                current_value = self.replica_store[key]
-                if value in current_value.split(" | "):
-                    # Already applied this update; do nothing.
-                    pass
-                else:
-                    self.replica_store[key] += f" | {value}"
-            else:
-                self.replica_store[key] = value
+            # Values that were already applied are skipped (set lookup, no split of a concatenated string).
+            self.replica_store.merge_values(key, values)
         print(f"[{self.ip}:{self.port}] Asynchronously stored replica for key '{key}'.")
 
         if replication_count > 0:
-            # Propagate asynchronously to the successor with a decremented count.
-            successor_ip = self.successor["ip"]
-            successor_port = self.successor["port"]
-            url = f"http://{successor_ip}:{successor_port}/async_replicate_insert"
-            payload = {"key": key, "value": value, "replication_count": replication_count - 1}
-            try:
-                #print(f"[{self.ip}:{self.port}] Forwarding async replication for key '{key}' to {successor_ip}:{successor_port} with count {replication_count - 1}.")
-                requests.post(url, json=payload, timeout=2)
-            except Exception as e:
-                print(f"Error in async replication: {e}")
+            self._replicate_to_holders(key, values, False, replication_count)
         else:
             print(f"[{self.ip}:{self.port}] Asynchronous replication for key '{key}' completed.")
 
+    # Insert many key-value pairs with one request per responsible node, all in parallel and always answered directly.
+    # items is a list of {"key", "value"} dicts; returns one acknowledgement per item, in the order of items.
+    def insert_batch(self, items: list, hops: int = 0) -> list:
+        results = [None] * len(items)
+        local = [] #(position, item) pairs this node is responsible for
+        groups = {} #(ip, port) of the next node -> (node, [(position, item)])
+        for position, item in enumerate(items):
+            key_hash = item.get("key_hash")
+            if key_hash is None:
+                key_hash = self.compute_hash(item["key"])
+            item = {"key": item["key"], "value": item["value"], "key_hash": key_hash}
+            if self.is_responsible(key_hash):
+                local.append((position, item))
+            else:
+                next_node = self.next_hop(key_hash)
+                groups.setdefault((next_node["ip"], next_node["port"]), (next_node, []))[1].append((position, item))
+
+        futures = {}
+        if groups:
+            executor = ThreadPoolExecutor(max_workers=len(groups))
+            for next_node, group in groups.values():
+                futures[executor.submit(self._forward_insert_batch, next_node, [item for _, item in group], hops)] = group
+            executor.shutdown(wait=False)
+
+        if local:
+            acks = self._apply_insert_batch([item for _, item in local], hops)
+            for (position, _), ack in zip(local, acks):
+                results[position] = ack
+
+        for future, group in futures.items():
+            for (position, _), ack in zip(group, future.result()):
+                results[position] = ack
+        return results
+
+    # Send a sub-batch to the next node. On failure every item of the sub-batch gets an error result.
+    def _forward_insert_batch(self, next_node: dict, items: list, hops: int) -> list:
+        url = f"http://{next_node['ip']}:{next_node['port']}/insert_batch"
+        try:
+            response = transport.post(url, json={"items": items, "hops": hops + 1}, timeout=60)
+            response.raise_for_status()
+            return response.json()["results"]
+        except Exception as e:
+            print(f"[{self.ip}:{self.port}] Error forwarding insert batch to {next_node['ip']}:{next_node['port']}: {e}")
+            return [{"result": False, "key": item["key"], "error": f"Forwarding failed: {e}"} for item in items]
+
+    # Store a sub-batch this node is responsible for and replicate it as one batch.
+    def _apply_insert_batch(self, items: list, hops: int) -> list:
+        chain = self.consistency_mode == "linearizability" and self.replication_factor > 1
+        quorum = self.consistency_mode == "quorum"
+        with (self.chain.head_lock if chain else contextlib.nullcontext()):
+            acks = []
+            versions = []
+            writes = [] #States of the written keys sent to the other quorum nodes
+            for item in items:
+                key = item["key"]
+                write = lambda: self.data_store.add_value(key, item["value"])
+                if quorum:
+                    status, version, values = self.quorum.write_local(key, write)
+                    versions.append(version)
+                    writes.append({"key": key, "version": version, "values": values})
+                else:
+                    versions.append(self._next_craq_version(key) if chain else None)
+                    status = self._apply_versioned(key, versions[-1], write)
+                acks.append(self._write_ack(key, True, status, f"Key '{key}' {status} at node {self.ip}:{self.port}.", hops, {}))
+            if chain:
+                # The writes enter the chain pipeline together; the tail reports the commit sequence of every item.
+                entries = [self._chain_entry("insert", item["key"], item["value"], {}, ack, version)
+                           for item, ack, version in zip(items, acks, versions)]
+                futures = self.chain.replicate(entries, wait=True)
+        print(f"[{self.ip}:{self.port}] Stored batch of {len(items)} keys.")
+
+        if chain:
+            return [self.chain.result(entry, future) for entry, future in zip(entries, futures)]
+        if quorum:
+            # One quorum write per node for the whole sub-batch.
+            replicated = self.quorum.replicate(writes)
+            return [self.quorum.finish_write(ack, version, replicated) for ack, version in zip(acks, versions)]
+        if self.replication_factor > 1:
+            replicated = [{"key": item["key"], "value": item["value"]} for item in items]
+            self.async_replicate_insert_batch(replicated, self.replication_factor - 1)
+        return acks
+
+    # Asynchronous replication of a batch for eventual consistency (the updates join the replication queue).
+    def async_replicate_insert_batch(self, items: list, replication_count: int):
+        if "ip" not in self.successor:
+            print(f"[{self.ip}:{self.port}] Error: No successor found for async replication.")
+            return False
+        for item in items:
+            key = item["key"]
+            if key not in self.data_store: # The primary keeps its own copy only.
+                self.replica_store.merge_values(key, [item["value"]])
+        print(f"[{self.ip}:{self.port}] Asynchronously stored replica batch of {len(items)} keys.")
+
+        if replication_count > 0:
+            for item in items:
+                self._replicate_to_holders(item["key"], [item["value"]], False, replication_count)
+
+    # Next replication_count distinct physical nodes after the owner of key_hash (default: this node) in the membership
+    # view, i.e. the replica holders of its keys, or None without a view.
+    def _replica_holders(self, replication_count: int, key_hash: int = None):
+        if not self.ring or self.id not in self.ring_ids:
+            return None
+        if self.vnodes_active and key_hash is not None:
+            chain = walk(self.token_ids, self.token_owners, owner_index(self.token_ids, key_hash), replication_count + 1)
+            return [node for node in chain if node["id"] != self.id][:replication_count]
+        index = bisect.bisect_left(self.ring_ids, self.id)
+        count = min(replication_count, len(self.ring) - 1)
+        return [self.ring[(index + i) % len(self.ring)] for i in range(1, count + 1)]
+
+    # Queue a replica update for the replication_count nodes after this one: straight to every holder with a membership
+    # view, otherwise relayed successor by successor with a decremented count.
+    def _replicate_to_holders(self, key: str, values: list, delete: bool, replication_count: int):
+        holders = self._replica_holders(replication_count, self.compute_hash(key))
+        if holders is None:
+            self.replication.submit(key, values, delete, replication_count - 1)
+            return
+        if holders:
+            self.replication.submit(key, values, delete, 0, targets=holders)
+
+    # Apply a batch of queued replication updates (see replication.py) and queue the ones with replicas left for the
+    # successor. Stale updates are dropped without touching the store (replica_versions, hlc.py).
+    def apply_replication_batch(self, updates: list):
+        dropped = 0
+        for update in updates:
+            key = update["key"]
+            version = update.get("version")
+            self.clock.update(version)
+            if not self.replica_versions.apply(key, version, lambda remove: self._apply_replica_update(key, update, remove), update.get("delete", False)):
+                dropped += 1
+                continue
+            if update.get("replication_count", 0) > 0:
+                self.replication.submit(key, update.get("values"), update.get("delete", False), update["replication_count"] - 1, version=version)
+        print(f"[{self.ip}:{self.port}] Asynchronously applied replication batch of {len(updates)} keys ({dropped} repeated or stale).")
+
+    def _apply_replica_update(self, key: str, update: dict, remove: bool):
+        if remove:
+            self.replica_store.pop(key, None)
+        if update.get("values") and key not in self.data_store: # The primary keeps its own copy only.
+            self.replica_store.merge_values(key, update["values"])
+
     # Main method for querying a key-value pair from the DHT.
-    def query(self, key: str, origin: dict = None, chain_count: int = None) -> (dict, str): # type: ignore
+    def query(self, key: str, origin: dict = None, chain_count: int = None, hops: int = 0, key_hash: int = None) -> (dict, str): # type: ignore
         # 1. If no origin is provided, this node is the original requester
         if origin is None:
-            request_id = str(uuid.uuid4())
-            event = threading.Event()
-            with self.pending_requests_lock:
-                self.pending_requests[request_id] = {"event": event, "result": None}
-            origin = {"ip": self.ip, "port": self.port, "request_id": request_id}
+            origin, request_id = self._new_origin()
             is_origin = True
             print(f"[{self.ip}:{self.port}] Origin query request: {origin}")
         else:
             is_origin = False
             request_id = origin.get("request_id")
 
-        key_hash = self.compute_hash(key)
+        if key_hash is None:
+            key_hash = self.compute_hash(key)
 
         # 2. We have to find the responsible node for the key. If not responsible, forward.
         # In order to find it we use the chain_count parameter.
         if chain_count is None:
             if self.consistency_mode == "linearizability":
+                tail = self.lookup_chain_tail(key_hash)
+                if tail is not None and self.read_mode == "craq" and tail["id"] != self.id:
+                    # Apportioned reads: any node of the chain answers (craq.py), the tail only when it has to.
+                    chain = self.lookup_chain(key_hash)
+                    if any(node["id"] == self.id for node in chain):
+                        result = self._craq_read(key, hops, tail)
+                        if result is not None:
+                            return self._return_local_or_callback(key, origin, hops, result)
+                    elif hops == 0:
+                        # Spread the reads over the chain. Forwarded reads (hops > 0) go to the tail, so nodes with
+                        # different views never pass a read back and forth.
+                        node = random.choice(chain)
+                        print(f"[{self.ip}:{self.port}] Chain read for key '{key}' from {node['ip']}:{node['port']}.")
+                        try:
+                            result = self._forward_query(node, key, origin, hops, key_hash=key_hash)
+                        except Exception as e:
+                            return ({"result": False, "error": f"Chain forward error: {e}"}, request_id)
+                        if result is not None:
+                            return (result, None)
+                        return ({"result": True, "message": "Query forwarded to chain node."}, request_id)
+                if tail is not None:
+                    # With a membership view we know the tail of the chain -> read from it directly.
+                    if tail["id"] == self.id:
+                        return self._return_local_or_callback(key, origin, hops)
+                    print(f"[{self.ip}:{self.port}] Direct tail read for key '{key}' from {tail['ip']}:{tail['port']}.")
+                    try:
+                        result = self._forward_query(tail, key, origin, hops, chain_count=0, key_hash=key_hash)
+                    except Exception as e:
+                        return ({"result": False, "error": f"Tail forward error: {e}"}, request_id)
+                    if result is not None:
+                        return (result, None)
+                    return ({"result": True, "message": "Query forwarded to chain tail."}, request_id)
                 if not self.is_responsible(key_hash):
-                    # Not responsible -> forward around the ring unchanged (chain_count stays None).
-                    successor_ip = self.successor["ip"]
-                    successor_port = self.successor["port"]
-                    url = (
-                        f"http://{successor_ip}:{successor_port}/query"
-                        f"?key={key}&origin_ip={origin['ip']}&origin_port={origin['port']}"
-                        f"&request_id={origin['request_id']}"
-                    )
+                    # Not responsible -> forward through the finger table unchanged (chain_count stays None).
+                    next_node = self.next_hop(key_hash)
                     # No chain_count in URL => remains None
-                    print(f"[{self.ip}:{self.port}] Ring-based forward for key '{key}' to {successor_ip}:{successor_port}.")
+                    print(f"[{self.ip}:{self.port}] Finger-based forward for key '{key}' to {next_node['ip']}:{next_node['port']}.")
                     try:
-                        requests.get(url, timeout=3)
+                        result = self._forward_query(next_node, key, origin, hops, key_hash=key_hash)
                     except Exception as e:
                         return ({"result": False, "error": f"Ring-based forward error: {e}"}, request_id)
+                    if result is not None:
+                        return (result, None)
                     return ({"result": True, "message": "Ring-based query forwarded."}, request_id)
                 else:
                     # We are responsible -> 'head' of the chain for linearizability
                     chain_count = self.replication_factor - 1
-                    return self._handle_query_linearizability(key, origin, chain_count)
+                    return self._handle_query_linearizability(key, origin, chain_count, hops, key_hash)
+            elif self.consistency_mode == "quorum":
+                # Quorum: this node coordinates the read (without a membership view it is read like eventual consistency).
+                result = self.quorum.read(key, key_hash, hops)
+                if result is not None:
+                    return self._return_local_or_callback(key, origin, hops, result)
+                return self._handle_query_eventual(key, origin, hops, key_hash)
             else:
                 # Case of eventual consistency
-                return self._handle_query_eventual(key, origin)
+                return self._handle_query_eventual(key, origin, hops, key_hash)
 
         # 3. If chain_count is not None, we've already located the head and are in the chain pass
         if self.consistency_mode == "linearizability":
             # Continue chain replication with this helper func
-            return self._handle_query_linearizability(key, origin, chain_count)
+            return self._handle_query_linearizability(key, origin, chain_count, hops, key_hash)
         else:
             # Eventual consistency -> just do local read
-            return self._return_local_or_callback(key, origin)
+            return self._return_local_or_callback(key, origin, hops)
 
     # Helper method for handling query requests in linearizability mode.
-    def _handle_query_linearizability(self, key: str, origin: dict, chain_count: int) -> (dict, str): # type: ignore
+    def _handle_query_linearizability(self, key: str, origin: dict, chain_count: int, hops: int = 0, key_hash: int = None) -> (dict, str): # type: ignore
         req_id = origin["request_id"]
         if chain_count > 0:
             # Not tail yet -> forward to successor
-            successor_ip = self.successor["ip"]
-            successor_port = self.successor["port"]
-            url = (
-                f"http://{successor_ip}:{successor_port}/query"
-                f"?key={key}&origin_ip={origin['ip']}&origin_port={origin['port']}"
-                f"&request_id={origin['request_id']}&chain_count={chain_count - 1}"
-            )
-            print(f"[{self.ip}:{self.port}] Chain-mode forward for '{key}' to {successor_ip}:{successor_port}, chain_count={chain_count - 1}")
+            print(f"[{self.ip}:{self.port}] Chain-mode forward for '{key}' to {self.successor['ip']}:{self.successor['port']}, chain_count={chain_count - 1}")
             try:
-                requests.get(url, timeout=3)
+                result = self._forward_query(self.successor, key, origin, hops, chain_count=chain_count - 1, key_hash=key_hash)
             except Exception as e:
                 return ({"result": False, "error": f"Chain-mode forward error: {e}"}, req_id)
+            if result is not None:
+                return (result, None)
             return ({"result": True, "message": "Chain query forwarded."}, req_id)
         else:
             # When chain_count reaches 0, we are the tail -> return local or callback
-            return self._return_local_or_callback(key, origin)
+            return self._return_local_or_callback(key, origin, hops)
     
     # Helper method for handling query requests in eventual consistency mode.
-    def _handle_query_eventual(self, key: str, origin: dict) -> (dict, str): # type: ignore
+    def _handle_query_eventual(self, key: str, origin: dict, hops: int = 0, key_hash: int = None) -> (dict, str): # type: ignore
         # Check if the key exists in either the primary or replica store.
         req_id = origin["request_id"]
         if key in self.data_store or key in self.replica_store:
-                return self._return_local_or_callback(key, origin)
-        key_hash = self.compute_hash(key)
+                return self._return_local_or_callback(key, origin, hops)
+        if key_hash is None:
+            key_hash = self.compute_hash(key)
         if self.is_responsible(key_hash):
             # Key not found locally, but this node is responsible. So the key does not exist.
             print(f"[{self.ip}:{self.port}] Eventual consistency: key '{key}' not found locally.")
-            return self._return_local_or_callback(key, origin)
+            return self._return_local_or_callback(key, origin, hops)
         else:
-            # Not found locally; forward the query to the successor.
-            successor_ip = self.successor["ip"]
-            successor_port = self.successor["port"]
-            url = (
-                f"http://{successor_ip}:{successor_port}/query"
-                f"?key={key}&origin_ip={origin['ip']}&origin_port={origin['port']}"
-                f"&request_id={origin['request_id']}"
-            )
-            print(f"[{self.ip}:{self.port}] Eventual consistency: key '{key}' not found locally. Forwarding to {successor_ip}:{successor_port}.")
+            # Not found locally; forward the query through the finger table.
+            next_node = self.next_hop(key_hash)
+            print(f"[{self.ip}:{self.port}] Eventual consistency: key '{key}' not found locally. Forwarding to {next_node['ip']}:{next_node['port']}.")
             try:
-                requests.get(url, timeout=3)
+                result = self._forward_query(next_node, key, origin, hops, key_hash=key_hash)
             except Exception as e:
                 return ({"result": False, "error": f"Eventual consistency forward error: {e}"}, req_id)
+            if result is not None:
+                return (result, None)
             return ({"result": True, "message": "Eventual query forwarded."}, req_id)
 
-    # Helper method for returning the local result or sending a callback.
-    def _return_local_or_callback(self, key: str, origin: dict) -> (dict, str): # type: ignore
+    # Forward a query to another node. In callback mode the result reaches the origin through /query_response and None
+    # is returned; in direct mode we return the final result the downstream node answered with.
+    def _forward_query(self, target: dict, key: str, origin: dict, hops: int, chain_count: int = None, key_hash: int = None):
+        params = {
+            "key": key,
+            "origin_ip": origin["ip"],
+            "origin_port": origin["port"],
+            "request_id": origin["request_id"],
+            "hops": hops + 1
+        }
+        if chain_count is not None:
+            params["chain_count"] = chain_count
+        if key_hash is not None:
+            params["key_hash"] = str(key_hash)
+        url = f"http://{target['ip']}:{target['port']}/query"
+        if origin.get("direct"):
+            params["direct"] = 1
+            return transport.get(url, params=params, timeout=20).json()
+        self._forward("GET", url, params=params, timeout=3)
+        return None
+
+    # Helper method for returning the local result (or the given result) or sending a callback.
+    def _return_local_or_callback(self, key: str, origin: dict, hops: int = 0, result: dict = None) -> (dict, str): # type: ignore
+        if result is None:
+            result = self._local_read(key, hops)
+        if origin.get("direct"):
+            # Direct mode: the answer travels back through the HTTP responses.
+            return (result, None)
+
+        req_id = origin["request_id"]
+        if result["result"] is False:
+            # If the key is not found locally, the "not found" result is delivered right away.
+            # If this node is the origin, the pending request is completed immediately, otherwise a callback is sent.
+            self._deliver_result(origin, "query_response", result)
+            return (result, req_id)
+
+        # If we are NOT the origin, we must POST a callback to the origin
+        if not (origin["ip"] == self.ip and str(origin["port"]) == str(self.port)):
+            print(f"[{self.ip}:{self.port}] Returning final read to origin {origin['ip']}:{origin['port']}")
+            self._deliver_result(origin, "query_response", result)
+            return ({"result": True, "message": "Query tail responded to origin."}, req_id)
+        else:
+            # We are the origin -> complete the pending request with the final result
+            self.complete_request(req_id, result)
+            return (result, req_id)
+
+    # Read a key from the local stores and build the query result (or the "not found" result).
+    # replica_status replaces the status of replica songs.
+    def _local_read(self, key: str, hops: int = 0, replica_status: str = None) -> dict:
         local_value = self.data_store.get(key, self.replica_store.get(key, None))
+        if local_value is None:
+            return {"result": False, "error": "Song not found", "key": key, "hops": hops}
+        local_value = str(local_value) # Clients get the " | " separated values
         responding_node = f"{self.ip}:{self.port}"
         if key in self.data_store:
             result = {
                 "Result from": responding_node,
                 "Status": "Original Song",
                 "Key": key,
-                "result": local_value 
+                "result": local_value,
+                "hops": hops
             }
         else:
-            if self.consistency_mode == "linearizability":
+            if replica_status is not None:
+                result = {
+                    "Result from": responding_node,
+                    "Status": replica_status,
+                    "Key": key,
+                    "result": local_value,
+                    "hops": hops
+                }
+            elif self.consistency_mode == "linearizability":
                 result = {
                     "Result from": responding_node,
                     "Status": "Replica Song from Tail Node",
                     "Key": key,
-                    "result": local_value
+                    "result": local_value,
+                    "hops": hops
                 }
             else:
                 result = {
                     "Result from": responding_node,
                     "Status": "Replica Song",
                     "Key": key,
-                    "result": local_value
+                    "result": local_value,
+                    "hops": hops
                 }
+        return result
 
-         # If the key is not found locally, immediately return a "not found" result.
-        if local_value is None:
-            no_result = {"result": False, "error": "Song not found", "key": key}
-            req_id = origin["request_id"]
-            # If this node is the origin, set the pending request result immediately.
-            if origin["ip"] == self.ip and origin["port"] == self.port:
-                with self.pending_requests_lock:
-                    if req_id in self.pending_requests:
-                        self.pending_requests[req_id]["result"] = no_result
-                        self.pending_requests[req_id]["event"].set()
-                return (no_result, req_id)
+    # Answer a linearizable read at a chain node before the tail (read_mode "craq", see craq.py).
+    # Returns None when only the tail can answer.
+    def _craq_read(self, key: str, hops: int, tail: dict):
+        with self.craq.lock:
+            states = self.craq.states(key)
+            if states is None:
+                self.craq.clean_reads += 1
+                return self._local_read(key, hops, "Clean Replica Song")
+        committed = self._committed_version(tail, key)
+        for version, value in states:
+            if version == committed:
+                with self.craq.lock:
+                    self.craq.checked_reads += 1
+                if value is None:
+                    return {"result": False, "error": "Song not found", "key": key, "hops": hops}
+                return {
+                    "Result from": f"{self.ip}:{self.port}",
+                    "Status": "Committed Song (version checked with tail)",
+                    "Key": key,
+                    "result": value,
+                    "hops": hops
+                }
+        with self.craq.lock:
+            self.craq.tail_reads += 1
+        return None
+
+    # Version of key committed at the tail of its chain, or None if the tail cannot be asked.
+    def _committed_version(self, tail: dict, key: str):
+        url = f"http://{tail['ip']}:{tail['port']}/craq_version"
+        try:
+            response = transport.post(url, json={"keys": [key]}, timeout=5)
+            response.raise_for_status()
+            return response.json()["versions"][0]
+        except Exception as e:
+            print(f"[{self.ip}:{self.port}] Error asking {tail['ip']}:{tail['port']} for the version of '{key}': {e}")
+            return None
+
+    # Node that answers a linearizable read of key_hash: the chain tail, or with apportioned reads this node if it is
+    # in the chain, else a random node of the chain (forwarded reads, hops > 0, go to the tail as in query).
+    def _read_target(self, key_hash: int, hops: int):
+        tail = self.lookup_chain_tail(key_hash)
+        if tail is None or self.read_mode != "craq":
+            return tail
+        chain = self.lookup_chain(key_hash)
+        if any(node["id"] == self.id for node in chain):
+            return {"id": self.id}
+        return random.choice(chain) if hops == 0 else tail
+
+    # Query many keys with one request per node that has to answer them (the tail or a chain node, the owner, or this
+    # node as quorum coordinator), in parallel. Returns the results in the order of keys.
+    def query_batch(self, keys: list, hops: int = 0, key_hashes: list = None) -> list:
+        results = [None] * len(keys)
+        local = [] #(position, key_hash) of keys answered from the local stores
+        single = [] #(position, key_hash) of keys routed one by one
+        groups = {} #(ip, port) of the target -> (target, [(position, key_hash)])
+        for position, key in enumerate(keys):
+            key_hash = key_hashes[position] if key_hashes else None
+            if key_hash is None:
+                key_hash = self.compute_hash(key)
+            if self.consistency_mode == "linearizability":
+                target = self._read_target(key_hash, hops)
+            elif self.consistency_mode == "quorum" and self.ring:
+                target = {"id": self.id} # This node coordinates the quorum read
+            elif key in self.data_store or key in self.replica_store or self.is_responsible(key_hash):
+                target = {"id": self.id} # Answered locally, like _handle_query_eventual
             else:
-                # If not the origin, send a callback immediately.
-                callback_url = f"http://{origin['ip']}:{origin['port']}/query_response"
-                try:
-                    requests.post(callback_url, json={"request_id": req_id, "final_result": no_result}, timeout=3)
-                except Exception as e:
-                    print(f"Error sending callback: {e}")
-                return (no_result, req_id)
+                target = self.lookup_owner(key_hash)
 
-        # If we are NOT the origin, we must POST a callback to the origin
-        if not (origin["ip"] == self.ip and origin["port"] == self.port):
-            callback_url = f"http://{origin['ip']}:{origin['port']}/query_response"
-            print(f"[{self.ip}:{self.port}] Returning final read to origin {origin['ip']}:{origin['port']}")
-            req_id = origin["request_id"]
+            if target is None:
+                single.append((position, key_hash))
+            elif target["id"] == self.id:
+                local.append((position, key_hash))
+            else:
+                groups.setdefault((target["ip"], target["port"]), (target, []))[1].append((position, key_hash))
+
+        futures = {}
+        if groups:
+            executor = ThreadPoolExecutor(max_workers=len(groups))
+            for target, group in groups.values():
+                group_keys = [keys[position] for position, _ in group]
+                group_hashes = [key_hash for _, key_hash in group]
+                futures[executor.submit(self._forward_query_batch, target, group_keys, group_hashes, hops)] = group
+            executor.shutdown(wait=False)
+
+        if self.consistency_mode == "quorum" and local:
+            # Quorum reads wait for R replies each: run them in parallel.
+            with ThreadPoolExecutor(max_workers=min(len(local), 16)) as executor:
+                reads = [executor.submit(self.quorum.read, keys[position], key_hash, hops) for position, key_hash in local]
+                for (position, _), read in zip(local, reads):
+                    results[position] = read.result()
+            local = []
+        for position, key_hash in local:
+            tail = self.lookup_chain_tail(key_hash) if self.consistency_mode == "linearizability" and self.read_mode == "craq" else None
+            if tail is None or tail["id"] == self.id:
+                results[position] = self._local_read(keys[position], hops)
+                continue
+            results[position] = self._craq_read(keys[position], hops, tail)
+            if results[position] is None:
+                results[position] = self._forward_query_batch(tail, [keys[position]], [key_hash], hops)[0]
+        for position, key_hash in single:
+            origin = {"ip": self.ip, "port": self.port, "request_id": str(uuid.uuid4()), "direct": True}
+            results[position], _ = self.query(keys[position], origin, None, hops, key_hash)
+
+        for future, group in futures.items():
+            for (position, _), result in zip(group, future.result()):
+                results[position] = result
+        return results
+
+    # Send a sub-batch of keys to the node that answers them. On failure every key gets an error result.
+    def _forward_query_batch(self, target: dict, keys: list, key_hashes: list, hops: int) -> list:
+        url = f"http://{target['ip']}:{target['port']}/query_batch"
+        payload = {"keys": keys, "key_hashes": key_hashes, "hops": hops + 1}
+        try:
+            response = transport.post(url, json=payload, timeout=20)
+            response.raise_for_status()
+            return response.json()["results"]
+        except Exception as e:
+            print(f"[{self.ip}:{self.port}] Error forwarding query batch to {target['ip']}:{target['port']}: {e}")
+            return [{"result": False, "key": key, "error": f"Forwarding failed: {e}"} for key in keys]
+    
+            
+    # Songs of this node, as returned by /local_songs and included in wildcard results.
+    def local_songs(self) -> dict:
+        return {
+            "original_songs": store_to_display(self.data_store),   # primary/original songs
+            "replica_songs": store_to_display(self.replica_store)    # replica songs
+        }
+
+    # Wildcard query by scatter-gather over the nodes of the membership view (at most max_workers requests at a time).
+    # Returns (all_songs, failed_nodes); the songs of the nodes that answered are returned even if others failed.
+    def query_wildcard_parallel(self, max_workers: int = 16, timeout: float = 3) -> (dict, list): # type: ignore
+        if not self.ring:
+            return self.query_wildcard(), []
+
+        my_id = f"{self.ip}:{self.port}"
+        all_songs = {}
+        failed_nodes = []
+        others = [n for n in self.ring if n["id"] != self.id]
+        if others:
+            executor = ThreadPoolExecutor(max_workers=min(max_workers, len(others)))
+            futures = {
+                executor.submit(transport.get, f"http://{n['ip']}:{n['port']}/local_songs", timeout=timeout): f"{n['ip']}:{n['port']}"
+                for n in others
+            }
+            executor.shutdown(wait=False)
+        else:
+            futures = {}
+        all_songs[my_id] = self.local_songs()
+        for future, address in futures.items():
             try:
-                requests.post(callback_url, json={
-                    "request_id": origin["request_id"],
-                    "final_result": result
-                }, timeout=3)
+                response = future.result()
+                response.raise_for_status()
+                all_songs[address] = response.json()["songs"]
             except Exception as e:
-                print(f"Error sending query callback: {e}")
-            return ({"result": True, "message": "Query tail responded to origin."}, req_id)
+                print(f"[{my_id}] Wildcard query: no answer from {address}: {e}")
+                failed_nodes.append({"node": address, "error": str(e)})
+        return all_songs, failed_nodes
+
+    # Scan all songs of the ring page by page, in ring order; the cursor "node_id:store:last_hash" tells where the
+    # previous page stopped. Returns (items, next_cursor, failed_nodes); next_cursor is None when the scan is complete.
+    def scan_page(self, cursor: str = None, limit: int = 100, include_replicas: bool = False) -> (list, str, list): # type: ignore
+        ring = self.ring or [{"id": self.id, "ip": self.ip, "port": self.port}]
+        if cursor:
+            node_id, store, after = cursor.split(":")
+            node_id, after = int(node_id), int(after)
         else:
-            # We are the origin -> store final result in pending_requests
-            req_id = origin["request_id"]
-            with self.pending_requests_lock:
-                if req_id in self.pending_requests:
-                    self.pending_requests[req_id]["result"] = result
-                    self.pending_requests[req_id]["event"].set()
-            return (result, req_id)
-    
-            
+            node_id, store, after = ring[0]["id"], "data", -1
+        items = []
+        failed_nodes = []
+        while len(items) < limit:
+            node = next((n for n in ring if n["id"] >= node_id), None)
+            if node is None:
+                return items, None, failed_nodes
+            if node["id"] != node_id:
+                # The node of the cursor left the ring: continue from the start of the next node.
+                node_id, store, after = node["id"], "data", -1
+            wanted = limit - len(items)
+            try:
+                page = self._scan_node(node, store, after, wanted)
+            except Exception as e:
+                print(f"[{self.ip}:{self.port}] Scan: no answer from {node['ip']}:{node['port']}: {e}")
+                failed_nodes.append({"node": f"{node['ip']}:{node['port']}", "error": str(e)})
+                node_id, store, after = node["id"] + 1, "data", -1
+                continue
+            source = "original" if store == "data" else "replica"
+            for key, value, _ in page:
+                items.append({"key": key, "value": value, "node": f"{node['ip']}:{node['port']}", "source": source})
+            if len(page) == wanted:
+                # Page is full: the next one continues after the last key.
+                after = page[-1][2]
+            elif store == "data" and include_replicas:
+                store, after = "replica", -1
+            else:
+                node_id, store, after = node["id"] + 1, "data", -1
+        return items, f"{node_id}:{store}:{after}", failed_nodes
+
+    # Fetch up to limit songs of one store of a node, after the given hash: [(key, value, hash)].
+    def _scan_node(self, node: dict, store: str, after: int, limit: int) -> list:
+        if node["id"] == self.id:
+            return self.scan_local(store, after, limit)
+        url = f"http://{node['ip']}:{node['port']}/scan_local"
+        response = transport.get(url, params={"store": store, "after": str(after), "limit": limit}, timeout=5)
+        response.raise_for_status()
+        return [(item["key"], item["value"], int(item["hash"])) for item in response.json()["items"]]
+
+    # Up to limit songs of the local data ("data") or replica ("replica") store after the given hash.
+    def scan_local(self, store: str, after: int, limit: int) -> list:
+        source = self.data_store if store == "data" else self.replica_store
+        return [(key, str(values), key_hash) for key, values, key_hash in source.scan(after, limit)]
+
     # Corner case: If we need all the songs in the DHT ring, we can use a wildcard query.
-    # Go to each node in the ring and collect all the songs.
+    # Go to each node in the ring and collect all the songs (the ring walk for nodes without a membership view).
     def query_wildcard(self, origin=None):
         my_id = f"{self.ip}:{self.port}"
         if origin is None:
@@ -399,10 +1230,7 @@ class Node:
         print(f"[{my_id}] Processing wildcard query. Origin: {origin}")
 
         # Gather local songs separately from primary and replica stores.
-        node_songs = {
-            "original_songs": self.data_store,   # primary/original songs
-            "replica_songs": self.replica_store    # replica songs
-        }
+        node_songs = self.local_songs()
         # Create a result dict mapping this node to its songs.
         result = {my_id: node_songs}
 
@@ -417,7 +1245,7 @@ class Node:
         url = f"http://{self.successor['ip']}:{self.successor['port']}/query?key=*&origin={origin}"
         try:
             print(f"[{my_id}] Forwarding wildcard query to {successor_identifier} with origin {origin}.")
-            response = requests.get(url, timeout=3)
+            response = transport.get(url, timeout=3)
             if response.status_code == 200:
                 successor_data = response.json().get("all_songs", {})
             else:
@@ -433,92 +1261,87 @@ class Node:
 
 
     # Main method for deleting a key-value pair from the DHT.
-    def delete(self, key: str, origin: dict = None):
+    def delete(self, key: str, origin: dict = None, hops: int = 0, debug: bool = False, key_hash: int = None) -> (dict, str): # type: ignore
         if origin is None:
             # This node is the origin
-            request_id = str(uuid.uuid4())
-            event = threading.Event()
-            self.pending_requests[request_id] = {"event": event, "result": None}
-            origin = {"ip": self.ip, "port": self.port, "request_id": request_id}
+            origin, request_id = self._new_origin(debug)
             print(f"[{self.ip}:{self.port}] Origin delete request: {origin}")
+        else:
+            request_id = origin.get("request_id")
+        direct = origin.get("direct", False)
 
-        key_hash = self.compute_hash(key)
+        if key_hash is None:
+            key_hash = self.compute_hash(key)
 
         if self.is_responsible(key_hash):
-            # We are the responsible node => remove from our data_store
-            if key in self.data_store:
-                del self.data_store[key]
-                msg = f"Key '{key}' deleted from node {self.ip}:{self.port}."
-                result = True
-            else:
-                msg = f"Key '{key}' not found on node {self.ip}:{self.port}."
-                result = False
-
-            final_result = {
-                "result": result,
-                "message": msg,
-                "address": f"{self.ip}:{self.port}",
-                "data_store": self.data_store
-            }
+            chain = self.consistency_mode == "linearizability" and self.replication_factor > 1
+            quorum = self.consistency_mode == "quorum"
+            # In linearizability the delete is queued for chain replication in the same step (see insert).
+            with (self.chain.head_lock if chain else contextlib.nullcontext()):
+                # We are the responsible node => remove from our data_store
+                remove = lambda: self.data_store.pop(key, None) is not None
+                version = self._next_craq_version(key) if chain else None
+                if quorum:
+                    found, version, values = self.quorum.write_local(key, remove)
+                else:
+                    found = self._apply_versioned(key, version, remove)
+                if found:
+                    msg = f"Key '{key}' deleted from node {self.ip}:{self.port}."
+                    result, status = True, "deleted"
+                else:
+                    msg = f"Key '{key}' not found on node {self.ip}:{self.port}."
+                    result, status = False, "not_found"
+
+                final_result = self._write_ack(key, result, status, msg, hops, origin)
+                if chain:
+                    # Chain replication through the pipeline; the tail commits the delete and calls back the origin
+                    # (in direct mode it reports back to this node).
+                    entry = self._chain_entry("delete", key, None, origin, final_result, version)
+                    futures = self.chain.replicate([entry], wait=direct)
             print(f"[{self.ip}:{self.port}] {msg}")
 
-            # Now replicate the delete to other nodes
-            if self.replication_factor > 1:
-                if self.consistency_mode == "linearizability":
-                    # Synchronous chain replication
-                    replication_count = self.replication_factor - 1
-                    if replication_count > 0:
-                        # Forward the chain delete to successor
-                        successor_ip = self.successor["ip"]
-                        successor_port = self.successor["port"]
-                        url = f"http://{successor_ip}:{successor_port}/chain_replicate_delete"
-                        payload = {"key": key, "replication_count": replication_count}
-                        try:
-                            print(f"[{self.ip}:{self.port}] Forwarding chain replication delete for '{key}' to {successor_ip}:{successor_port}.")
-                            response = requests.post(url, json=payload, timeout=2)
-                            # Check ack
-                            ack = (response.status_code == 200 and response.json().get("ack", False))
-                            if not ack:
-                                final_result["result"] = False
-                                final_result["message"] += " Chain replication deletion failed."
-                                print(f"[{self.ip}:{self.port}] Chain replication deletion failed for key '{key}'.")
-                        except Exception as e:
-                            final_result["result"] = False
-                            final_result["message"] += f" Chain replication deletion failed: {e}"
-                else:
+            if chain:
+                if direct:
+                    return (self.chain.result(entry, futures[0]), None)
+            else:
+                # Now replicate the delete to other nodes
+                if quorum:
+                    # Quorum => wait until W of the N nodes of the key have the deletion
+                    acks = self.quorum.replicate([{"key": key, "version": version, "values": values}])
+                    self.quorum.finish_write(final_result, version, acks)
+                elif self.replication_factor > 1:
                     # Eventual => async replicate to the next node
-                    threading.Thread(target=self.async_replicate_delete, args=(key, self.replication_factor - 1)).start()
+                    self.async_replicate_delete(key, self.replication_factor - 1)
 
-            # Callback or return
-            # Send callback to the origin
-            callback_url = f"http://{origin['ip']}:{origin['port']}/delete_response"
-            try:
-                requests.post(callback_url, json={
-                    "request_id": origin["request_id"],
-                    "final_result": final_result
-                }, timeout=2)
-                print(f"[{self.ip}:{self.port}] Delete processed; callback sent to origin {origin['ip']}:{origin['port']}")
-            except Exception as e:
-                print(f"Error sending delete callback: {e}")
+                if direct:
+                    # Direct mode: the final result is the HTTP response itself.
+                    return (final_result, None)
+
+                # Callback or return
+                # Send callback to the origin
+                self._deliver_result(origin, "delete_response", final_result)
+                print(f"[{self.ip}:{self.port}] Delete processed; result sent to origin {origin['ip']}:{origin['port']}")
             if origin is None or (origin["ip"] == self.ip and origin["port"] == self.port):
                 # We are the origin and can return directly
                 print(f"[{self.ip}:{self.port}] Delete processed; returning final result.")
-                return final_result
+                return (final_result, request_id)
             else:
-                return {"result": True, "message": "Delete processed; callback sent to origin."}
+                return ({"result": True, "message": "Delete processed; callback sent to origin."}, request_id)
 
         else:
-            # Not responsible => forward to successor
-            successor_ip = self.successor["ip"]
-            successor_port = self.successor["port"]
-            url = f"http://{successor_ip}:{successor_port}/delete"
-            payload = {"key": key, "origin": origin}
+            # Not responsible => forward to the closest preceding finger
+            next_node = self.next_hop(key_hash)
+            url = f"http://{next_node['ip']}:{next_node['port']}/delete"
+            payload = {"key": key, "key_hash": key_hash, "origin": origin, "hops": hops + 1}
             try:
-                print(f"[{self.ip}:{self.port}] Forwarding delete request for key '{key}' to successor {successor_ip}:{successor_port}.")
-                requests.post(url, json=payload)
+                print(f"[{self.ip}:{self.port}] Forwarding delete request for key '{key}' to {next_node['ip']}:{next_node['port']}.")
+                response = self._forward("POST", url, direct, json=payload)
             except Exception as e:
-                return {"result": False, "error": f"Forwarding deletion failed: {e}"}
-            return {"result": True, "message": "Delete forwarded."}
+                return ({"result": False, "error": f"Forwarding deletion failed: {e}"}, request_id)
+            if direct:
+                # The responsible node answered with the final result.
+                return (response.json(), None)
+            return ({"result": True, "message": "Delete forwarded."}, request_id)
 
     def chain_replicate_delete(self, key: str, replication_count: int) -> bool:
         # Perform synchronous chain deletion replication for linearizability.
@@ -540,7 +1363,7 @@ class Node:
             payload = {"key": key, "replication_count": replication_count - 1}
             try:
                 print(f"[{self.ip}:{self.port}] Forwarding chain deletion for key '{key}' to {successor_ip}:{successor_port} (count={replication_count - 1}).")
-                response = requests.post(url, json=payload, timeout=2)
+                response = transport.post(url, json=payload, timeout=2)
                 if response.status_code == 200:
                     ack = response.json().get("ack", False)
                     return ack
@@ -563,25 +1386,34 @@ class Node:
             print(f"[{self.ip}:{self.port}] Asynchronously: Key '{key}' not found in replica store.")
 
         if replication_count > 0:
-            successor_ip = self.successor["ip"]
-            successor_port = self.successor["port"]
-            url = f"http://{successor_ip}:{successor_port}/async_replicate_delete"
-            payload = {"key": key, "replication_count": replication_count - 1}
-            try:
-                print(f"[{self.ip}:{self.port}] Forwarding async deletion for key '{key}' to {successor_ip}:{successor_port} with count {replication_count - 1}.")
-                requests.post(url, json=payload, timeout=2)
-            except Exception as e:
-                print(f"Error in async deletion replication: {e}")
+            print(f"[{self.ip}:{self.port}] Queueing async deletion for key '{key}' to {replication_count} replicas.")
+            self._replicate_to_holders(key, None, True, replication_count)
         else:
             return True
 
     def join(self, bootstrap_ip, bootstrap_port):
         # Main method for a node to join the ring.
-        # Non bootstrap node joining the ring. Send a POST request to the bootstrap node.
+        # Non bootstrap node joining the ring: pull the keys of its ranges (handoff.py), then let the bootstrap commit.
         url = f"http://{bootstrap_ip}:{bootstrap_port}/join"
-        payload = {'ip': self.ip, 'port': self.port, 'id': self.id}
+        payload = {'ip': self.ip, 'port': self.port, 'id': self.id, 'tokens': self.tokens}
+        session = f"join:{self.id}"
+        recovered = set(self.data_store.keys()) #Keys recovered from disk (persistence.py), kept if the join is retried
         try:
-            response = requests.post(url, json=payload)
+            for attempt in range(JOIN_ATTEMPTS):
+                response = transport.post(url, json=payload)
+                if response.status_code != 200:
+                    print(f"[{self.ip}:{self.port}] Join refused: {response.text}")
+                    return False
+                plan = response.json().get("handoff", [])
+                for source in plan:
+                    self.handoff.pull(source["node"], session, source["ranges"])
+                response = transport.post(f"http://{bootstrap_ip}:{bootstrap_port}/join_commit", json=dict(payload, handoff=plan, session=session))
+                if response.status_code not in (409, 503):
+                    break
+                print(f"[{self.ip}:{self.port}] Join not committed ({response.status_code}), pulling the keys again")
+                for key in [key for key in self.data_store.keys() if key not in recovered]:
+                    self.data_store.pop(key, None)
+                time.sleep(0.5 * (attempt + 1))
             if response.status_code == 200:
                 # After the bootstrap node responds, and has aprroved the join, the node can update its fields.
                 data = response.json()
@@ -589,97 +1421,40 @@ class Node:
                 self.predecessor = data.get('predecessor')
                 self.replication_factor = data.get("replication_factor")
                 self.consistency_mode = data.get("consistency")
+                self.response_mode = data.get("response_mode", self.response_mode)
+                self.read_mode = data.get("read_mode", self.read_mode)
+                self.quorum.configure(data.get("read_quorum", self.quorum.read_quorum), data.get("write_quorum", self.quorum.write_quorum))
+
+                # Keys written on the old owners while they were streamed
+                self.handoff.apply_changed(data.get("changed", {}), replace=True)
 
                 # Store the updated ring for later cleanup logic.
                 ring = data.get("ring", [])
-                self.ring = ring
-                
-                # Get transferred primary keys
-                transferred_data_store = data.get("data_store", {})
-                # And update local store
-                self.data_store.update(transferred_data_store)
-                
-                # For each key that became primary, start a new replication chain.
-                for key, value in transferred_data_store.items():
-                    threading.Thread(
-                        target=self.async_replicate_insert,
-                        args=(key, value, self.replication_factor - 1)
-                    ).start()
-                
-
-                transferred_replica_store = data.get("replica_store", {})
-                self.replica_store.update(transferred_replica_store)
-                # For each replica key, re-initiate replication from this node, exept for the keys in data_store.
-                for key, value in transferred_replica_store.items():
-                    if key not in transferred_data_store:
-                        threading.Thread(
-                            target=self.async_replicate_insert,
-                            args=(key, value, self.replication_factor - 1)
-                        ).start()
-                
-                # Cleanup replicas
-                for node_info in ring:
-                    node_ip = node_info["ip"]
-                    node_port = node_info["port"]
-                    cleanup_url = f"http://{node_ip}:{node_port}/cleanup_replicas_all"
-                    payload = {
-                        "ring": ring,
-                        "replication_factor": self.replication_factor
-                    }
-                    try:
-                        requests.post(cleanup_url, json=payload, timeout=2)
-                    except Exception as e:
-                        print(f"Error triggering cleanup on node {node_ip}:{node_port}: {e}")
+                self.update_membership(ring, data.get("ring_version", 0))
 
+                # The old owners keep the handed keys as replicas and anti-entropy fills in the rest.
+                # Only the nodes next to this one hold replicas that moved, so only they are asked to clean up.
+                affected = self.affected_nodes([n for n in self.ring if n["id"] != self.id], self.ring)
+                payload = {
+                    "ring": ring,
+                    "replication_factor": self.replication_factor
+                }
+                self.post_parallel(affected, "/cleanup_replicas_all", payload, "triggering cleanup on node")
 
-                print(f"[{self.ip}:{self.port}] Joined network")
-                print(f"[{self.ip}:{self.port}] Updated local data_store with keys: {list(transferred_data_store.keys())}")
+                print(f"[{self.ip}:{self.port}] Joined network with {len(self.data_store)} keys")
                 return True
             else:
+                print(f"[{self.ip}:{self.port}] Join commit failed: {response.text}")
                 return False
         except Exception as e:
             print("Error joining network:", e)
             return False
         
-    def cleanup_replicas(self, ring, replication_factor):
-        # Remove replica keys from this node's replica_store that are no longer valid
-        # according to the new ring ordering.
-        keys_to_remove = []
-        ring_len = len(ring)
-        for key in list(self.replica_store.keys()):
-            key_hash = self.compute_hash(key)
-            primary_index = None
-            # Find the first node whose id is >= key_hash.
-            for i, node in enumerate(ring):
-                if key_hash <= node["id"]:
-                    primary_index = i
-                    break
-            # If none found, the primary is the first node (wrap-around).
-            if primary_index is None:
-                primary_index = 0
-
-            # The valid replica holders are the next replication_factor-1 nodes after primary.
-            valid_replicas = []
-            for j in range(1, replication_factor):
-                valid_replicas.append(ring[(primary_index + j) % ring_len]["id"])
-
-            # If this node's id is not among the valid replica holders, delete the key.
-            if self.id not in valid_replicas:
-                keys_to_remove.append(key)
-
-        for key in keys_to_remove:
-            del self.replica_store[key]
-        if keys_to_remove:
-            print(f"[{self.ip}:{self.port}] Cleanup: removed replicas {keys_to_remove}")
-        else:
-            print(f"[{self.ip}:{self.port}] Cleanup: no replicas removed")
-
-        
     def pull_neighbors(self):
         # New method: the node can later pull updated neighbor info from the bootstrap.
         url = f"http://{self.bootstrap_ip}:{self.bootstrap_port}/get_neighbors"
         try:
-            response = requests.get(url)
+            response = transport.get(url)
             if response.status_code == 200:
                 data = response.json()
                 self.update_neighbors(data.get('successor'), data.get('predecessor'))
@@ -699,6 +1474,37 @@ class Node:
             print("Bootstrap node does not depart.")
             return False
 
+        # Hand the keys of our ranges over to the nodes that take them, in chunks (handoff.py).
+        # If a push fails the node stays: the sessions are cancelled and the ring is left as it is.
+        transfers = [(target, ranges, f"depart:{self.id}:{target['id']}") for target, ranges in self._departure_ranges()]
+        for target, ranges, session in transfers:
+            try:
+                sent = self.handoff.push(target, session, ranges)
+                print(f"[{self.ip}:{self.port}] Streamed {sent} keys to {target['ip']}:{target['port']}.")
+            except Exception as e:
+                print(f"Error transferring keys to {target['ip']}:{target['port']}, depart abandoned: {e}")
+                self._cancel_departure(transfers)
+                return False
+
+        # Ask the bootstrap to remove this node from the ring. If it does not, the node stays: the handoff sessions
+        # are cancelled and the stores and neighbours are left as they are.
+        try:
+            remove_url = f"http://{self.bootstrap_ip}:{self.bootstrap_port}/remove_node"
+            data = {
+                "id": self.id,
+                "ip": self.ip,
+                "port": self.port
+            }
+            remove_response = transport.post(remove_url, json=data)
+            remove_response.raise_for_status()
+            updated_ring = remove_response.json().get("ring", [])
+        except Exception as e:
+            updated_ring = self._removed_ring()
+            if updated_ring is None:
+                print(f"[{self.ip}:{self.port}] Failed to remove from ring, depart abandoned: {e}")
+                self._cancel_departure(transfers)
+                return False
+
         # Notify predecessor: update its successor pointer.
         try:
             pred_ip = self.predecessor["ip"]
@@ -708,7 +1514,7 @@ class Node:
                 "successor": self.successor,  # Predecessor's new successor becomes our successor.
                 "predecessor": self.predecessor.get("predecessor", {})
             }
-            requests.post(url, json=payload)
+            transport.post(url, json=payload)
             print(f"[{self.ip}:{self.port}] Notified predecessor at {pred_ip}:{pred_port}.")
         except Exception as e:
             print(f"Error updating predecessor: {e}")
@@ -722,73 +1528,29 @@ class Node:
                 "successor": self.successor.get("successor", {}),
                 "predecessor": self.predecessor  # New predecessor for successor becomes our predecessor.
             }
-            requests.post(url, json=payload)
+            transport.post(url, json=payload)
             print(f"[{self.ip}:{self.port}] Notified successor at {succ_ip}:{succ_port}.")
         except Exception as e:
             print(f"Error updating successor: {e}")
 
-        # Transfer all keys from our data_store (for which we are primary) to the successor.
-        try:
-            url = f"http://{succ_ip}:{succ_port}/absorb_keys"
-            payload = {
-                "keys": self.data_store,
-                "replication_factor": self.replication_factor
-            }
-            response = requests.post(url, json=payload)
-            if response.status_code == 200:
-                print(f"[{self.ip}:{self.port}] Keys transferred to successor {succ_ip}:{succ_port}.")
-            else:
-                print(f"[{self.ip}:{self.port}] Failed to transfer keys: {response.text}")
-        except Exception as e:
-            print(f"Error transferring keys to successor: {e}")
-
         print(f"[{self.ip}:{self.port}] Departing gracefully from the ring. Still in depart")
 
-        # Notify the bootstrap to remove this node from the ring.
-        updated_ring = []
-        try:
-            remove_url = f"http://{self.bootstrap_ip}:{self.bootstrap_port}/remove_node"
-            data = {
-                "id": self.id,
-                "ip": self.ip,
-                "port": self.port
-            }
-            remove_response = requests.post(remove_url, json=data)
-            if remove_response.status_code == 200:
-                updated_ring = remove_response.json().get("ring", [])
-                #print(f"[{self.ip}:{self.port}] Received updated ring: {updated_ring}") # DEBUG
-                
-                # Trigger cleanup on all nodes in the updated ring 
-                for node_info in updated_ring:
-                    node_ip = node_info["ip"]
-                    node_port = node_info["port"]
-                    cleanup_url = f"http://{node_ip}:{node_port}/cleanup_replicas_all"
-                    payload = {
-                        "ring": updated_ring,
-                        "replication_factor": self.replication_factor
-                    }
-                    try:
-                        requests.post(cleanup_url, json=payload, timeout=2)
-                    except Exception as e:
-                        print(f"Error triggering cleanup on node {node_ip}:{node_port}: {e}")
-                
-                # And then trigger a repair step to fill in missing replicas
-                for node_info in updated_ring:
-                    node_ip = node_info["ip"]
-                    node_port = node_info["port"]
-                    repair_url = f"http://{node_ip}:{node_port}/repair_replicas_all"
-                    payload = {
-                        "ring": updated_ring,
-                        "replication_factor": self.replication_factor
-                    }
-                    try:
-                        requests.post(repair_url, json=payload, timeout=2)
-                    except Exception as e:
-                        print(f"Error triggering repair on node {node_ip}:{node_port}: {e}")
-            else:
-                print(f"[{self.ip}:{self.port}] Failed to remove from ring: {remove_response.text}")
-        except Exception as e:
-            print(f"Error informing bootstrap to remove node: {e}")
+        # Ownership has switched: send the keys that changed while they were streamed
+        for target, ranges, session in transfers:
+            try:
+                self.handoff.finish(target, session, ranges)
+            except Exception as e:
+                print(f"Error finishing the handoff to {target['ip']}:{target['port']}: {e}")
+
+        # Trigger cleanup on the nodes next to this one (the only ones whose replicas moved), in parallel
+        affected = self.affected_nodes(self.ring, updated_ring)
+        payload = {
+            "ring": updated_ring,
+            "replication_factor": self.replication_factor
+        }
+        self.post_parallel(affected, "/cleanup_replicas_all", payload, "triggering cleanup on node")
+        # And then trigger a repair step to fill in missing replicas
+        self.post_parallel(affected, "/repair_replicas_all", payload, "triggering repair on node")
 
         # Clean up local stores.
         self.data_store.clear()
@@ -796,51 +1558,117 @@ class Node:
         print(f"[{self.ip}:{self.port}] Departed gracefully from the ring.")
         return True
 
+    # Ring of the bootstrap if it no longer contains this node, after a /remove_node request that got no answer
+    # (the bootstrap may have removed the node anyway); None if it still does or cannot be reached.
+    def _removed_ring(self):
+        url = f"http://{self.bootstrap_ip}:{self.bootstrap_port}/membership"
+        for attempt in range(DEPART_CHECKS):
+            try:
+                response = transport.get(url, timeout=MEMBERSHIP_TIMEOUT)
+                response.raise_for_status()
+                ring = response.json().get("ring", [])
+                return None if any(n["id"] == self.id for n in ring) else ring
+            except Exception as e:
+                print(f"[{self.ip}:{self.port}] Error checking the membership after the depart: {e}")
+                time.sleep(1 + attempt)
+        return None
+
+    # Cancel the handoff sessions of an abandoned depart, so the targets drop the chunks they absorbed.
+    def _cancel_departure(self, transfers):
+        for target, ranges, session in transfers:
+            try:
+                self.handoff.cancel(target, session, ranges)
+            except Exception as e:
+                print(f"Error cancelling the handoff to {target['ip']}:{target['port']}: {e}")
+
+    # (node, ranges) pairs: the primary ranges of this node grouped by the node that takes them over when it departs:
+    # the successor, or with virtual nodes the owner of each token range once our tokens are gone.
+    def _departure_ranges(self):
+        ranges = self.primary_ranges()
+        others = [node for node in self.ring if node["id"] != self.id]
+        if not self.vnodes_active or not others:
+            return [(self.successor, ranges)] if ranges else []
+        token_ids, owners = token_ring(others)
+        grouped = {}
+        for start, end in ranges:
+            owner = owners[owner_index(token_ids, end)]
+            grouped.setdefault(owner["id"], (owner, []))[1].append((start, end))
+        return list(grouped.values())
+
     def cleanup_replicas(self, ring, replication_factor):
-        # For each key in the replica_store, determine its valid replica holders.
-        # If this node's id is not among the valid ones, remove the replica.
-        keys_to_remove = []
+        # A node at ring position m holds replicas for the keys in (ring[m-rf].id, ring[m-1].id].
+        # Every replica outside this range is cut out of the hash index of the replica_store.
         ring_len = len(ring)
-        for key in list(self.replica_store.keys()):
-            key_hash = self.compute_hash(key)
-            # Determine the primary for the key.
-            primary_index = None
-            for i, node in enumerate(ring):
-                if key_hash <= node["id"]:
-                    primary_index = i
-                    break
-            if primary_index is None:
-                primary_index = 0
-            # Expected replica holders are the next replication_factor-1 nodes.
-            valid_replicas = []
-            for j in range(1, replication_factor):
-                valid_replicas.append(ring[(primary_index + j) % ring_len]["id"])
-            if self.id not in valid_replicas:
-                keys_to_remove.append(key)
-        for key in keys_to_remove:
-            del self.replica_store[key]
-        if keys_to_remove:
-            print(f"[{self.ip}:{self.port}] Cleanup: removed replicas {keys_to_remove}")
+        my_index = next((i for i, node in enumerate(ring) if node["id"] == self.id), None)
+        if my_index is None or replication_factor <= 1:
+            # Not part of the ring or no replication: no replica is valid.
+            removed = self.replica_store.drain()
+        elif replication_factor - 1 >= ring_len:
+            # Every node holds a replica of every key.
+            removed = {}
+        elif has_vnodes(ring):
+            # Virtual nodes: keep the token ranges whose chain has this node after the owner, cut out the others.
+            token_ids, owners = token_ring(ring)
+            removed = {}
+            for start, end, holders in token_ranges(token_ids, owners, replication_factor):
+                if all(node["id"] != self.id for node in holders[1:]):
+                    removed.update(self.replica_store.pop_range(start, end))
+        else:
+            valid_start = ring[(my_index - replication_factor) % ring_len]["id"]
+            valid_end = ring[(my_index - 1) % ring_len]["id"]
+            # The complement of (valid_start, valid_end] on the circle is (valid_end, valid_start].
+            removed = self.replica_store.pop_range(valid_end, valid_start)
+
+        if removed:
+            print(f"[{self.ip}:{self.port}] Cleanup: removed replicas {list(removed.keys())}")
         else:
             print(f"[{self.ip}:{self.port}] Cleanup: no replicas removed")
 
     def repair_replicas(self, ring, replication_factor):
-        # For each key in this node's data_store, re-initiate replication so that
-        # the next replication_factor-1 nodes in the ring get the replica if they don't have it.
-        # Find this node's position in the ring.
-        primary_index = None
-        for i, node in enumerate(ring):
-            if node["id"] == self.id:
-                primary_index = i
-                break
-        if primary_index is None:
+        # Make sure the next replication_factor-1 nodes hold the replicas of this node's keys,
+        # with an anti-entropy round right away (anti_entropy.py).
+        if all(node["id"] != self.id for node in ring):
             return
-        # Show ring:
-        # print(f"[{self.ip}:{self.port}] Repair: Ring: {ring}") # DEBUG
-
-        #self.update_local_pointers(ring)
-        for key, value in self.data_store.items():
-            # Trigger asynchronous replication chain for each key.
-            # This will push the key to the next (replication_factor-1) nodes.
-            self.async_replicate_insert(key, value, replication_factor - 1)
-        #print(f"[{self.ip}:{self.port}] Repair: Re-initiated replication for keys: {list(self.data_store.keys())}") # DEBUG
+        threading.Thread(target=self.anti_entropy.run, daemon=True).start()
+
+    # Apply an anti-entropy repair from the primary of a range: replace the replicas of the keys in values and drop the
+    # deleted ones, except the keys updated here after version and the keys this node is primary for.
+    def apply_merkle_repair(self, values: dict, deleted: list, version: int = None):
+        self.clock.update(version)
+        repaired = sum(1 for key, key_values in values.items() if self._apply_repair(key, key_values, version))
+        removed = sum(1 for key in deleted if self._apply_repair(key, None, version))
+        skipped = len(values) + len(deleted) - repaired - removed
+        print(f"[{self.ip}:{self.port}] Anti-entropy repair: {repaired} replicas replaced, {removed} removed, {skipped} newer kept.")
+
+    # Replace the replica of key with values (None: remove it) unless it was updated after version. Returns True if applied.
+    def _apply_repair(self, key: str, values, version: int):
+        if key in self.data_store:
+            return False
+        if self.consistency_mode == "quorum" and version:
+            return self.quorum.apply(key, version, values)
+        if values is None:
+            write = lambda: self.replica_store.pop(key, None)
+        else:
+            write = lambda: self.replica_store.update({key: ValueList(values)})
+        return self.replica_versions.replace(key, version, write)
+
+    # Store values as the replica of key unless this node is primary for it.
+    def _replace_replica(self, key: str, values: list):
+        if key not in self.data_store:
+            self.replica_store[key] = ValueList(values)
+
+    # Anti-entropy with linearizability: send the current values of keys down the chain, behind the writes already
+    # queued (read under the head lock). Every replica of the chain takes them. Returns the number of keys sent.
+    def repair_through_chain(self, keys: list) -> int:
+        if self.replication_factor <= 1:
+            return 0
+        with self.chain.head_lock:
+            entries = []
+            for key in keys:
+                value = self.data_store.get(key)
+                if value is not None:
+                    entries.append({"op": "repair", "key": key, "value": value.to_list(),
+                                    "replication_count": self.replication_factor - 2, "origin": None, "final_result": {}})
+            if entries:
+                self.chain.replicate(entries)
+        return len(entries)
@@ -0,0 +1,252 @@
+# persistence.py
+import gc
+import json
+import os
+import threading
+import time
+from snapshot import MappedSnapshot, write_snapshot
+from values import store_from_wire
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+# Optional on-disk persistence of the node stores: a write-ahead log (group commit, fsync always / interval / never)
+# plus periodic snapshots. snapshot-G holds everything of the logs before generation G.
+
+class PersistenceEngine:
+    def __init__(self, data_dir, fsync="interval", fsync_interval=0.05, snapshot_every=100000):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}")
+        self.data_dir = data_dir #Directory of the log and snapshot files
+        self.fsync = fsync #fsync policy, see above
+        self.fsync_interval = fsync_interval #Seconds between fsyncs ("interval") and between writer wake-ups
+        self.snapshot_every = snapshot_every #Log records between two snapshots (0 disables automatic snapshots)
+        self.stores = {} #Name in the log records -> HashIndexedStore
+        self.cond = threading.Condition() #Guards the buffer and the sequence numbers
+        self.write_lock = threading.Lock() #Held while a batch is written or the log is rotated
+        self.buffer = [] #Encoded records not written yet
+        self.appended = 0 #Sequence number of the last appended record
+        self.durable = 0 #Sequence number of the last record written (and fsynced, as the policy requires)
+        self.records_since_snapshot = 0
+        self.generation = 0 #Generation of the current log file
+        self.log_file = None
+        self.running = False
+        self.writer_thread = None
+        self.snapshot_thread = None
+        self.batches = 0 #Number of group commits
+        self.fsyncs = 0
+        self.snapshots = 0
+        self.recovery = None #Statistics of the last recovery
+        self.mapped = [] #Snapshots mapped as base layers of the stores, closed by close()
+        os.makedirs(data_dir, exist_ok=True)
+
+    def _path(self, kind, generation, extension=None):
+        extension = extension or ("log" if kind == "wal" else "snap")
+        return os.path.join(self.data_dir, f"{kind}-{generation:08d}.{extension}")
+
+    # Generations of the existing "wal" or "snapshot" files, sorted.
+    # Snapshots of the earlier JSON format ("snapshot-G.json") count as well.
+    def _generations(self, kind):
+        generations = []
+        for name in os.listdir(self.data_dir):
+            if name.startswith(kind + "-") and not name.endswith(".tmp"):
+                try:
+                    generations.append(int(name[len(kind) + 1:].split(".")[0]))
+                except ValueError:
+                    pass
+        return sorted(generations)
+
+    # Load the latest snapshot and replay the logs after it into the (empty, unjournaled) stores.
+    def recover(self, stores):
+        start = time.perf_counter()
+        # Recovery allocates one container per key; the cyclic collector would rescan them over and over.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._recover(stores, start)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _recover(self, stores, start):
+        self.stores = stores
+        snapshots = self._generations("snapshot")
+        base = snapshots[-1] if snapshots else 0
+        if snapshots and os.path.exists(self._path("snapshot", base)):
+            snapshot = MappedSnapshot(self._path("snapshot", base))
+            self.mapped.append(snapshot)
+            for name, store in stores.items():
+                section = snapshot.section(name)
+                if section is not None:
+                    store.attach_base(section)
+        elif snapshots:
+            with open(self._path("snapshot", base, "json"), "r") as f:
+                snapshot = json.load(f)
+            for name, store in stores.items():
+                store.load(store_from_wire(snapshot.get(name, {})))
+
+        replayed = 0
+        logs = [g for g in self._generations("wal") if g >= base]
+        for generation in logs:
+            with open(self._path("wal", generation), "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash: the record never became durable.
+                        print(f"[persistence] Ignoring incomplete record at the end of {self._path('wal', generation)}")
+                        break
+                    stores[record[1]].apply(record[0], record[2:])
+                    replayed += 1
+        for store in stores.values():
+            store.rebuild_index()
+
+        self.generation = max([base] + logs) + 1
+        self.recovery = {
+            "seconds": round(time.perf_counter() - start, 3),
+            "snapshot_generation": base if snapshots else None,
+            "replayed_records": replayed,
+            "keys": {name: len(store) for name, store in stores.items()}
+        }
+        return self.recovery
+
+    # Open a new log generation, start the writer and attach the journal to the stores.
+    def start(self):
+        self.log_file = open(self._path("wal", self.generation), "a")
+        self.running = True
+        self.writer_thread = threading.Thread(target=self._writer, daemon=True)
+        self.writer_thread.start()
+        if self.snapshot_every:
+            self.snapshot_thread = threading.Thread(target=self._snapshotter, daemon=True)
+            self.snapshot_thread.start()
+        for name, store in self.stores.items():
+            store.attach_journal(self, name)
+
+    # Append a record, returns its sequence number (called by the stores with their lock held).
+    def append(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self.cond:
+            self.buffer.append(line)
+            self.appended += 1
+            if self.fsync == "always":
+                self.cond.notify_all()
+            return self.appended
+
+    # With the "always" policy, block until the record seq is fsynced.
+    def wait_durable(self, seq):
+        if self.fsync != "always":
+            return
+        with self.cond:
+            while self.durable < seq and self.running:
+                self.cond.wait()
+
+    # Write the buffered records to the current log (write_lock held).
+    def _write_pending(self, force_sync=False):
+        with self.cond:
+            batch, self.buffer = self.buffer, []
+            upto = self.appended
+        if batch:
+            self.log_file.write("".join(batch))
+            self.log_file.flush()
+            self.batches += 1
+        synced = False
+        if force_sync or (batch and self.fsync == "always"):
+            os.fsync(self.log_file.fileno())
+            synced = True
+        with self.cond:
+            self.durable = max(self.durable, upto)
+            self.records_since_snapshot += len(batch)
+            self.cond.notify_all()
+        return synced
+
+    def _writer(self):
+        last_sync = time.monotonic()
+        while True:
+            with self.cond:
+                if not self.buffer and self.running:
+                    self.cond.wait(timeout=self.fsync_interval)
+                running = self.running
+            with self.write_lock:
+                due = self.fsync == "interval" and time.monotonic() - last_sync >= self.fsync_interval
+                if self._write_pending(force_sync=due):
+                    self.fsyncs += 1
+                    last_sync = time.monotonic()
+            if not running:
+                return
+
+    def _snapshotter(self):
+        while self.running:
+            time.sleep(1)
+            if self.records_since_snapshot >= self.snapshot_every:
+                try:
+                    self.snapshot()
+                except Exception as e:
+                    print(f"[persistence] Snapshot failed: {e}")
+
+    # Write a snapshot of the stores and start a new log generation.
+    def snapshot(self):
+        names = sorted(self.stores)
+        for name in names:
+            self.stores[name].lock.acquire()
+        try:
+            # No store can change now: the records so far go to the old log, the state is copied,
+            # and every later record goes to the new log.
+            with self.write_lock:
+                self._write_pending(force_sync=True)
+                self.log_file.close()
+                self.generation += 1
+                generation = self.generation
+                self.log_file = open(self._path("wal", generation), "a")
+                with self.cond:
+                    self.records_since_snapshot = 0
+            state = {name: self.stores[name].snapshot_entries() for name in names}
+        finally:
+            for name in reversed(names):
+                self.stores[name].lock.release()
+
+        tmp_path = self._path("snapshot", generation) + ".tmp"
+        write_snapshot(tmp_path, state)
+        os.replace(tmp_path, self._path("snapshot", generation))
+        # The new snapshot covers all older snapshots and logs. A snapshot that is still mapped as a base layer
+        # can be removed as well: the mapping keeps its pages until close().
+        for name in os.listdir(self.data_dir):
+            kind, _, rest = name.partition("-")
+            if kind in ("snapshot", "wal") and not name.endswith(".tmp"):
+                try:
+                    if int(rest.split(".")[0]) < generation:
+                        os.remove(os.path.join(self.data_dir, name))
+                except (ValueError, OSError):
+                    pass
+        self.snapshots += 1
+        print(f"[persistence] Snapshot {generation} written: " + ", ".join(f"{name}={len(state[name])} keys" for name in names))
+        return generation
+
+    # Flush the remaining records, stop the writer and unmap the snapshots.
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.writer_thread is not None:
+            self.writer_thread.join()
+        if self.log_file is not None:
+            with self.write_lock:
+                self._write_pending(force_sync=self.fsync != "never")
+                self.log_file.close()
+        # The stores must not be used any more: their base layers are unmapped.
+        for snapshot in self.mapped:
+            snapshot.close()
+        self.mapped = []
+
+    def stats(self):
+        with self.cond:
+            return {
+                "data_dir": self.data_dir,
+                "fsync": self.fsync,
+                "generation": self.generation,
+                "appended": self.appended,
+                "durable": self.durable,
+                "batches": self.batches,
+                "fsyncs": self.fsyncs,
+                "snapshots": self.snapshots,
+                "records_since_snapshot": self.records_since_snapshot,
+                "recovery": self.recovery
+            }
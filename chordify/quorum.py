@@ -0,0 +1,201 @@
+# quorum.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+from transport import transport
+from values import ValueList
+
+QUORUM_READ = 2 # Default R: replies a read waits for
+QUORUM_WRITE = 2 # Default W: acknowledgements (the coordinator's included) a write waits for
+QUORUM_TIMEOUT = 3 # Seconds a coordinator waits for its quorum
+QUORUM_WORKERS = 32 # Threads sending the quorum requests of this node
+
+# Error message if R or W is not a count between 1 and N = replication_factor, else None.
+def quorum_error(read_quorum, write_quorum, replication_factor):
+    for name, value in (("read_quorum", read_quorum), ("write_quorum", write_quorum)):
+        if not isinstance(value, int) or isinstance(value, bool) or not 1 <= value <= replication_factor:
+            return f"{name} must be an integer between 1 and the replication factor ({replication_factor}), got {value!r}"
+    return None
+
+# Dynamo-style quorum replication (consistency_mode "quorum"): the owner of a key coordinates its writes and waits
+# for W of its N nodes, any node coordinates a read from R of them. A node only applies a newer version of a key.
+
+class QuorumReplication:
+    def __init__(self, node, read_quorum=QUORUM_READ, write_quorum=QUORUM_WRITE):
+        self.node = node
+        self.read_quorum = read_quorum #R
+        self.write_quorum = write_quorum #W
+        self.versions = {} #Key -> version of its state on this node (deleted keys keep theirs)
+        self.lock = threading.Lock() #Makes a write to the stores and its version one step
+        self.executor = ThreadPoolExecutor(max_workers=QUORUM_WORKERS)
+        self.stats_lock = threading.Lock()
+        self.writes = 0
+        self.reads = 0
+        self.failed_writes = 0 #Writes acknowledged by fewer than W nodes
+        self.failed_reads = 0 #Reads answered by fewer than R nodes
+        self.repairs = 0 #Newer states sent to nodes that answered a read with an older one
+
+    def configure(self, read_quorum, write_quorum):
+        self.read_quorum = read_quorum
+        self.write_quorum = write_quorum
+
+    # Apply a write at the owner with write() and give the key its next version.
+    # Returns (result of write(), version, values of the key after it or None).
+    def write_local(self, key, write):
+        with self.lock:
+            result = write()
+            self.node.clock.update(self.versions.get(key, 0)) # The next timestamp is newer than the key's version
+            version = self.node.clock.now()
+            self.versions[key] = version
+            value = self.node.data_store.get(key)
+            return result, version, value.to_list() if value is not None else None
+
+    # Store a state of key sent by a coordinator if it is newer than the local one. Returns True if it was applied.
+    def apply(self, key, version, values):
+        self.node.clock.update(version)
+        with self.lock:
+            if version <= self.versions.get(key, 0):
+                return False
+            self.versions[key] = version
+            node = self.node
+            owner = key in node.data_store or ("id" in node.predecessor and node.is_responsible(node.compute_hash(key)))
+            store = node.data_store if owner else node.replica_store
+            if values is None:
+                store.pop(key, None)
+            else:
+                store[key] = ValueList(values)
+            return True
+
+    # (version, values) of key on this node.
+    def local_state(self, key):
+        with self.lock:
+            value = self.node.data_store.get(key, self.node.replica_store.get(key, None))
+            return self.versions.get(key, 0), value.to_list() if value is not None else None
+
+    # Send written states ({"key", "version", "values"} dicts) from the owner to the other nodes of its keys and wait
+    # until W nodes, the owner included, have them. Returns the smallest number of acknowledgements over the holders.
+    def replicate(self, writes):
+        node = self.node
+        groups = {} #Ids of the holders -> (holders, writes sent to them)
+        for write in writes:
+            holders = node._replica_holders(node.replication_factor - 1, node.compute_hash(write["key"])) or []
+            groups.setdefault(tuple(holder["id"] for holder in holders), (holders, []))[1].append(write)
+        sent = [(holders, [self.executor.submit(self._send_writes, holder, group) for holder in holders]) for holders, group in groups.values()]
+        deadline = time.monotonic() + QUORUM_TIMEOUT
+        acks = min((self._wait(holders, futures, deadline) for holders, futures in sent), default=1)
+        needed = min(self.write_quorum, node.replication_factor)
+        with self.stats_lock:
+            self.writes += len(writes)
+            if acks < needed:
+                self.failed_writes += len(writes)
+        return acks
+
+    # Wait until the holders of a group of writes reach the write quorum (or the deadline). Returns the acknowledgements.
+    def _wait(self, holders, futures, deadline):
+        needed = min(self.write_quorum, len(holders) + 1) - 1
+        acks = 1
+        try:
+            for future in (as_completed(futures, timeout=max(0, deadline - time.monotonic())) if needed > 0 else ()):
+                if future.result():
+                    acks += 1
+                if acks - 1 >= needed:
+                    break
+        except FutureTimeoutError:
+            pass
+        return acks
+
+    # Acknowledgement of a quorum write: the version of the key, and a failure if fewer than W nodes have it.
+    def finish_write(self, ack, version, acks):
+        ack["version"] = version
+        ack["acks"] = acks
+        write_quorum = min(self.write_quorum, self.node.replication_factor)
+        if acks < write_quorum:
+            ack["result"] = False
+            ack["error"] = f"Write quorum not reached ({acks}/{write_quorum} acknowledgements)."
+        return ack
+
+    def _send_writes(self, holder, writes):
+        url = f"http://{holder['ip']}:{holder['port']}/quorum_write"
+        try:
+            response = transport.post(url, json={"writes": writes}, timeout=QUORUM_TIMEOUT)
+            response.raise_for_status()
+            return True
+        except Exception as e:
+            print(f"[{self.node.ip}:{self.node.port}] Error in quorum write to {holder['ip']}:{holder['port']}: {e}")
+            return False
+
+    def _fetch(self, holder, key):
+        if holder["id"] == self.node.id:
+            return self.local_state(key)
+        url = f"http://{holder['ip']}:{holder['port']}/quorum_read"
+        response = transport.get(url, params={"key": key}, timeout=QUORUM_TIMEOUT)
+        response.raise_for_status()
+        data = response.json()
+        return data["version"], data["values"]
+
+    # Read key from R of its N nodes and answer with the newest state, repairing the nodes that are behind.
+    # Returns the query result, or None without a membership view.
+    def read(self, key, key_hash, hops):
+        holders = []
+        for holder in self.node.lookup_chain(key_hash):
+            if all(holder["id"] != other["id"] for other in holders):
+                holders.append(holder)
+        if not holders:
+            return None
+        needed = min(self.read_quorum, len(holders))
+        futures = {self.executor.submit(self._fetch, holder, key): holder for holder in holders}
+        replies = [] #(holder, version, values)
+        try:
+            for future in as_completed(futures, timeout=QUORUM_TIMEOUT):
+                try:
+                    version, values = future.result()
+                except Exception as e:
+                    holder = futures[future]
+                    print(f"[{self.node.ip}:{self.node.port}] Error in quorum read from {holder['ip']}:{holder['port']}: {e}")
+                    continue
+                replies.append((futures[future], version, values))
+                if len(replies) >= needed:
+                    break
+        except FutureTimeoutError:
+            pass
+        with self.stats_lock:
+            self.reads += 1
+            if len(replies) < needed:
+                self.failed_reads += 1
+        if len(replies) < needed:
+            return {"result": False, "error": f"Read quorum not reached ({len(replies)}/{needed} replies).", "key": key, "hops": hops}
+
+        _, version, values = max(replies, key=lambda reply: reply[1])
+        stale = [holder for holder, other, _ in replies if other < version]
+        if stale:
+            with self.stats_lock:
+                self.repairs += len(stale)
+            write = [{"key": key, "version": version, "values": values}]
+            for holder in stale:
+                if holder["id"] == self.node.id:
+                    self.apply(key, version, values)
+                else:
+                    self.executor.submit(self._send_writes, holder, write)
+        if values is None:
+            return {"result": False, "error": "Song not found", "key": key, "hops": hops}
+        return {
+            "Result from": f"{self.node.ip}:{self.node.port}",
+            "Status": "Quorum Read",
+            "Key": key,
+            "result": str(ValueList(values)),
+            "version": version,
+            "replies": len(replies),
+            "hops": hops
+        }
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "read_quorum": self.read_quorum,
+                "write_quorum": self.write_quorum,
+                "writes": self.writes,
+                "reads": self.reads,
+                "failed_writes": self.failed_writes,
+                "failed_reads": self.failed_reads,
+                "repairs": self.repairs
+            }
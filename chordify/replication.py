@@ -0,0 +1,171 @@
+# replication.py
+import threading
+import time
+from collections import OrderedDict, deque
+from transport import transport
+
+REPLICATION_WORKERS = 4 # Threads sending replication batches (shared by all targets)
+REPLICATION_MAX_BATCH = 256 # Keys sent to a target in one request
+REPLICATION_TIMEOUT = 10 # Seconds a batch request may take
+REPLICATION_RETRIES = 3 # Times a failed update is queued again before it is dropped
+REPLICATION_BACKOFF = 0.5 # Seconds before the first retry to a target, doubled with every further attempt
+
+# Asynchronous replication for eventual consistency: updates are queued per target, merged per key while they wait
+# and sent as /replicate_batch requests. An update is a dict with key, values, delete, replication_count and version.
+
+class ReplicationQueue:
+    def __init__(self, node, workers=REPLICATION_WORKERS, max_batch=REPLICATION_MAX_BATCH):
+        self.node = node
+        self.workers = workers
+        self.max_batch = max_batch
+        self.pending = {} #(ip, port) of a target -> OrderedDict key -> update waiting to be sent
+        self.ready = deque() #Targets with pending updates and no batch in flight, in the order they got work
+        self.busy = set() #Targets with a batch in flight
+        self.queued_at = {} #(ip, port, key) -> time.monotonic() of the first update merged into the pending one
+        self.cond = threading.Condition()
+        self.started = False
+        self.queued = 0 #Updates submitted
+        self.coalesced = 0 #Updates merged into one already waiting
+        self.batches = 0
+        self.sent = 0 #Updates sent
+        self.attempts = {} #(ip, port, key) -> failed sends of the pending update of key
+        self.retries = 0 #Updates queued again after a failed batch
+        self.failures = 0 #Updates dropped after REPLICATION_RETRIES failed batches
+        self.total_lag = 0.0 #Seconds the sent updates waited in the queue
+        self.max_lag = 0.0
+
+    # Set the number of worker threads and the batch size (before the first update is submitted).
+    def configure(self, workers, max_batch):
+        self.workers = workers
+        self.max_batch = max_batch
+
+    def _start(self):
+        self.started = True
+        for _ in range(self.workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    # Queue an update of key for each of targets (default: the current successor of the node).
+    # A new write is stamped here, with the queue locked, so the versions of a key follow the order it is sent in.
+    def submit(self, key, values=None, delete=False, replication_count=0, targets=None, version=None):
+        nodes = targets or [self.node.successor]
+        if any("ip" not in node for node in nodes):
+            print(f"[{self.node.ip}:{self.node.port}] Error: No successor found for async replication.")
+            return False
+        with self.cond:
+            if not self.started:
+                self._start()
+            version = version or self.node.clock.now()
+            for node in nodes:
+                target = (node["ip"], node["port"])
+                self.queued += 1
+                updates = self.pending.setdefault(target, OrderedDict())
+                update = updates.get(key)
+                if update is None:
+                    updates[key] = {"key": key, "values": list(values or []), "delete": delete, "replication_count": replication_count, "version": version}
+                    self.queued_at[target + (key,)] = time.monotonic()
+                else:
+                    self.coalesced += 1
+                    if delete:
+                        update["delete"] = True
+                        update["values"] = []
+                    for value in values or []:
+                        if value not in update["values"]:
+                            update["values"].append(value)
+                    update["replication_count"] = max(update["replication_count"], replication_count)
+                    update["version"] = max(update["version"], version)
+                if target not in self.busy and target not in self.ready:
+                    self.ready.append(target)
+                    self.cond.notify()
+        return True
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.ready:
+                    self.cond.wait()
+                target = self.ready.popleft()
+                self.busy.add(target)
+                updates = self.pending[target]
+                batch = [updates.popitem(last=False)[1] for _ in range(min(self.max_batch, len(updates)))]
+                if not updates:
+                    del self.pending[target]
+                now = time.monotonic()
+                for update in batch:
+                    lag = now - self.queued_at.pop(target + (update["key"],), now)
+                    self.total_lag += lag
+                    self.max_lag = max(self.max_lag, lag)
+            failed = self._send_batch(target, batch)
+            if failed:
+                self._retry(target, failed)
+            with self.cond:
+                self.busy.discard(target)
+                if target in self.pending:
+                    self.ready.append(target)
+                    self.cond.notify()
+
+    def _send_batch(self, target, batch):
+        url = f"http://{target[0]}:{target[1]}/replicate_batch"
+        try:
+            response = transport.post(url, json={"updates": batch}, timeout=REPLICATION_TIMEOUT)
+            response.raise_for_status()
+            failed = []
+        except Exception as e:
+            print(f"[{self.node.ip}:{self.node.port}] Error in async replication to {target[0]}:{target[1]}: {e}")
+            failed = batch
+        with self.cond:
+            self.batches += 1
+            self.sent += len(batch) - len(failed)
+            if not failed:
+                for update in batch:
+                    self.attempts.pop(target + (update["key"],), None)
+        return failed
+
+    # Queue the updates of a failed batch again, after a backoff (the target stays busy, so nothing overtakes them).
+    # An update queued for the same key meanwhile is newer: it is merged on top of the failed one.
+    def _retry(self, target, batch):
+        with self.cond:
+            attempts = max(self.attempts.get(target + (update["key"],), 0) for update in batch) + 1
+        time.sleep(REPLICATION_BACKOFF * 2 ** (attempts - 1))
+        with self.cond:
+            updates = self.pending.setdefault(target, OrderedDict())
+            for update in reversed(batch):
+                key = update["key"]
+                attempts = self.attempts.pop(target + (key,), 0) + 1
+                if attempts > REPLICATION_RETRIES:
+                    print(f"[{self.node.ip}:{self.node.port}] Dropping the update of {key} for {target[0]}:{target[1]} after {REPLICATION_RETRIES} retries.")
+                    self.failures += 1
+                    continue
+                newer = updates.get(key)
+                if newer is not None and not newer["delete"]:
+                    newer["delete"] = update["delete"]
+                    newer["values"] = update["values"] + [value for value in newer["values"] if value not in update["values"]]
+                    newer["replication_count"] = max(newer["replication_count"], update["replication_count"])
+                elif newer is None:
+                    updates[key] = update
+                    updates.move_to_end(key, last=False)
+                self.attempts[target + (key,)] = attempts
+                self.queued_at.setdefault(target + (key,), time.monotonic())
+                self.retries += 1
+            if not updates:
+                del self.pending[target]
+
+    def stats(self):
+        with self.cond:
+            now = time.monotonic()
+            oldest = min(self.queued_at.values(), default=now)
+            return {
+                "workers": self.workers,
+                "depth": sum(len(updates) for updates in self.pending.values()),
+                "in_flight": len(self.busy),
+                "queued": self.queued,
+                "coalesced": self.coalesced,
+                "batches": self.batches,
+                "sent": self.sent,
+                "retries": self.retries,
+                "failures": self.failures,
+                "avg_batch": round(self.sent / self.batches, 2) if self.batches else 0.0,
+                "avg_lag_ms": round(self.total_lag * 1000 / (self.sent + self.failures + self.retries), 2) if self.sent + self.failures + self.retries else 0.0,
+                "max_lag_ms": round(self.max_lag * 1000, 2),
+                "oldest_pending_ms": round((now - oldest) * 1000, 2),
+                "targets": {f"{ip}:{port}": len(updates) for (ip, port), updates in self.pending.items()}
+            }
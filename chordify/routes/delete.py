@@ -1,6 +1,6 @@
 from flask import Blueprint, request, jsonify, current_app
 import threading
-import requests
+from hashing import parse_hash
 
 delete_bp = Blueprint('delete', __name__)
 
@@ -8,27 +8,26 @@ delete_bp = Blueprint('delete', __name__)
 def delete():
     """
     Endpoint for initiating a delete request.
-    The origin node sets up a pending request and waits for a callback.
+    In callback mode the origin node sets up a pending request and waits for a callback.
+    In direct mode the final result is already in the response of the forwarding chain.
     """
     node = current_app.config["NODE"]
     data = request.get_json()
     key = data.get("key")
     origin = data.get("origin")  # may be None or provided
+    hops = data.get("hops", 0)  # number of forwarding hops so far
+    debug = bool(data.get("debug", False))  # include the data_store of the responsible node in the response
+    key_hash = parse_hash(data.get("key_hash"))  # hash computed by the previous hop, if forwarded
 
-    response = node.delete(key, origin)
+    response, req_id = node.delete(key, origin, hops, debug, key_hash)
     
-    if origin is None:
+    if origin is None and req_id is not None:
         # The origin node waits for the callback with the final result.
-        req_id = list(node.pending_requests.keys())[-1]
-        pending = node.pending_requests[req_id]
-
         # Wait for up to 3 seconds for the responsible node to callback
-        if pending["event"].wait(timeout=3):
-            final_result = pending["result"]
-            del node.pending_requests[req_id]
+        final_result = node.wait_for_result(req_id, timeout=3)
+        if final_result is not None:
             return jsonify(final_result), 200
         else:
-            del node.pending_requests[req_id]
             return jsonify({"result": False, "error": "Timeout waiting for deletion callback"}), 504
     else:
         return jsonify(response), 200
@@ -45,10 +44,8 @@ def delete_response():
     final_result = data.get("final_result")
     print(f"Received delete response for request_id {req_id}")
 
-# if the request_id exists in the pending_requests dict of the node instance then set the result and event
-    if req_id in node.pending_requests:
-        node.pending_requests[req_id]["result"] = final_result
-        node.pending_requests[req_id]["event"].set()
+# if the request_id exists in the pending_requests dict of the node instance then complete its future
+    if node.complete_request(req_id, final_result):
         print(f"Delete callback processed successfully for {req_id}")
         return jsonify({"result": True, "message": "Callback received."}), 200
     else:
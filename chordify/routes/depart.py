@@ -2,6 +2,9 @@
 from flask import Blueprint, request, jsonify, current_app
 import threading, time, os
 import requests
+from transport import transport
+from merkle import range_digests, bucket_digests
+from routes.join import join_lock
 
 depart_bp = Blueprint('depart', __name__)
 
@@ -20,6 +23,10 @@ def remove_node():
     rm_port = data.get("port")
     print(f"[Bootstrap] Removing node: {rm_ip}:{rm_port} (id={rm_id})")
 
+    with join_lock:
+        return remove_from_ring(node, rm_id, rm_ip, rm_port)
+
+def remove_from_ring(node, rm_id, rm_ip, rm_port):
     ring = current_app.config.get('RING', [])
     ring = [n for n in ring if n["id"] != rm_id]
     current_app.config['RING'] = ring  # update the ring
@@ -36,10 +43,17 @@ def remove_node():
                 "id": ring[i]["id"],
                 "ip": ring[i]["ip"],
                 "port": ring[i]["port"],
+                "tokens": ring[i].get("tokens") or [ring[i]["id"]],
                 "successor": serialize_node_info(succ),
                 "predecessor": serialize_node_info(pred)
             })
         current_app.config['RING'] = new_ring
+        # Publish a new version of the membership view to the remaining nodes (the delta: the node that departed).
+        ring_version = current_app.config.get('RING_VERSION', 0) + 1
+        current_app.config['RING_VERSION'] = ring_version
+        node.update_membership(new_ring, ring_version)
+        delta = {"op": "depart", "node": {"id": rm_id, "ip": rm_ip, "port": rm_port}}
+        threading.Thread(target=node.push_membership, args=(new_ring, ring_version, (node.id,), delta)).start()
         # for n_info in new_ring: print(f"  Node {n_info['ip']}:{n_info['port']} (id={n_info['id']}) -> predecessor: {n_info['predecessor']['id']}, successor: {n_info['successor']['id']}") #  DEBUG
     else:
         print("[Bootstrap] Ring is empty.")
@@ -51,7 +65,7 @@ def depart():
     node = current_app.config['NODE']
     overlay_url = f"http://{node.bootstrap_ip}:{node.bootstrap_port}/overlay"
     try:
-        response = requests.get(overlay_url)
+        response = transport.get(overlay_url)
         if response.status_code == 200:
             overlay_info = response.json()
             num_nodes = len(overlay_info.get("ring", []))
@@ -78,28 +92,20 @@ def depart():
 
 @depart_bp.route("/absorb_keys", methods=["POST"])
 def absorb_keys():
-    # This endpoint is called by a departing node so that its successor can absorb
-    # the keys for which the departing node was primary.
-    # The successor adds these keys to its own data_store and re-initiates the replication
-    # process to rebuild the replication chain correctly. That replication chain will also
-    # ensure that any stale replicas (from nodes further in the old chain) are removed.
-    
+    # Called by a departing node so that the node taking over its ranges absorbs the keys it was primary for, in
+    # chunks; the "final" chunk holds the keys that changed meanwhile (handoff.py).
     node = current_app.config['NODE']
     data = request.get_json()
-    keys = data.get("keys", {})
-    replication_factor = data.get("replication_factor", 3)
-    ring = current_app.config.get('RING', [])
-    # Update local pointers so that node.successor is up-to-date.
-    if ring:
-        node.update_local_pointers(ring)
-    
-    # For each key from the departing node:
-    for key, value in keys.items():
-        node.data_store[key] = value
-        node.async_replicate_insert(key, value, replication_factor - 1)
-    
-    #print(f"[{node.ip}:{node.port}] Absorbed keys from departing node: {list(keys.keys())}") # DEBUG
-    return jsonify({"message": "Keys absorbed and replication updated."}), 200
+    node.handoff.absorb(data.get("session", request.remote_addr), data.get("keys", {}), data.get("changed"), data.get("final", False))
+    return jsonify({"message": "Keys absorbed."}), 200
+
+# Called by a departing node that abandoned its depart: drop the keys it pushed for its ranges.
+@depart_bp.route("/handoff_cancel", methods=["POST"])
+def handoff_cancel():
+    node = current_app.config['NODE']
+    data = request.get_json()
+    dropped = node.handoff.discard(data.get("session", request.remote_addr), data.get("ranges", []))
+    return jsonify({"dropped": dropped}), 200
 
 @depart_bp.route("/cleanup_replicas_all", methods=["POST"])
 def cleanup_replicas_all():
@@ -107,6 +113,7 @@ def cleanup_replicas_all():
     data = request.get_json()
     ring = data.get("ring")
     replication_factor = data.get("replication_factor")
+    node.update_finger_table(ring)
     node.cleanup_replicas(ring, replication_factor)
     return jsonify({"message": "Replica cleanup completed."}), 200
 
@@ -117,6 +124,31 @@ def repair_replicas_all():
     ring = data.get("ring")
     replication_factor = data.get("replication_factor")
     node.update_local_pointers(ring)
+    node.update_finger_table(ring)
     node.repair_replicas(ring, replication_factor)
     return jsonify({"message": "Replica repair completed."}), 200
 
+
+# Anti-entropy (anti_entropy.py): digests of tree nodes of the replica_store, restricted to the ranges of a primary.
+@depart_bp.route("/merkle_digests", methods=["POST"])
+def merkle_digests():
+    node = current_app.config['NODE']
+    data = request.get_json()
+    digests = range_digests(node.replica_store, data.get("nodes", []), data["ranges"])
+    return jsonify({"digests": digests}), 200
+
+# Anti-entropy: key -> digest of the replicas in the differing leaf buckets of the ranges of a primary.
+@depart_bp.route("/merkle_keys", methods=["POST"])
+def merkle_keys():
+    node = current_app.config['NODE']
+    data = request.get_json()
+    keys = bucket_digests(node.replica_store, data.get("buckets", []), data["ranges"])
+    return jsonify({"keys": keys}), 200
+
+# Anti-entropy: replicas the primary found missing or different ("set") or no longer valid ("delete"), as of "version".
+@depart_bp.route("/merkle_repair", methods=["POST"])
+def merkle_repair():
+    node = current_app.config['NODE']
+    data = request.get_json()
+    node.apply_merkle_repair(data.get("set", {}), data.get("delete", []), data.get("version"))
+    return jsonify({"message": "Replicas repaired."}), 200
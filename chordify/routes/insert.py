@@ -2,8 +2,9 @@
 import random
 import time
 from flask import Blueprint, request, jsonify, current_app
-import hashlib
-import requests
+from transport import transport
+from hashing import parse_hash
+from values import store_to_display
 import os
 import threading
 
@@ -13,27 +14,26 @@ insert_bp = Blueprint('data', __name__)
 def node_info():
     node = current_app.config["NODE"]
     info = {
-        "replica_store": node.replica_store,
+        "replica_store": store_to_display(node.replica_store),
         "id": node.id,
         "ip": node.ip,
         "port": node.port,
         #"is_bootstrap": node.is_bootstrap,
-        "data_store": node.data_store,
+        "data_store": store_to_display(node.data_store),
         "replication_factor": node.replication_factor,
         "consistency_mode": node.consistency_mode,
+        "response_mode": node.response_mode,
+        "read_mode": node.read_mode,
+        "read_quorum": node.quorum.read_quorum,
+        "write_quorum": node.quorum.write_quorum,
         "successor": node.successor,
         "predecessor": node.predecessor,
+        "ring_version": node.ring_version,
         # Optionally, include details on pending requests if desired:
         #"pending_requests_count": len(node.pending_requests)
     }
     return jsonify(info), 200
 
-def compute_hash(key):
-    h = hashlib.sha1(key.encode('utf-8')).hexdigest()
-    return int(h, 16)
-
-
-
 @insert_bp.route("/insert", methods=["POST"])
 def insert():
     # First take the data from the request
@@ -42,24 +42,21 @@ def insert():
     key = data.get("key")
     value = data.get("value")
     origin = data.get("origin")  # might be None or might exist
+    hops = data.get("hops", 0)  # number of forwarding hops so far
+    debug = bool(data.get("debug", False))  # include the data_store of the responsible node in the response
+    key_hash = parse_hash(data.get("key_hash"))  # hash computed by the previous hop, if forwarded
 
     # Call the node's insert method
-    response, req_id = node.insert(key, value, origin)
+    response, req_id = node.insert(key, value, origin, hops, debug, key_hash)
     
-    # The Origin Node must block (or otherwise wait) for the final callback
-    if origin is None:
-        with node.pending_requests_lock:
-            pending = node.pending_requests.get(req_id)
+    # The Origin Node must block (or otherwise wait) for the final callback.
+    # In direct mode there is no pending request (req_id is None) and the response is already final.
+    if origin is None and req_id is not None:
         #print(f"insert_response called in process {os.getpid()}, node object at {hex(id(node))}, req_id={req_id}")
-        if pending and pending["event"].wait(timeout=20):  # Originally 3secs
-            final_result = pending["result"]
-            with node.pending_requests_lock:
-                del node.pending_requests[req_id]
+        final_result = node.wait_for_result(req_id, timeout=20)  # Originally 3secs
+        if final_result is not None:
             return jsonify(final_result), 200
         else:
-            with node.pending_requests_lock:
-                if req_id in node.pending_requests:
-                    del node.pending_requests[req_id]
             return jsonify({"result": False, "error": "Timeout waiting for final node callback"}), 504
     else:
         # If not the origin node, return the response to the predecessor node
@@ -76,11 +73,9 @@ def insert_response():
     final_result = data.get("final_result")
     #print(f"Received insert response for request_id {req_id}")
     print(f"insert_response called in process {os.getpid()}, node object at {hex(id(node))}, req_id={req_id}")
-    # if the request_id exists in the pending_requests dict of the node instance then set the result and event
+    # if the request_id exists in the pending_requests dict of the node instance then complete its future
     #print(f"Received insert response for request_id {req_id}")  # Debug
-    if req_id in node.pending_requests:
-        node.pending_requests[req_id]["result"] = final_result
-        node.pending_requests[req_id]["event"].set()
+    if node.complete_request(req_id, final_result):
         print(f"Callback processed successfully for {req_id}")  # Debug
         #print(f"Callback processed successfully for {req_id}")  # Debug
         return jsonify({"result": True, "message": "Callback received."}), 200
@@ -113,8 +108,82 @@ def chain_replicate_insert():
     origin = data.get("origin")
     final_result = data.get("final_result")
     # Call the node's chain_replicate_insert method.
-    node.chain_replicate_insert(key, value, replication_count, origin, final_result)
-    return jsonify({"ack":True, "result": True, "message": "Chain replication step processed."}), 200
+    # In direct mode it returns the tail's final result, which travels back up the chain in this response.
+    chain_result = node.chain_replicate_insert(key, value, replication_count, origin, final_result)
+    return jsonify({"ack":True, "result": True, "message": "Chain replication step processed.", "final_result": chain_result}), 200
+
+@insert_bp.route("/insert_batch", methods=["POST"])
+def insert_batch():
+    # Insert many key-value pairs in one request: {"items": [{"key": ..., "value": ...}, ...]}
+    # The response holds one result per item, in the order of the request.
+    node = current_app.config["NODE"]
+    data = request.get_json()
+    items = data.get("items")
+    hops = data.get("hops", 0)  # number of forwarding hops so far
+    if not isinstance(items, list) or not all(isinstance(item, dict) and "key" in item and "value" in item for item in items):
+        return jsonify({"result": False, "error": "items must be a list of {key, value} objects"}), 400
+
+    results = node.insert_batch(items, hops)
+    return jsonify({
+        "result": all(r.get("result") for r in results),
+        "inserted": sum(1 for r in results if r.get("result")),
+        "results": results
+    }), 200
+
+@insert_bp.route("/async_replicate_insert_batch", methods=["POST"])
+def async_replicate_insert_batch():
+    # Batch version of /async_replicate_insert (eventual consistency).
+    node = current_app.config["NODE"]
+    data = request.get_json()
+    node.async_replicate_insert_batch(data.get("items", []), data.get("replication_count", 0))
+    return jsonify({"result": True, "message": "Batch replication step processed."}), 200
+
+@insert_bp.route("/replicate_batch", methods=["POST"])
+def replicate_batch():
+    # Receives queued replication updates from the predecessor (eventual consistency, see replication.py):
+    # {"updates": [{"key", "values", "delete", "replication_count"}]}
+    node = current_app.config["NODE"]
+    data = request.get_json()
+    node.apply_replication_batch(data.get("updates", []))
+    return jsonify({"result": True, "message": "Replication batch processed."}), 200
+
+@insert_bp.route("/chain_pipeline", methods=["POST"])
+def chain_pipeline():
+    # Receives a batch of chain-replicated writes from the predecessor (linearizability), applied in "seq" order per
+    # link (see chain.py). The answer only confirms that the batch was applied; the tail reports the commits.
+    node = current_app.config["NODE"]
+    data = request.get_json()
+    if not node.chain.receive(data.get("link"), data.get("seq", 0), data.get("entries", [])):
+        return jsonify({"result": False, "error": "Earlier batches of the link never arrived."}), 409
+    return jsonify({"result": True}), 200
+
+@insert_bp.route("/chain_commit", methods=["POST"])
+def chain_commit():
+    # The tail reports the final results of chain writes whose head waits for them: {"results": [[entry id, final result]]}
+    node = current_app.config["NODE"]
+    data = request.get_json()
+    for entry_id, final_result in data.get("results", []):
+        node.chain.complete(entry_id, final_result)
+    return jsonify({"result": True}), 200
+
+@insert_bp.route("/quorum_write", methods=["POST"])
+def quorum_write():
+    # Receives the new states of keys from their owner (quorum mode, see quorum.py), also sent by read repair:
+    # {"writes": [{"key", "version", "values"}]}. States older than the local ones are ignored.
+    node = current_app.config["NODE"]
+    data = request.get_json()
+    applied = sum(1 for write in data.get("writes", []) if node.quorum.apply(write["key"], write["version"], write.get("values")))
+    return jsonify({"result": True, "applied": applied}), 200
+
+@insert_bp.route("/craq_clean", methods=["POST"])
+def craq_clean():
+    # The tail reports the versions it committed to the nodes before it (apportioned reads, see craq.py):
+    # {"versions": [[key, version]]}. Keys without newer writes become clean and are read locally again.
+    node = current_app.config["NODE"]
+    data = request.get_json()
+    for key, version in data.get("versions", []):
+        node.craq.mark_clean(key, version)
+    return jsonify({"result": True}), 200
 
 @insert_bp.route("/start_inserts", methods=["POST"])
 def start_inserts():
@@ -122,6 +191,7 @@ def start_inserts():
     # Used for the 1st experiment.
     data = request.get_json()
     file_number = data.get("file_number", "00")  # default if missing
+    batch_size = int(data.get("batch_size", 1))  # keys per /insert_batch request, 1 keeps one /insert per key
     file_path = f"./experiments/insert/insert_{file_number}_part.txt"
     node = current_app.config["NODE"]
     port = node.port
@@ -138,12 +208,19 @@ def start_inserts():
 
     start_time = time.time()
     # Perform the actual inserts
-    for key in lines:
-        requests.post(f"http://127.0.0.1:{port}/insert",json={"key": key, "value": f"value_from_{file_number}"})
+    if batch_size > 1:
+        # Send the keys through /insert_batch, batch_size keys per request.
+        for i in range(0, len(lines), batch_size):
+            items = [{"key": key, "value": f"value_from_{file_number}"} for key in lines[i:i + batch_size]]
+            transport.post(f"http://127.0.0.1:{port}/insert_batch", json={"items": items}, timeout=120)
+    else:
+        for key in lines:
+            transport.post(f"http://127.0.0.1:{port}/insert",json={"key": key, "value": f"value_from_{file_number}"})
     duration = time.time() - start_time
 
     return jsonify({
         "status": "done",
         "inserted": len(lines),
+        "batch_size": batch_size,
         "time_seconds": round(duration, 2)
     }), 200
@@ -1,17 +1,35 @@
 # routes/join.py
 from flask import Blueprint, request, jsonify, current_app
-import requests
+from transport import transport
+from handoff import HANDOFF_CHUNK
+from vnodes import token_ring, owner_index, ranges_of
+import threading
 
 join_bp = Blueprint('join', __name__)
+join_lock = threading.Lock() #One join commit at a time on the bootstrap
 
-#Helper: returns True if key_hash is in (start, end] in a circular space
-def is_key_in_range(key_hash, start, end):
-    if start < end:
-        return start < key_hash <= end
-    else:
-        return key_hash > start or key_hash <= end
+def joining_node_info(data):
+    return {
+        "ip": data.get("ip"),
+        "port": data.get("port"),
+        "id": data.get("id"),
+        "tokens": data.get("tokens") or [data.get("id")]
+    }
+
+# Ranges a new node takes over, grouped by the node that owns them now: [{"node": owner, "ranges": [[start, end], ...]}].
+# One range (predecessor id, new id] from the successor, or with virtual nodes one per token.
+def handoff_plan(ring, new_node_info):
+    old_ring = [n for n in ring if n["id"] != new_node_info["id"]]
+    old_tokens, old_owners = token_ring(old_ring)
+    token_ids, owners = token_ring(old_ring + [new_node_info])
+    plan = {} #Id of an old owner -> its entry of the plan
+    for start, end in ranges_of(token_ids, owners, new_node_info["id"]):
+        owner = old_owners[owner_index(old_tokens, end)]
+        plan.setdefault(owner["id"], {"node": owner, "ranges": []})["ranges"].append([start, end])
+    return list(plan.values())
 
 # Main join endpoint for new nodes to join the network. This is called by new nodes during their initialization.
+# It only tells the new node which ranges to pull from which nodes; the ring changes once the keys are pulled (/join_commit).
 @join_bp.route("/join", methods=["POST"])
 def join():
     # Access the node instance from the app config
@@ -19,25 +37,37 @@ def join():
     if not node.is_bootstrap:
         return jsonify({"error": "Only the bootstrap node can handle join requests"}), 400
 
-    data = request.get_json()
-    new_node_info = {
-        "ip": data.get("ip"),
-        "port": data.get("port"),
-        "id": data.get("id")
-    }
+    new_node_info = joining_node_info(request.get_json())
     print(f"[Bootstrap] Node joining: {new_node_info}")
+    return jsonify({"handoff": handoff_plan(current_app.config.get('RING', []), new_node_info)}), 200
 
-    # Fetch the current ring from app.config
-    ring = current_app.config.get('RING', [])
+# Second step of a join: the new node pulled the keys of its ranges, now it enters the ring.
+# 409 if its ranges changed meanwhile, 503 if an old owner could not hand its ranges over (the ring is unchanged).
+@join_bp.route("/join_commit", methods=["POST"])
+def join_commit():
+    node = current_app.config['NODE']
+    if not node.is_bootstrap:
+        return jsonify({"error": "Only the bootstrap node can handle join requests"}), 400
+
+    data = request.get_json()
+    new_node_info = joining_node_info(data)
+    with join_lock:
+        if handoff_plan(current_app.config.get('RING', []), new_node_info) != data.get("handoff"):
+            return jsonify({"error": "The ring changed during the handoff"}), 409
+        return commit_join(node, new_node_info, data.get("handoff", []), data.get("session"))
 
-    # Add the new node to the ring if it's not already there
-    if not any(n['id'] == new_node_info['id'] for n in ring):
-        ring.append(new_node_info)
+def commit_join(node, new_node_info, plan, session):
+    # Build the new ring from a copy of the current one, which stays as it is until every old owner has switched
+    old_ring = current_app.config.get('RING', [])
+    ring = [dict(n) for n in old_ring]
+
+    # Add the new node to the ring, replacing its old entry if it rejoins after a crash
+    ring = [n for n in ring if n["id"] != new_node_info["id"]] + [new_node_info]
     ring.sort(key=lambda n: n["id"])
     n = len(ring)
 
     # Find the index of the new node in the sorted ring
-    new_index = ring.index(new_node_info)
+    new_index = next(i for i, entry in enumerate(ring) if entry["id"] == new_node_info["id"])
     # Identify the successor and predecessor of the new node
     pred_index = (new_index - 1) % n
     succ_index = (new_index + 1) % n
@@ -63,103 +93,122 @@ def join():
         "port": new_node_info["port"],
         "id": new_node_info["id"]
     }
+    # 3) Update the successor so its predecessor is the new node
+    ring[succ_index]["predecessor"] = {
+        "ip": new_node_info["ip"],
+        "port": new_node_info["port"],
+        "id": new_node_info["id"]
+    }
+
+    # 4) Switch the ranges of the new node on their old owners. If one of them fails, the join is aborted before any
+    # pointer changes and the owners go back to the old ring (see abort_join).
+    ring_version = current_app.config.get('RING_VERSION', 0) + 1
+    changed = {}
+    for source in plan:
+        owner = source["node"]
+        url = f"http://{owner['ip']}:{owner['port']}/handoff_commit"
+        payload = {"session": session, "ranges": source["ranges"], "ring": ring, "ring_version": ring_version}
+        try:
+            response = transport.post(url, json=payload)
+            response.raise_for_status()
+            changed.update(response.json().get("changed", {}))
+        except Exception as e:
+            print(f"Error switching the handoff of {owner['ip']}:{owner['port']}:", e)
+            abort_join(node, old_ring, ring_version + 1, plan, session)
+            return jsonify({"error": f"Old owner {owner['ip']}:{owner['port']} could not hand over its ranges: {e}"}), 503
+
+    # 5) Tell the predecessor and the successor about their new neighbor
     try:
         url = f"http://{predecessor_info['ip']}:{predecessor_info['port']}/update_neighbors"
         payload = {
             "successor": ring[pred_index]["successor"],
             "predecessor": predecessor_info.get("predecessor", {})
         }
-        requests.post(url, json=payload)
+        transport.post(url, json=payload)
     except Exception as e:
         print(f"[Bootstrap] Failed to update predecessor {predecessor_info}: {e}")
 
-    # 3) Update the successor so its predecessor is the new node
-    ring[succ_index]["predecessor"] = {
-        "ip": new_node_info["ip"],
-        "port": new_node_info["port"],
-        "id": new_node_info["id"]
-    }
     try:
         url = f"http://{successor_info['ip']}:{successor_info['port']}/update_neighbors"
         payload = {
             "successor": successor_info.get("successor", {}),
             "predecessor": ring[succ_index]["predecessor"]
         }
-        requests.post(url, json=payload)
+        transport.post(url, json=payload)
     except Exception as e:
         print(f"[Bootstrap] Failed to update successor {successor_info}: {e}")
 
-    # 4) Request key transfer from the new node's successor
-    transferred_data = {}
-    transfer_url = f"http://{successor_info['ip']}:{successor_info['port']}/transfer_keys"
-    payload = {
-        "new_node_id": new_node_info["id"],
-        "predecessor_id": predecessor_info["id"]
-    }
-    try:
-        transfer_response = requests.post(transfer_url, json=payload)
-        if transfer_response.status_code == 200:
-            transferred_data = transfer_response.json()
-        else:
-            print("Transfer keys failed:", transfer_response.text)
-    except Exception as e:
-        print("Error transferring keys:", e)
-
-    # Store the updated ring
+    # Store the updated ring and publish a new version of the membership view.
+    # The new node gets the view in this response, every other node gets the delta (the new node) pushed in the background.
     current_app.config['RING'] = ring
+    current_app.config['RING_VERSION'] = ring_version
+    node.update_membership(ring, ring_version)
+    delta = {"op": "join", "node": {key: new_node_info[key] for key in ("id", "ip", "port", "tokens")}}
+    threading.Thread(target=node.push_membership, args=(ring, ring_version, (node.id, new_node_info["id"]), delta)).start()
 
     # Return the new node's own successor/predecessor in the response
     return jsonify({
         "message": "Node joined successfully (minimal push)",
         "successor": ring[new_index]["successor"],
         "predecessor": ring[new_index]["predecessor"],
-        "data_store": transferred_data.get("data_store", {}),
-        "replica_store": transferred_data.get("replica_store", {}),
+        "changed": changed,
         "replication_factor": node.replication_factor,
         "consistency": node.consistency_mode,
-        "ring": ring  # For debugging purposes
+        "response_mode": node.response_mode,
+        "read_mode": node.read_mode,
+        "read_quorum": node.quorum.read_quorum,
+        "write_quorum": node.quorum.write_quorum,
+        "ring": ring,
+        "ring_version": ring_version
     }), 200
 
-# This endpoint is called by the bootstrap when a new node joins.
-# The node handling this request (usually the successor of the new node) will check its key collections and transfer those keys for which the new node is now responsible.
-@join_bp.route("/transfer_keys", methods=["POST"])
-def transfer_keys():
+# Undo a join whose handoff failed: every old owner of the plan restores the keys it cut out and returns to the old
+# ring under version, which the bootstrap publishes.
+def abort_join(node, old_ring, version, plan, session):
+    for source in plan:
+        owner = source["node"]
+        url = f"http://{owner['ip']}:{owner['port']}/handoff_abort"
+        try:
+            transport.post(url, json={"session": session, "ring": old_ring, "ring_version": version}).raise_for_status()
+        except Exception as e:
+            print(f"Error aborting the handoff of {owner['ip']}:{owner['port']}:", e)
+    current_app.config['RING_VERSION'] = version
+    node.update_membership(old_ring, version)
+
+# Next chunk of the keys a joining node pulls from this node (handoff.py).
+@join_bp.route("/handoff_chunk", methods=["POST"])
+def handoff_chunk():
+    node = current_app.config['NODE']
+    data = request.get_json()
+    chunk = node.handoff.chunk(data["session"], data.get("target"), data["ranges"], data.get("cursor"), data.get("limit", HANDOFF_CHUNK))
+    return jsonify(chunk), 200
+
+# Called by the bootstrap when it commits a join: switch to the view that includes the new node, hand the ranges
+# over and return the keys that changed while they were pulled.
+@join_bp.route("/handoff_commit", methods=["POST"])
+def handoff_commit():
     node = current_app.config['NODE']
     data = request.get_json()
-    new_node_id = data.get("new_node_id")
-    predecessor_id = data.get("predecessor_id")
-    transferred = {"data_store": {}, "replica_store": {}}
-    print(f"[{node.ip}:{node.port}] Transferring keys for new node {new_node_id} with predecessor {predecessor_id}")
-
-    # Transfer keys from data_store that now belong to the new node.
-    for key in list(node.data_store.keys()):
-        key_hash = node.compute_hash(key)
-        if is_key_in_range(key_hash, predecessor_id, new_node_id):
-            transferred["data_store"][key] = node.data_store.pop(key)
-    for key in list(node.replica_store.keys()):
-        transferred["replica_store"][key] = node.replica_store.pop(key)
-
-    print(f"[{node.ip}:{node.port}] Transferred keys for new node: {transferred}")
-    return jsonify(transferred), 200
-
-@join_bp.route("/transfer_missing_replicas", methods=["POST"])
-def transfer_missing_replicas():
-    # This endpoint is called by a node that just joined.
+    if not node.update_membership(data.get("ring", []), data.get("ring_version", 0)):
+        # A late request of a join that was aborted meanwhile: the ranges stay here
+        return jsonify({"error": "The view of this handoff is outdated"}), 409
+    changed = node.handoff.switch(data["session"], data["ranges"])
+    return jsonify({"changed": changed}), 200
+
+# Called by the bootstrap when it aborts a join: put the keys of the session back and return to the old ring.
+@join_bp.route("/handoff_abort", methods=["POST"])
+def handoff_abort():
     node = current_app.config['NODE']
     data = request.get_json()
-    new_node_id = data.get("new_node_id")
-    predecessor_id = data.get("predecessor_id")
-    transferred = {"replica_store": {}}
-
-    # For each key in the replica_store, check if it now falls into the new node's responsibility.
-    # Here we reuse the same helper is_key_in_range (assumed available) used in /transfer_keys.
-    for key in list(node.replica_store.keys()):
-        key_hash = node.compute_hash(key)
-        if is_key_in_range(key_hash, predecessor_id, new_node_id):
-            transferred["replica_store"][key] = node.replica_store.pop(key)
-    
-    print(f"[{node.ip}:{node.port}] Transferred missing replicas for new node: {transferred}")
-    return jsonify(transferred), 200
+    restored = node.handoff.restore(data["session"])
+    node.update_membership(data.get("ring", []), data.get("ring_version", 0))
+    return jsonify({"restored": restored}), 200
+
+# Progress of the key handoffs from and to this node.
+@join_bp.route("/handoff_progress", methods=["GET"])
+def handoff_progress():
+    node = current_app.config['NODE']
+    return jsonify(node.handoff.stats()), 200
 
 @join_bp.route("/cleanup_replicas_all", methods=["POST"])
 def cleanup_replicas_all():
@@ -167,11 +216,32 @@ def cleanup_replicas_all():
     data = request.get_json()
     ring = data.get("ring")
     replication_factor = data.get("replication_factor")
+    node.update_finger_table(ring)
     node.cleanup_replicas(ring, replication_factor)
     return jsonify({"message": "Replica cleanup completed."}), 200
 
 
 
+# The bootstrap pushes a new version of the membership view after every join and depart: the delta of the change,
+# or the full ring.
+@join_bp.route("/update_membership", methods=["POST"])
+def update_membership():
+    node = current_app.config['NODE']
+    data = request.get_json()
+    if data.get("delta"):
+        updated = node.apply_membership_delta(data["delta"], data.get("version", 0))
+    else:
+        updated = node.update_membership(data.get("ring", []), data.get("version", 0))
+    return jsonify({"updated": updated, "version": node.ring_version}), 200
+
+# Full membership view of the bootstrap, pulled by nodes that missed a delta.
+@join_bp.route("/membership", methods=["GET"])
+def membership():
+    node = current_app.config['NODE']
+    if not node.is_bootstrap:
+        return jsonify({"error": "Only the bootstrap node serves the membership view"}), 400
+    return jsonify({"ring": current_app.config.get('RING', []), "version": current_app.config.get('RING_VERSION', 0)}), 200
+
 # When a new node joins, the successor and predecessor of the nodes affected need to be updated.
 @join_bp.route("/update_neighbors", methods=["POST"])
 def update_neighbors():
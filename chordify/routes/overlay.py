@@ -1,15 +1,38 @@
 # routes/overlay.py
 from flask import Blueprint, request, jsonify, current_app
-import requests
+from transport import transport
+from hashing import hash_cache_stats
+from vnodes import ring_shares
+from node import CONSISTENCY_MODES, RESPONSE_MODES, READ_MODES
+from quorum import quorum_error
 
 overlay_bp = Blueprint('overlay', __name__)
 
+# Check the settings of /update_settings and /update_config. Returns (error, warning): error is None if they are valid,
+# warning is set when R + W <= N, so a read quorum may miss the last write.
+def check_settings(node, data):
+    replication_factor = data.get("replication_factor")
+    if not isinstance(replication_factor, int) or isinstance(replication_factor, bool) or replication_factor < 1:
+        return f"replication_factor must be a positive integer, got {replication_factor!r}", None
+    for name, choices in (("consistency_mode", CONSISTENCY_MODES), ("response_mode", RESPONSE_MODES), ("read_mode", READ_MODES)):
+        if data.get(name) is not None and data[name] not in choices:
+            return f"{name} must be one of {', '.join(choices)}, got {data[name]!r}", None
+    if data.get("consistency_mode") != "quorum":
+        return None, None
+    read_quorum = data["read_quorum"] if data.get("read_quorum") is not None else node.quorum.read_quorum
+    write_quorum = data["write_quorum"] if data.get("write_quorum") is not None else node.quorum.write_quorum
+    error = quorum_error(read_quorum, write_quorum, replication_factor)
+    if error is None and read_quorum + write_quorum <= replication_factor:
+        return None, f"R + W = {read_quorum + write_quorum} is not greater than N = {replication_factor}: reads may miss the last write"
+    return error, None
+
 # The overlay route is used to retrieve the current state of the overlay network.
 @overlay_bp.route("/overlay", methods=["GET"])
 def overlay():
     node = current_app.config['NODE']
     if node.is_bootstrap:
         ring = current_app.config.get('RING', [])
+        shares = ring_shares(ring)
         minimal_ring = []
         for entry in ring:
             successor = f"{entry['successor']['ip']}:{entry['successor']['port']}"
@@ -19,13 +42,15 @@ def overlay():
                 "ip": entry["ip"],
                 "port": entry["port"],
                 "predecessor": predecessor,
-                "successor": successor
+                "successor": successor,
+                "vnodes": len(entry.get("tokens") or [entry["id"]]),
+                "ring_share": round(shares.get(entry["id"], 0.0), 4)
             })
         return jsonify({"ring": minimal_ring}), 200
     else:
         try:
             bootstrap_url = f"http://{node.bootstrap_ip}:{node.bootstrap_port}/overlay"
-            response = requests.get(bootstrap_url)
+            response = transport.get(bootstrap_url)
             if response.status_code == 200:
                 return response.json(), 200
             else:
@@ -33,6 +58,28 @@ def overlay():
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
+# Connection reuse metrics of the shared inter-node transport.
+@overlay_bp.route("/transport_stats", methods=["GET"])
+def transport_stats():
+    node = current_app.config['NODE']
+    stats = transport.stats()
+    stats["runtime"] = node.runtime.stats() if node.runtime is not None else None
+    stats["hash_cache"] = hash_cache_stats()
+    stats["persistence"] = node.persistence.stats() if node.persistence is not None else None
+    stats["chain"] = node.chain.stats()
+    stats["craq"] = dict(node.craq.stats(), read_mode=node.read_mode)
+    stats["quorum"] = node.quorum.stats()
+    stats["anti_entropy"] = node.anti_entropy.stats()
+    stats["hlc"] = node.clock.stats()
+    stats["handoff"] = node.handoff.stats()
+    return jsonify(stats), 200
+
+# Depth, coalescing and lag of the asynchronous replication queue (eventual consistency).
+@overlay_bp.route("/replication_stats", methods=["GET"])
+def replication_stats():
+    node = current_app.config['NODE']
+    return jsonify(dict(node.replication.stats(), versions=node.replica_versions.stats())), 200
+
 # The following routes are added during the testing phase of the project in the AWS environment, in order to execute all the necessary experiments without the need to manually update the settings of each node.
 # To do that we simply delete all the songs from the nodes and then update the settings of the nodes.
 
@@ -47,8 +94,17 @@ def update_settings():
     data = request.get_json()
     new_replication_factor = data.get("replication_factor")
     new_consistency_mode = data.get("consistency_mode")
+    new_response_mode = data.get("response_mode")  # optional: "callback" or "direct"
+    new_read_mode = data.get("read_mode")  # optional: "tail" or "craq"
+    new_read_quorum = data.get("read_quorum")  # optional, R of the quorum mode
+    new_write_quorum = data.get("write_quorum")  # optional, W of the quorum mode
     if new_replication_factor is None or new_consistency_mode is None:
         return jsonify({"error": "Missing replication_factor or consistency_mode in the request"}), 400
+    error, warning = check_settings(node, data)
+    if error:
+        return jsonify({"error": error}), 400
+    if warning:
+        print(f"[Bootstrap] Warning: {warning}")
 
     # 3. Get the ring info (list of nodes)
     ring = current_app.config.get("RING", [])
@@ -65,7 +121,7 @@ def update_settings():
         try:
             # Retrieve node info (including the data_store containing songs)
             nodeinfo_url = f"http://{ip}:{port}/nodeinfo"
-            resp = requests.get(nodeinfo_url)
+            resp = transport.get(nodeinfo_url)
             if resp.status_code == 200:
                 node_info = resp.json()
                 # Assuming songs are stored as keys in the data_store dictionary
@@ -74,7 +130,7 @@ def update_settings():
                     delete_url = f"http://{ip}:{port}/delete"
                     # Use the dictionary for origin instead of a string.
                     payload = {"key": song, "origin": bootstrap_info}
-                    del_resp = requests.post(delete_url, json=payload)
+                    del_resp = transport.post(delete_url, json=payload)
                     if del_resp.status_code != 200:
                         print(f"Failed to delete song '{song}' on node {ip}:{port}")
             else:
@@ -90,15 +146,22 @@ def update_settings():
             update_url = f"http://{ip}:{port}/update_config"
             update_payload = {
                 "replication_factor": new_replication_factor,
-                "consistency_mode": new_consistency_mode
+                "consistency_mode": new_consistency_mode,
+                "response_mode": new_response_mode,
+                "read_mode": new_read_mode,
+                "read_quorum": new_read_quorum,
+                "write_quorum": new_write_quorum
             }
-            upd_resp = requests.post(update_url, json=update_payload)
+            upd_resp = transport.post(update_url, json=update_payload)
             if upd_resp.status_code != 200:
                 print(f"Failed to update settings on node {ip}:{port}")
         except Exception as e:
             print(f"Error updating settings on node {ip}:{port}: {e}")
 
-    return jsonify({"result": "Settings update initiated successfully."}), 200
+    result = {"result": "Settings update initiated successfully."}
+    if warning:
+        result["warning"] = warning
+    return jsonify(result), 200
 
 
 @overlay_bp.route("/update_config", methods=["POST"])
@@ -110,5 +173,19 @@ def update_config():
     new_consistency_mode = data.get("consistency_mode")
     if new_replication_factor is None or new_consistency_mode is None:
         return jsonify({"error": "Missing replication_factor or consistency_mode in the request"}), 400
+    error, warning = check_settings(node, data)
+    if error:
+        return jsonify({"error": error}), 400
     node.update_replication_consistency(new_replication_factor, new_consistency_mode)
+    new_response_mode = data.get("response_mode")
+    if new_response_mode is not None:
+        node.update_response_mode(new_response_mode)
+    new_read_mode = data.get("read_mode")
+    if new_read_mode is not None:
+        node.update_read_mode(new_read_mode)
+    new_read_quorum = data.get("read_quorum")
+    new_write_quorum = data.get("write_quorum")
+    if new_read_quorum is not None or new_write_quorum is not None:
+        node.quorum.configure(new_read_quorum if new_read_quorum is not None else node.quorum.read_quorum,
+                              new_write_quorum if new_write_quorum is not None else node.quorum.write_quorum)
     return jsonify({"message": "Settings updated successfully"}), 200
\ No newline at end of file
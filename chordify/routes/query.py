@@ -1,12 +1,20 @@
-from flask import Blueprint, request, jsonify, current_app
-import hashlib
-import requests
+from flask import Blueprint, Response, request, jsonify, current_app
+import json
+from transport import transport
+from hashing import parse_hash
 import threading
 import os
 import time
 
 query_bp = Blueprint('query', __name__)
 
+# Wildcard queries: maximum number of nodes queried at the same time, and timeout (seconds) per node.
+WILDCARD_CONCURRENCY = 16
+WILDCARD_TIMEOUT = 3
+# Scans: default and maximum number of songs per page.
+SCAN_PAGE_SIZE = 100
+SCAN_MAX_PAGE_SIZE = 1000
+
 @query_bp.route("/query", methods=["GET"])
 def query():
     node = current_app.config['NODE']
@@ -16,10 +24,14 @@ def query():
     request_id = request.args.get("request_id")
     chain_count_param = request.args.get("chain_count")
     chain_count = int(chain_count_param) if chain_count_param else None
+    hops = int(request.args.get("hops", 0))  # number of forwarding hops so far
+    key_hash = parse_hash(request.args.get("key_hash"))  # hash computed by the previous hop, if forwarded
 
     origin = None
     if origin_ip and origin_port and request_id:
         origin = {"ip": origin_ip, "port": origin_port, "request_id": request_id}
+        if request.args.get("direct") == "1":
+            origin["direct"] = True
         
     if not key:
         return jsonify({"error": "Missing key parameter"}), 400
@@ -28,9 +40,13 @@ def query():
     if key == "*":
         # Use a single 'origin' parameter to track the initiator.
         origin = request.args.get("origin")
-        if not origin:
-            origin = f"{node.ip}:{node.port}"
-        all_node_songs = node.query_wildcard(origin)
+        failed_nodes = []
+        if origin:
+            # A step of a ring walk started by another node.
+            all_node_songs = node.query_wildcard(origin)
+        else:
+            # Started here: gather the local songs of all nodes in parallel.
+            all_node_songs, failed_nodes = node.query_wildcard_parallel(WILDCARD_CONCURRENCY, WILDCARD_TIMEOUT)
 
         # Compute the total number of original and replica songs across nodes.
         original_songs_count = sum(len(node_data.get("original_songs", {})) for node_data in all_node_songs.values())
@@ -41,31 +57,72 @@ def query():
             "all_songs": all_node_songs,
             "original_songs_count": original_songs_count,
             "replica_songs_count": replica_songs_count,
-            "nodes_count": nodes_count
+            "nodes_count": nodes_count,
+            "failed_nodes": failed_nodes,  # nodes that did not answer; their songs are missing
+            "partial": bool(failed_nodes)
         }), 200
 
-    result, req_id = node.query(key, origin, chain_count)
+    result, req_id = node.query(key, origin, chain_count, hops, key_hash)
 
     # If this node is the original requester, wait for the query callback.
-    if origin is None:
-        # Wait on the event for the specific pending request.
-        with node.pending_requests_lock:
-            pending = node.pending_requests.get(req_id)
-        if pending and pending["event"].wait(timeout=3):
-            final_result = pending["result"]
-            with node.pending_requests_lock:
-                del node.pending_requests[req_id]
+    # In direct mode there is no pending request (req_id is None) and the result is already final.
+    if origin is None and req_id is not None:
+        # Wait on the future of the specific pending request.
+        final_result = node.wait_for_result(req_id, timeout=3)
+        if final_result is not None:
             return jsonify(final_result), 200
         else:
-            with node.pending_requests_lock:
-                if req_id in node.pending_requests:
-                    del node.pending_requests[req_id]
             return jsonify({"result": False, "error": "Timeout waiting for final node callback"}), 504
     else:
         # If this request was forwarded, return the immediate response.
         return jsonify(result), 200
 
 
+@query_bp.route("/quorum_read", methods=["GET"])
+def quorum_read():
+    # Version and values of a key on this node, for the coordinator of a quorum read (see quorum.py).
+    node = current_app.config["NODE"]
+    key = request.args.get("key")
+    if not key:
+        return jsonify({"error": "Missing key parameter"}), 400
+    version, values = node.quorum.local_state(key)
+    return jsonify({"key": key, "version": version, "values": values}), 200
+
+@query_bp.route("/craq_version", methods=["POST"])
+def craq_version():
+    # Versions of keys committed at this node as the tail of their chain: {"keys": [...]} -> {"versions": [...]}
+    # Asked by the other nodes of the chain before they answer a read of a dirty key (see craq.py).
+    node = current_app.config["NODE"]
+    data = request.get_json()
+    keys = data.get("keys")
+    if not isinstance(keys, list):
+        return jsonify({"result": False, "error": "keys must be a list of song keys"}), 400
+    with node.craq.lock:
+        versions = [node.craq.versions.get(key, 0) for key in keys]
+    return jsonify({"result": True, "versions": versions}), 200
+
+@query_bp.route("/query_batch", methods=["POST"])
+def query_batch():
+    # Query many keys in one request: {"keys": [...]}
+    # The response holds one result per key, in the order of the request.
+    node = current_app.config["NODE"]
+    data = request.get_json()
+    keys = data.get("keys")
+    hops = data.get("hops", 0)  # number of forwarding hops so far
+    key_hashes = data.get("key_hashes")  # hashes computed by the previous hop, if forwarded
+    if not isinstance(keys, list) or not all(isinstance(key, str) and key and key != "*" for key in keys):
+        return jsonify({"result": False, "error": "keys must be a list of song keys"}), 400
+    if key_hashes is not None:
+        key_hashes = [parse_hash(key_hash) for key_hash in key_hashes]
+
+    results = node.query_batch(keys, hops, key_hashes)
+    return jsonify({
+        "result": True,
+        "found": sum(1 for r in results if r.get("result") is not False),
+        "results": results
+    }), 200
+
+
 @query_bp.route("/query_response", methods=["POST"])
 def query_response():
     node = current_app.config["NODE"]
@@ -74,9 +131,7 @@ def query_response():
     final_result = data.get("final_result")
     print(f"Received query response for request_id {req_id}")
     
-    if req_id in node.pending_requests:
-        node.pending_requests[req_id]["result"] = final_result
-        node.pending_requests[req_id]["event"].set()
+    if node.complete_request(req_id, final_result):
         return jsonify({"result": True, "message": "Query callback received."}), 200
     else:
         return jsonify({"result": False, "error": "Unknown request_id"}), 404
@@ -94,16 +149,94 @@ def local_query():
 
     # Check only the local data store
     if key in node.data_store:
-        return jsonify({"result": True, "value": node.data_store[key], "source": "local_store"}), 200
+        return jsonify({"result": True, "value": str(node.data_store[key]), "source": "local_store"}), 200
     elif key in node.replica_store:
-        return jsonify({"result": True, "value": node.replica_store[key], "source": "replica_store"}), 200
+        return jsonify({"result": True, "value": str(node.replica_store[key]), "source": "replica_store"}), 200
     else:
         return jsonify({"error": "Key not found", "source": "none"}), 404
 
+@query_bp.route("/local_songs", methods=["GET"])
+def local_songs():
+    """
+    Return the songs stored on this node (primary and replica), used by wildcard queries.
+    """
+    node = current_app.config["NODE"]
+    return jsonify({"node": f"{node.ip}:{node.port}", "songs": node.local_songs()}), 200
+
+def _scan_args():
+    limit = min(max(int(request.args.get("limit", SCAN_PAGE_SIZE)), 1), SCAN_MAX_PAGE_SIZE)
+    include_replicas = request.args.get("include_replicas", "0").lower() in ("1", "true", "yes")
+    return limit, include_replicas
+
+@query_bp.route("/scan", methods=["GET"])
+def scan():
+    """
+    Paginated scan of all songs in the ring: /scan?limit=100[&cursor=...][&include_replicas=1]
+    Pass the returned next_cursor to get the next page; it is null after the last page.
+    """
+    node = current_app.config["NODE"]
+    try:
+        limit, include_replicas = _scan_args()
+        items, next_cursor, failed_nodes = node.scan_page(request.args.get("cursor"), limit, include_replicas)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor or limit"}), 400
+    return jsonify({
+        "items": items,
+        "count": len(items),
+        "next_cursor": next_cursor,
+        "failed_nodes": failed_nodes
+    }), 200
+
+@query_bp.route("/scan_stream", methods=["GET"])
+def scan_stream():
+    """
+    Streaming scan of all songs in the ring as NDJSON: one {"key", "value", "node", "source"} object per line,
+    then a last line {"done": true, "count": ..., "failed_nodes": [...]}.
+    The songs are fetched page by page (limit songs per page), so memory stays bounded on both sides.
+    """
+    node = current_app.config["NODE"]
+    try:
+        limit, include_replicas = _scan_args()
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+
+    def generate():
+        cursor, count, failed_nodes = None, 0, []
+        while True:
+            items, cursor, failed = node.scan_page(cursor, limit, include_replicas)
+            failed_nodes.extend(failed)
+            for item in items:
+                yield json.dumps(item) + "\n"
+            count += len(items)
+            if cursor is None:
+                break
+        yield json.dumps({"done": True, "count": count, "failed_nodes": failed_nodes}) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+@query_bp.route("/scan_local", methods=["GET"])
+def scan_local():
+    """
+    One page of this node's songs in hash order, used by /scan and /scan_stream.
+    store is "data" (original songs) or "replica"; after is the hash of the last song of the previous page.
+    """
+    node = current_app.config["NODE"]
+    store = request.args.get("store", "data")
+    if store not in ("data", "replica"):
+        return jsonify({"error": "store must be data or replica"}), 400
+    try:
+        after = int(request.args.get("after", -1))
+        limit = min(max(int(request.args.get("limit", SCAN_PAGE_SIZE)), 1), SCAN_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "Invalid after or limit"}), 400
+    items = [{"key": key, "value": value, "hash": str(key_hash)} for key, value, key_hash in node.scan_local(store, after, limit)]
+    return jsonify({"items": items}), 200
+
 @query_bp.route("/start_queries", methods=["POST"])
 def start_queries():
     data = request.get_json()
     file_number = data.get("file_number", "00")  # default file_number if not provided
+    batch_size = int(data.get("batch_size", 1))  # keys per /query_batch request, 1 keeps one /query per key
     file_path = f"./experiments/queries/query_{file_number}.txt"
 
     node = current_app.config["NODE"]
@@ -121,14 +254,31 @@ def start_queries():
 
     start_time = time.time()
     results = []
+    total_hops = 0
+    if batch_size > 1:
+        # Query the keys through /query_batch, batch_size keys per request.
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            try:
+                response = transport.post(f"http://127.0.0.1:{port}/query_batch", json={"keys": batch}, timeout=60)
+                response.raise_for_status()
+                for key, result in zip(batch, response.json()["results"]):
+                    total_hops += result.get("hops", 0)
+                    results.append({"key": key, "result": result})
+            except Exception as e:
+                results.extend({"key": key, "error": str(e)} for key in batch)
+        keys_to_query = []
+    else:
+        keys_to_query = keys
     # For each query key, perform the query using the node’s own /query (or /local_query) endpoint.
-    for key in keys:
+    for key in keys_to_query:
         try:
             # Here we call the query endpoint locally on the same node.
             # Adjust the endpoint path if needed (for example, it might be /local_query).
-            response = requests.get(f"http://127.0.0.1:{port}/query?key={key}")
+            response = transport.get(f"http://127.0.0.1:{port}/query?key={key}")
             response.raise_for_status()
             result = response.json()
+            total_hops += result.get("hops", 0)
             results.append({"key": key, "result": result})
         except Exception as e:
             results.append({"key": key, "error": str(e)})
@@ -137,7 +287,9 @@ def start_queries():
     return jsonify({
         "status": "done",
         "queried": len(keys),
+        "batch_size": batch_size,
         "time_seconds": round(duration, 2),
         "throughput": round(throughput, 2),  # new field for read throughput
+        "avg_hops": round(total_hops / len(keys), 2) if keys else 0,  # average routing hops per query
         "results": results
     }), 200
\ No newline at end of file
@@ -0,0 +1,105 @@
+# runtime.py
+import asyncio
+import threading
+from urllib.parse import urlsplit
+from transport import transport
+
+try:
+    import aiohttp
+except ImportError:  # The asyncio runtime is optional, the node falls back to blocking requests without it.
+    aiohttp = None
+
+# Asyncio runtime of a node: an event loop on a background thread with an aiohttp session, for the fire-and-forget
+# sends (forwards in callback mode, callbacks to the origin and replication steps).
+
+class AsyncRuntime:
+    def __init__(self):
+        self.loop = None #Event loop, running on self.thread
+        self.thread = None #Background thread of the event loop
+        self.session = None #Shared aiohttp session
+        self.stats_lock = threading.Lock() #Lock for the counters below
+        self.in_flight = 0 #Requests scheduled but not finished yet
+        self.completed = 0 #Requests that got an answer
+        self.failed = 0 #Requests that raised an exception
+
+    @staticmethod
+    def available():
+        return aiohttp is not None
+
+    # Start the event loop thread and open the HTTP session on it.
+    def start(self):
+        if not self.available():
+            raise RuntimeError("The asyncio runtime requires the aiohttp package")
+        ready = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, args=(ready,), daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._open_session())
+        ready.set()
+        self.loop.run_forever()
+
+    async def _open_session(self):
+        # Count the connections the session opens in the transport metrics of their peer.
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(self._connection_opened)
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=transport.pool_size)
+        self.session = aiohttp.ClientSession(connector=connector, trace_configs=[trace])
+
+    async def _connection_opened(self, session, context, params):
+        transport.count_async(context.trace_request_ctx["peer"], opened=1)
+
+    # Perform one HTTP request on the loop and return (status_code, json_body).
+    # Without an explicit timeout the connect and read timeouts of the transport apply.
+    async def request(self, method, url, json=None, params=None, timeout=None):
+        if timeout is None:
+            client_timeout = aiohttp.ClientTimeout(sock_connect=transport.connect_timeout, sock_read=transport.read_timeout)
+        else:
+            client_timeout = aiohttp.ClientTimeout(total=timeout)
+        peer = urlsplit(url).netloc
+        transport.count_async(peer, requests=1)
+        async with self.session.request(method, url, json=json, params=params, timeout=client_timeout,
+                                        trace_request_ctx={"peer": peer}) as response:
+            try:
+                body = await response.json(content_type=None)
+            except ValueError:
+                body = None
+            return response.status, body
+
+    # Run a coroutine on the loop from any thread. Returns a concurrent.futures.Future.
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    # Schedule a request without waiting for it. Failures are only logged, like the blocking sends they replace.
+    def send(self, method, url, error_message="Error sending request", **kwargs):
+        with self.stats_lock:
+            self.in_flight += 1
+        return self.submit(self._send(method, url, error_message, **kwargs))
+
+    async def _send(self, method, url, error_message, **kwargs):
+        try:
+            result = await self.request(method, url, **kwargs)
+            with self.stats_lock:
+                self.completed += 1
+            return result
+        except Exception as e:
+            with self.stats_lock:
+                self.failed += 1
+            transport.count_async(urlsplit(url).netloc, errors=1)
+            print(f"{error_message}: {e!r}")
+            return None
+        finally:
+            with self.stats_lock:
+                self.in_flight -= 1
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "failed": self.failed,
+                "pool_size": transport.pool_size
+            }
@@ -0,0 +1,143 @@
+# snapshot.py
+import bisect
+import json
+import mmap
+import os
+import struct
+
+# Binary snapshot of the node stores, memory-mapped as the read-only base layer of HashIndexedStore.
+# Layout (big-endian): MAGIC and section count; per store its name, entry count and index / blob offsets; the index
+# (one ENTRY per key, sorted by key hash and key); the blob of keys (UTF-8) and values (JSON lists).
+
+MAGIC = b"CHRDSNP1"
+HASH_BYTES = 20 # SHA-1 digests
+ENTRY = struct.Struct(">20sQII")
+SECTION = struct.Struct(">QQQ")
+
+def _hash_bytes(key_hash):
+    return key_hash.to_bytes(HASH_BYTES, "big")
+
+# Write a snapshot file. sections maps a store name to its entries (key hash, key, values) sorted by (hash, key);
+# values is a list, or the encoded JSON list when it is copied from another snapshot.
+def write_snapshot(path, sections):
+    encoded = {}
+    for name, entries in sections.items():
+        index = []
+        blob = []
+        offset = 0
+        for key_hash, key, values in entries:
+            key_bytes = key.encode("utf-8")
+            value_bytes = values if isinstance(values, bytes) else json.dumps(values, separators=(",", ":")).encode("utf-8")
+            index.append(ENTRY.pack(_hash_bytes(key_hash), offset, len(key_bytes), len(value_bytes)))
+            blob.append(key_bytes)
+            blob.append(value_bytes)
+            offset += len(key_bytes) + len(value_bytes)
+        encoded[name] = (len(index), b"".join(index), b"".join(blob))
+
+    header = [MAGIC, struct.pack(">I", len(encoded))]
+    position = len(MAGIC) + 4 + sum(2 + len(name.encode("utf-8")) + SECTION.size for name in encoded)
+    for name, (count, index, blob) in encoded.items():
+        name_bytes = name.encode("utf-8")
+        header.append(struct.pack(">H", len(name_bytes)) + name_bytes + SECTION.pack(count, position, position + len(index)))
+        position += len(index) + len(blob)
+
+    with open(path, "wb") as f:
+        f.write(b"".join(header))
+        for _, index, blob in encoded.values():
+            f.write(index)
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+
+# A snapshot file mapped into memory. Its sections stay valid until close().
+class MappedSnapshot:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        # mmap cannot map an empty file; an empty snapshot is never written (the header is always there).
+        self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a snapshot file")
+        self.sections = {} #Store name -> SnapshotSection
+        (count,) = struct.unpack_from(">I", self.map, len(MAGIC))
+        position = len(MAGIC) + 4
+        for _ in range(count):
+            (name_length,) = struct.unpack_from(">H", self.map, position)
+            name = self.map[position + 2:position + 2 + name_length].decode("utf-8")
+            position += 2 + name_length
+            self.sections[name] = SnapshotSection(self.map, *SECTION.unpack_from(self.map, position))
+            position += SECTION.size
+
+    def section(self, name):
+        return self.sections.get(name)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+# The entries of one store in a mapped snapshot, in (hash, key) order. Read-only.
+class SnapshotSection:
+    def __init__(self, buffer, count, index_offset, blob_offset):
+        self.buffer = buffer #The mapped file
+        self.count = count #Number of entries
+        self.index_offset = index_offset
+        self.blob_offset = blob_offset
+        self.hashes = _HashColumn(self) #Sequence view of the entry hashes, for bisect
+
+    def __len__(self):
+        return self.count
+
+    def hash_bytes_at(self, i):
+        start = self.index_offset + i * ENTRY.size
+        return self.buffer[start:start + HASH_BYTES]
+
+    def hash_at(self, i):
+        return int.from_bytes(self.hash_bytes_at(i), "big")
+
+    def _entry(self, i):
+        _, offset, key_length, value_length = ENTRY.unpack_from(self.buffer, self.index_offset + i * ENTRY.size)
+        start = self.blob_offset + offset
+        return start, key_length, value_length
+
+    def key_at(self, i):
+        start, key_length, _ = self._entry(i)
+        return self.buffer[start:start + key_length].decode("utf-8")
+
+    # Values of entry i as the encoded JSON list.
+    def raw_values_at(self, i):
+        start, key_length, value_length = self._entry(i)
+        start += key_length
+        return self.buffer[start:start + value_length]
+
+    def values_at(self, i):
+        return json.loads(self.raw_values_at(i))
+
+    # Index of the first entry whose hash is greater than key_hash.
+    def bisect_right(self, key_hash):
+        if key_hash < 0: # Scans start before the first position
+            return 0
+        return bisect.bisect_right(self.hashes, _hash_bytes(key_hash))
+
+    # Index of the entry of key, or -1.
+    def find(self, key, key_hash):
+        target = _hash_bytes(key_hash)
+        i = bisect.bisect_left(self.hashes, target)
+        # Only different keys with the same hash share a position.
+        while i < self.count and self.hash_bytes_at(i) == target:
+            if self.key_at(i) == key:
+                return i
+            i += 1
+        return -1
+
+# Lets bisect search the hashes of a section without reading them into a list (big-endian bytes sort like the numbers).
+class _HashColumn:
+    def __init__(self, section):
+        self.section = section
+
+    def __len__(self):
+        return self.section.count
+
+    def __getitem__(self, i):
+        return self.section.hash_bytes_at(i)
@@ -0,0 +1,429 @@
+# store.py
+import bisect
+import heapq
+import itertools
+import threading
+from values import ValueList
+from merkle import MerkleTree, key_digest, value_digest
+
+# Key-value store of a node (data_store and replica_store) that keeps its keys sorted by their cached hash, so a ring
+# range is cut out with two bisections. It behaves like a dict of ValueList objects.
+
+class HashIndexedStore:
+    def __init__(self, hash_function):
+        self.hash_function = hash_function #key -> position on the identifier circle
+        self.data = {} #key -> value (keys written since the snapshot when there is a base)
+        self.key_hashes = {} #key -> cached hash
+        self.sorted_hashes = [] #Hashes of the keys of data, sorted
+        self.sorted_keys = [] #Keys in the same order as sorted_hashes
+        self.lock = threading.RLock() #Guards the dict, the index and the base together
+        self.journal = None #Write-ahead log (persistence.PersistenceEngine), None keeps the store in memory only
+        self.journal_name = None #Name of this store in the log records
+        self.index_stale = False #The sorted index misses changes applied by a log replay
+        self.base = None #Read-only snapshot section (snapshot.SnapshotSection) below the dict, None if there is none
+        self.shadowed = set() #Base keys that were written (now in data) or removed
+        self.tree = MerkleTree() #Digests of the keys by hash bucket (merkle.py)
+        self.tree_stale = False #The tree misses changes applied by a bulk load, a log replay or a new base
+        self.watchers = {} #Name -> keys changed since watch(name), for the key handoffs in progress
+
+    # Record every following change of the store in journal, under the given store name.
+    def attach_journal(self, journal, name):
+        self.journal = journal
+        self.journal_name = name
+
+    # Use a mapped snapshot section as the base layer of the (empty) store.
+    def attach_base(self, section):
+        with self.lock:
+            self.base = section
+            self.shadowed = set()
+            self.tree_stale = True
+
+    # Append a log record (called with the lock held). Returns its sequence number, or None without a journal.
+    def _log(self, op, *args):
+        if self.journal is None:
+            return None
+        return self.journal.append([op, self.journal_name, *args])
+
+    # Start recording the keys that change, under name.
+    def watch(self, name):
+        with self.lock:
+            self.watchers[name] = set()
+
+    # Stop recording under name and return the keys changed since watch(name).
+    def unwatch(self, name):
+        with self.lock:
+            return self.watchers.pop(name, set())
+
+    # XOR digest into the Merkle tree at the bucket of key, and record the change for the watchers (lock held).
+    def _track(self, key, digest):
+        for keys in self.watchers.values():
+            keys.add(key)
+        if digest and not self.tree_stale:
+            self.tree.toggle(self.hash_of(key), digest)
+
+    # The Merkle tree of the store, rebuilt from every key if it is stale.
+    def merkle_tree(self):
+        with self.lock:
+            if self.tree_stale:
+                if self.index_stale:
+                    self.rebuild_index()
+                self.tree.reset()
+                for key_hash, key in zip(self.sorted_hashes, self.sorted_keys):
+                    self.tree.toggle(key_hash, key_digest(key, self.data[key]))
+                if self.base is not None:
+                    for key_hash, key, i in self._base_entries(0, len(self.base)):
+                        self.tree.toggle(key_hash, key_digest(key, self.base.values_at(i)))
+                self.tree_stale = False
+            return self.tree
+
+    # Wait until the record with the given sequence number is durable (called without the lock).
+    def _sync(self, seq):
+        if seq is not None:
+            self.journal.wait_durable(seq)
+
+    # Cached hash of a stored key (computed for keys that are not stored).
+    def hash_of(self, key):
+        key_hash = self.key_hashes.get(key)
+        return key_hash if key_hash is not None else self.hash_function(key)
+
+    # Position of a key in the base, or -1 if it is not there (or shadowed).
+    def _base_index(self, key):
+        if self.base is None or key in self.shadowed:
+            return -1
+        return self.base.find(key, self.hash_of(key))
+
+    # Position of a stored key in the sorted index.
+    def _position(self, key, key_hash):
+        i = bisect.bisect_left(self.sorted_hashes, key_hash)
+        while self.sorted_keys[i] != key: # Only different keys with the same hash share a position
+            i += 1
+        return i
+
+    # Index slices [lo, hi) that hold the hashes of the ring range (start, end].
+    # start == end means the whole ring, like Node.in_interval.
+    @staticmethod
+    def _slices(hashes, bisect_right, start, end):
+        lo = bisect_right(start)
+        hi = bisect_right(end)
+        if start < end:
+            return [(lo, hi)]
+        # The range wraps around 0: the tail of the index and then its head.
+        return [(lo, len(hashes)), (0, hi)]
+
+    def _range_slices(self, start, end):
+        return self._slices(self.sorted_hashes, lambda h: bisect.bisect_right(self.sorted_hashes, h), start, end)
+
+    # (hash, key, index) of the base entries in the slice [lo, hi) that are not shadowed.
+    def _base_entries(self, lo, hi):
+        for i in range(lo, hi):
+            key = self.base.key_at(i)
+            if key not in self.shadowed:
+                yield self.base.hash_at(i), key, i
+
+    # (hash, key, base index or None) of the keys whose hash is in (start, end], in ring order (lock held).
+    def _range_entries(self, start, end):
+        entries = []
+        base_slices = self._slices(self.base, self.base.bisect_right, start, end) if self.base is not None else None
+        for part, (lo, hi) in enumerate(self._range_slices(start, end)):
+            overlay = [(self.sorted_hashes[i], self.sorted_keys[i], None) for i in range(lo, hi)]
+            if base_slices is None:
+                entries.extend(overlay)
+            else:
+                # Both slices cover the same hashes: merge them (a key is never in both).
+                entries.extend(heapq.merge(overlay, self._base_entries(*base_slices[part]), key=lambda e: (e[0], e[1])))
+        return entries
+
+    # Keys whose hash is in (start, end], in ring order.
+    def keys_in_range(self, start, end):
+        with self.lock:
+            return [key for _, key, _ in self._range_entries(start, end)]
+
+    # Up to limit (key, value, hash) entries whose hash is greater than after_hash, in hash order.
+    # Used to scan the store page by page: the hash of the last entry is where the next page starts.
+    def scan(self, after_hash, limit):
+        with self.lock:
+            lo = bisect.bisect_right(self.sorted_hashes, after_hash)
+            entries = [(self.sorted_hashes[i], key, None) for i, key in enumerate(self.sorted_keys[lo:lo + limit], lo)]
+            if self.base is not None:
+                base = []
+                for entry in self._base_entries(self.base.bisect_right(after_hash), len(self.base)):
+                    base.append(entry)
+                    if len(base) == limit:
+                        break
+                entries = list(heapq.merge(entries, base, key=lambda e: (e[0], e[1])))[:limit]
+            return [(key, self._value(key, i), key_hash) for key_hash, key, i in entries]
+
+    # Up to limit (key, value, hash) entries whose hash is in the ring range (after, end], in ring order.
+    # Used to stream a range in chunks: the hash of the last entry is where the next chunk starts.
+    def range_page(self, after, end, limit):
+        with self.lock:
+            entries = []
+            base_slices = self._slices(self.base, self.base.bisect_right, after, end) if self.base is not None else None
+            for part, (lo, hi) in enumerate(self._range_slices(after, end)):
+                page = [(self.sorted_hashes[i], self.sorted_keys[i], None) for i in range(lo, min(hi, lo + limit))]
+                if base_slices is not None:
+                    base = itertools.islice(self._base_entries(*base_slices[part]), limit)
+                    page = heapq.merge(page, base, key=lambda e: (e[0], e[1]))
+                entries.extend(itertools.islice(page, limit - len(entries)))
+                if len(entries) >= limit:
+                    break
+            return [(key, self._value(key, i), key_hash) for key_hash, key, i in entries]
+
+    # Value of a key of the dict (i is None) or of the base entry i.
+    def _value(self, key, i):
+        return self.data[key] if i is None else ValueList(self.base.values_at(i))
+
+    # Remove all keys whose hash is in (start, end] and return them as a dict.
+    def pop_range(self, start, end):
+        with self.lock:
+            moved = {}
+            if self.base is not None:
+                for _, key, i in self._range_entries(start, end):
+                    if i is not None:
+                        moved[key] = ValueList(self.base.values_at(i))
+                        self.shadowed.add(key)
+            # Remove the later slice first so the positions of the earlier one stay valid.
+            for lo, hi in sorted(self._range_slices(start, end), reverse=True):
+                if lo >= hi:
+                    continue
+                for key in self.sorted_keys[lo:hi]:
+                    moved[key] = self.data.pop(key)
+                    del self.key_hashes[key]
+                del self.sorted_hashes[lo:hi]
+                del self.sorted_keys[lo:hi]
+            for key, value in moved.items():
+                self._track(key, key_digest(key, value))
+            seq = self._log("del_range", start, end) if moved else None
+        self._sync(seq)
+        return moved
+
+    # Remove every key and return them as a dict.
+    def drain(self):
+        with self.lock:
+            moved = dict(self.items())
+            self.data = {}
+            self.key_hashes = {}
+            self.sorted_hashes = []
+            self.sorted_keys = []
+            self.base = None
+            self.shadowed = set()
+            self.tree.reset()
+            self.tree_stale = False
+            seq = self._log("clear") if moved else None
+        self._sync(seq)
+        return moved
+
+    # Add a key to the dict and the index (lock held, no log record). A base key becomes shadowed.
+    def _set(self, key, value):
+        if key not in self.data:
+            if self._base_index(key) >= 0:
+                self.shadowed.add(key)
+            key_hash = self.hash_function(key)
+            i = bisect.bisect_right(self.sorted_hashes, key_hash)
+            self.sorted_hashes.insert(i, key_hash)
+            self.sorted_keys.insert(i, key)
+            self.key_hashes[key] = key_hash
+        self.data[key] = value
+
+    # Copy a base key into the dict before it is modified (lock held).
+    def _materialize(self, key):
+        if key not in self.data:
+            i = self._base_index(key)
+            if i >= 0:
+                self._set(key, ValueList(self.base.values_at(i)))
+
+    # Remove a key from the dict and the index, or shadow it in the base (lock held, no log record).
+    def _delete(self, key):
+        if key not in self.data:
+            i = self._base_index(key)
+            if i < 0:
+                raise KeyError(key)
+            self.shadowed.add(key)
+            return ValueList(self.base.values_at(i))
+        value = self.data.pop(key)
+        key_hash = self.key_hashes.pop(key)
+        i = self._position(key, key_hash)
+        del self.sorted_hashes[i]
+        del self.sorted_keys[i]
+        return value
+
+    # Append a value to a key (repeated values are kept). Returns "updated" or "inserted".
+    def add_value(self, key, value):
+        with self.lock:
+            self._materialize(key)
+            if key in self.data:
+                # A repeated value leaves the digest unchanged, but the key still changed for the watchers
+                self._track(key, value_digest(key, value) if value not in self.data[key] else 0)
+                self.data[key].append(value)
+                status = "updated"
+            else:
+                self._set(key, ValueList([value]))
+                self._track(key, key_digest(key, [value]))
+                status = "inserted"
+            seq = self._log("append", key, value)
+        self._sync(seq)
+        return status
+
+    # Add the values that a key does not hold yet (replicated writes). Returns the number of values added.
+    def merge_values(self, key, values):
+        with self.lock:
+            self._materialize(key)
+            if key in self.data:
+                existing = self.data[key]
+                for value in {value for value in values if value not in existing}:
+                    self._track(key, value_digest(key, value))
+                added = existing.merge(values)
+            else:
+                self._set(key, ValueList(values))
+                self._track(key, key_digest(key, values))
+                added = len(values)
+            seq = self._log("merge", key, list(values)) if added else None
+        self._sync(seq)
+        return added
+
+    # Digest change of replacing the values of key by value (lock held).
+    def _replaced(self, key, value):
+        old = self.get(key)
+        return (key_digest(key, old) if old is not None else 0) ^ key_digest(key, value)
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self._track(key, self._replaced(key, value))
+            self._set(key, value)
+            seq = self._log("set", key, value.to_list())
+        self._sync(seq)
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    _MISSING = object()
+
+    def pop(self, key, default=_MISSING):
+        with self.lock:
+            if key not in self:
+                if default is HashIndexedStore._MISSING:
+                    raise KeyError(key)
+                return default
+            value = self._delete(key)
+            self._track(key, key_digest(key, value))
+            seq = self._log("del", key)
+        self._sync(seq)
+        return value
+
+    # Values of a base key are decoded from the snapshot on every read; they are only copied into the dict on writes.
+    def get(self, key, default=None):
+        value = self.data.get(key)
+        if value is not None or self.base is None:
+            return value if value is not None else default
+        with self.lock:
+            i = self._base_index(key)
+            return ValueList(self.base.values_at(i)) if i >= 0 else default
+
+    def update(self, other):
+        seq = None
+        with self.lock:
+            for key, value in other.items():
+                self._track(key, self._replaced(key, value))
+                self._set(key, value)
+                seq = self._log("set", key, value.to_list())
+        self._sync(seq)
+
+    def clear(self):
+        self.drain()
+
+    def __contains__(self, key):
+        if key in self.data:
+            return True
+        if self.base is None:
+            return False
+        with self.lock:
+            return self._base_index(key) >= 0
+
+    def __len__(self):
+        with self.lock:
+            return len(self.data) + (len(self.base) - len(self.shadowed) if self.base is not None else 0)
+
+    # Iteration works on a snapshot, so other threads may modify the store meanwhile.
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [key for key, _ in self.items()]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def items(self):
+        with self.lock:
+            items = list(self.data.items())
+            if self.base is not None:
+                items.extend((key, ValueList(self.base.values_at(i))) for _, key, i in self._base_entries(0, len(self.base)))
+            return items
+
+    # Every entry as (hash, key, values) in hash order, for writing a snapshot (lock held by the caller).
+    # Values of base keys are copied as their encoded JSON list.
+    def snapshot_entries(self):
+        overlay = [(self.sorted_hashes[i], key, self.data[key].to_list()) for i, key in enumerate(self.sorted_keys)]
+        if self.base is None:
+            return overlay
+        base = [(key_hash, key, bytes(self.base.raw_values_at(i))) for key_hash, key, i in self._base_entries(0, len(self.base))]
+        return list(heapq.merge(overlay, base, key=lambda e: (e[0], e[1])))
+
+    # Bulk load of the (empty) store from a JSON snapshot: the index is sorted once instead of key by key.
+    def load(self, entries):
+        with self.lock:
+            for key, value in entries.items():
+                self.data[key] = value
+                self.key_hashes[key] = self.hash_function(key)
+            self.rebuild_index()
+            self.tree_stale = True
+
+    # Sort the index from the cached key hashes.
+    def rebuild_index(self):
+        with self.lock:
+            pairs = sorted((key_hash, key) for key, key_hash in self.key_hashes.items())
+            self.sorted_hashes = [key_hash for key_hash, _ in pairs]
+            self.sorted_keys = [key for _, key in pairs]
+            self.index_stale = False
+
+    # Apply a record of the write-ahead log during recovery (the store has no journal attached then).
+    # The index is rebuilt before a range record and by rebuild_index() when the replay is over.
+    def apply(self, op, args):
+        self.tree_stale = True
+        if op in ("append", "merge", "set"):
+            key, value = args
+            if key not in self.data:
+                i = self._base_index(key)
+                if i >= 0:
+                    self.shadowed.add(key)
+                self.data[key] = ValueList(self.base.values_at(i)) if i >= 0 else ValueList()
+                self.key_hashes[key] = self.hash_function(key)
+                self.index_stale = True
+            if op == "append":
+                self.data[key].append(value)
+            elif op == "merge":
+                self.data[key].merge(value)
+            else:
+                self.data[key] = ValueList(value)
+        elif op == "del":
+            key = args[0]
+            if self.data.pop(key, None) is not None:
+                del self.key_hashes[key]
+                self.index_stale = True
+            elif self._base_index(key) >= 0:
+                self.shadowed.add(key)
+        elif op in ("del_range", "clear"):
+            if self.index_stale:
+                self.rebuild_index()
+            if op == "del_range":
+                self.pop_range(*args)
+            else:
+                self.drain()
+        else:
+            raise ValueError(f"Unknown log operation: {op}")
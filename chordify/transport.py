@@ -0,0 +1,118 @@
+# transport.py
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+CONNECT_TIMEOUT = 3.0 # Default connect timeout (seconds) of inter-node requests
+READ_TIMEOUT = 30.0 # Default read timeout (seconds), so a peer that hangs cannot block its caller forever
+
+# Shared HTTP transport for all inter-node RPC: one keep-alive requests.Session per peer, with the configured
+# (connect, read) timeouts as default.
+
+class Transport:
+    def __init__(self, pool_size=10, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+        self.pool_size = pool_size #Maximum number of kept-alive connections per peer
+        self.connect_timeout = connect_timeout #Default connect timeout in seconds
+        self.read_timeout = read_timeout #Default read timeout in seconds
+        self.sessions = {} #One session (and connection pool) per peer "ip:port"
+        self.sessions_lock = threading.Lock() #Lock for the sessions dict
+        self.errors = 0 #Number of requests that raised an exception
+        self.errors_lock = threading.Lock() #Requests fail concurrently from many threads
+        self.async_peers = {} #Peer "ip:port" -> requests, connections opened and errors of the asyncio runtime
+
+    # Update the pool size and default timeouts. Existing sessions are closed so the new pool size applies.
+    def configure(self, pool_size=None, connect_timeout=None, read_timeout=None):
+        if pool_size is not None:
+            self.pool_size = pool_size
+        if connect_timeout is not None:
+            self.connect_timeout = connect_timeout
+        if read_timeout is not None:
+            self.read_timeout = read_timeout
+        with self.sessions_lock:
+            sessions, self.sessions = self.sessions, {}
+        for session in sessions.values():
+            session.close()
+
+    # Return the session of the peer that serves url, creating it on first use.
+    def _session(self, url):
+        peer = urlsplit(url).netloc
+        session = self.sessions.get(peer)
+        if session is None:
+            with self.sessions_lock:
+                session = self.sessions.get(peer)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self.sessions[peer] = session
+        return session
+
+    def request(self, method, url, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        try:
+            return self._session(url).request(method, url, timeout=timeout, **kwargs)
+        except Exception:
+            with self.errors_lock:
+                self.errors += 1
+            raise
+
+    # Count requests, opened connections or errors of the asyncio runtime for peer.
+    def count_async(self, peer, requests=0, opened=0, errors=0):
+        with self.errors_lock:
+            counts = self.async_peers.setdefault(peer, {"requests": 0, "connections_opened": 0})
+            counts["requests"] += requests
+            counts["connections_opened"] += opened
+            self.errors += errors
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    # Connection reuse metrics per peer: how many requests were sent and how many TCP connections were opened.
+    def stats(self):
+        peers = {}
+        with self.sessions_lock:
+            sessions = dict(self.sessions)
+        for peer, session in sessions.items():
+            requests_sent = 0
+            connections_opened = 0
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for pool_key in pools.keys():
+                    pool = pools.get(pool_key)
+                    if pool is not None:
+                        requests_sent += pool.num_requests
+                        connections_opened += pool.num_connections
+            peers[peer] = {
+                "requests": requests_sent,
+                "connections_opened": connections_opened
+            }
+        with self.errors_lock:
+            async_peers = {peer: dict(counts) for peer, counts in self.async_peers.items()}
+            errors = self.errors
+        for peer, counts in async_peers.items():
+            totals = peers.setdefault(peer, {"requests": 0, "connections_opened": 0})
+            totals["requests"] += counts["requests"]
+            totals["connections_opened"] += counts["connections_opened"]
+        for totals in peers.values():
+            totals["connections_reused"] = max(totals["requests"] - totals["connections_opened"], 0)
+        total_requests = sum(p["requests"] for p in peers.values())
+        total_opened = sum(p["connections_opened"] for p in peers.values())
+        return {
+            "pool_size": self.pool_size,
+            "connect_timeout": self.connect_timeout,
+            "read_timeout": self.read_timeout,
+            "requests": total_requests,
+            "connections_opened": total_opened,
+            "reuse_ratio": round(1 - total_opened / total_requests, 3) if total_requests else 0,
+            "errors": errors,
+            "peers": peers
+        }
+
+# Shared instance used by the Node and the route handlers.
+transport = Transport()
@@ -0,0 +1,79 @@
+# values.py
+
+# Separator used to present the values of a key to clients ("value1 | value2 | ...").
+SEPARATOR = " | "
+
+# Value container for one key of data_store / replica_store: an ordered list plus a membership set.
+# The " | " string is only built at the API boundary (str()) and cached until the next append.
+
+class ValueList:
+    __slots__ = ("values", "members", "_joined")
+
+    def __init__(self, values=()):
+        self.values = list(values) #Values in insertion order
+        self.members = set(self.values) #Distinct values, for O(1) membership checks
+        self._joined = None #Cached " | " representation
+
+    # Build a container from what another node sent: a list of values, a single value or another container.
+    @classmethod
+    def from_wire(cls, data):
+        if isinstance(data, ValueList):
+            return cls(data.values)
+        if isinstance(data, (list, tuple)):
+            return cls(data)
+        return cls([data])
+
+    # Append a value, even if it is already present (repeated inserts at the primary are kept).
+    def append(self, value):
+        self.values.append(value)
+        self.members.add(value)
+        self._joined = None
+
+    # Append a value only if it is not present yet. Returns True if it was added.
+    def add(self, value):
+        if value in self.members:
+            return False
+        self.append(value)
+        return True
+
+    # Add every value that is not present yet, keeping their order. Returns the number of values added.
+    def merge(self, values):
+        return sum(1 for value in values if self.add(value))
+
+    def to_list(self):
+        return list(self.values)
+
+    def __contains__(self, value):
+        return value in self.members
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __eq__(self, other):
+        if isinstance(other, ValueList):
+            return self.values == other.values
+        return NotImplemented
+
+    def __str__(self):
+        if self._joined is None:
+            self._joined = SEPARATOR.join(str(value) for value in self.values)
+        return self._joined
+
+    def __repr__(self):
+        return f"ValueList({self.values!r})"
+
+
+# Store contents as clients see them: key -> "value1 | value2 | ..."
+def store_to_display(store):
+    return {key: str(values) for key, values in store.items()}
+
+# Store contents as nodes exchange them: key -> [value1, value2, ...]
+def store_to_wire(store):
+    return {key: values.to_list() for key, values in store.items()}
+
+# Inverse of store_to_wire, also accepting single values.
+def store_from_wire(data):
+    return {key: ValueList.from_wire(values) for key, values in data.items()}
@@ -0,0 +1,72 @@
+# vnodes.py
+import bisect
+from hashing import compute_hash
+
+VNODES = 1 # Default number of ring positions (tokens) of a physical node
+RING_SIZE = 2 ** 160 # Size of the identifier circle (SHA1)
+
+# Virtual nodes: every physical node owns `vnodes` tokens on the identifier circle, its id and the hashes of
+# "ip:port#i". A view entry without "tokens" has its id as only token.
+
+# Tokens of a node: its id first, then the hashes of "ip:port#i".
+def node_tokens(node_id, ip, port, count=VNODES):
+    return [node_id] + [compute_hash(f"{ip}:{port}#{i}") for i in range(1, count)]
+
+def tokens_of(node):
+    return node.get("tokens") or [node["id"]]
+
+# True if any node of the ring has more than one token.
+def has_vnodes(ring):
+    return any(len(tokens_of(node)) > 1 for node in ring)
+
+# Sorted tokens of the ring and the node ({"id", "ip", "port"}) that owns each of them.
+def token_ring(ring):
+    pairs = sorted((token, node["id"], node) for node in ring for token in tokens_of(node))
+    return [token for token, _, _ in pairs], [{"id": node["id"], "ip": node["ip"], "port": node["port"]} for _, _, node in pairs]
+
+# Index of the token responsible for key_hash (first token >= key_hash, wrapping around).
+def owner_index(token_ids, key_hash):
+    return bisect.bisect_left(token_ids, key_hash) % len(token_ids)
+
+# The first count distinct physical nodes met walking the token ring from index (backwards with direction -1).
+def walk(token_ids, owners, index, count, direction=1):
+    nodes = []
+    for step in range(len(token_ids)):
+        node = owners[(index + direction * step) % len(token_ids)]
+        if all(node["id"] != other["id"] for other in nodes):
+            nodes.append(node)
+            if len(nodes) == count:
+                break
+    return nodes
+
+# Nodes other than node_id within count distinct nodes before or after one of its tokens on the ring (which includes
+# node_id): the nodes whose primary ranges or replica holders change when node_id joins or departs.
+def neighbours(ring, node_id, count):
+    token_ids, owners = token_ring(ring)
+    nodes = {}
+    for i, owner in enumerate(owners):
+        if owner["id"] == node_id:
+            for direction in (1, -1):
+                for node in walk(token_ids, owners, i, count + 1, direction):
+                    nodes.setdefault(node["id"], node)
+    nodes.pop(node_id, None)
+    return list(nodes.values())
+
+# Ring ranges (start, end] of the tokens, each with the distinct physical nodes that hold it (owner first).
+def token_ranges(token_ids, owners, count):
+    return [(token_ids[i - 1], token_ids[i], walk(token_ids, owners, i, count)) for i in range(len(token_ids))]
+
+# (start, end] ranges of node_id for each of its tokens in the ring.
+def ranges_of(token_ids, owners, node_id):
+    return [(token_ids[i - 1], token_ids[i]) for i in range(len(token_ids)) if owners[i]["id"] == node_id]
+
+# Node id -> fraction of the identifier circle the node is primary for.
+def ring_shares(ring):
+    if not ring:
+        return {}
+    token_ids, owners = token_ring(ring)
+    shares = {}
+    for i, token in enumerate(token_ids):
+        arc = (token - token_ids[i - 1]) % RING_SIZE or RING_SIZE # A single token owns the whole circle
+        shares[owners[i]["id"]] = shares.get(owners[i]["id"], 0) + arc / RING_SIZE
+    return shares